@@ -0,0 +1,14 @@
+import logging
+
+from taxipassengers_backend import celery
+from taxipassengers_backend.app import create_app
+from taxipassengers_backend.async_worker import AsyncWorker
+from taxipassengers_backend.task import init_celery
+
+app = create_app()
+
+init_celery(celery, app)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    AsyncWorker(app).run()
@@ -0,0 +1,77 @@
+import random
+import statistics
+import string
+import time
+from datetime import datetime, timedelta
+
+from taxipassengers_backend.app import create_app
+from taxipassengers_backend.models import PassengerModel
+
+
+def benchmark_app(db_file):
+    """
+    Application using its own SQLite file, so benchmarks don't touch the
+    development database
+    """
+    application = create_app()
+    application.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_file}'
+    application.app_context().push()
+    application.db.create_all()
+    return application
+
+
+def random_word(length):
+    return ''.join(random.choices(string.ascii_lowercase, k=length))
+
+
+def seed_passengers(db, count, days=365, start_id=1, batch_size=10000):
+    """
+    Insert count passengers with signups spread over the last days
+    """
+    now = datetime.utcnow()
+    table = PassengerModel.__table__
+    for offset in range(0, count, batch_size):
+        rows = []
+        for number in range(start_id + offset,
+                            start_id + min(offset + batch_size, count)):
+            rows.append({
+                'authId': number,
+                'firstName': random_word(7).title(),
+                'lastName': random_word(9).title(),
+                'email': f'{random_word(8)}{number}@example.com',
+                'phoneNumber': f'080{number:08d}',
+                'emailStatus': random.randint(0, 1),
+                'phoneNumberStatus': random.randint(0, 1),
+                'suspendedAt': now if random.random() < 0.05 else None,
+                'timestamp': now - timedelta(seconds=random.randint(
+                    0, days * 24 * 3600)),
+            })
+        db.session.execute(table.insert(), rows)
+        db.session.commit()
+
+
+def timings(func, rounds):
+    """
+    Run func rounds times and return the p50 and p95 latency in ms
+    """
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'p50': statistics.median(samples),
+        'p95': samples[int(len(samples) * 0.95) - 1],
+    }
+
+
+def rss_mb(pid):
+    """
+    Resident memory of a process in MB
+    """
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0
@@ -0,0 +1,208 @@
+"""
+End to end throughput of the notification pipeline, as the API sends the
+notifications: queue_notification writing them to the outbox, a
+dispatcher draining it into send_batch tasks through a broker, a worker
+consuming the sms and email queues and the stub gateway. The messages
+are offered at RATE per second, each committed as a request commits it,
+and timed from the commit to the gateway answering them.
+
+The dispatcher and the worker run in this process: a solo Celery worker,
+or the asyncio worker. The dispatcher drains the outbox every
+OUTBOX_POLL_INTERVAL seconds, as `flask outbox dispatch --follow`. The
+broker is in memory by default, or a local one, e.g. --broker
+amqp://localhost:5672. The rate limits of the channels are off, so the
+pipeline is measured rather than the limits. CPU is the time of this
+process, the worker, the dispatcher and the sending loop; RSS is at the
+end of the run.
+
+Run from the project directory:
+
+    python -m benchmarks.notification_pipeline --latency 0.05
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import requests
+from celery.contrib.testing.worker import start_worker
+
+from taxipassengers_backend import celery, delivery, task
+from taxipassengers_backend.async_worker import AsyncWorker
+from taxipassengers_backend.outbox import (OUTBOX_POLL_INTERVAL, drain,
+                                           queue_notification)
+from taxipassengers_backend.stub_gateway import stub_gateway
+from taxipassengers_backend.task import init_celery
+
+from .common import benchmark_app, rss_mb
+
+MESSAGES = 1000
+RATE = 200
+GATEWAY_LATENCY = 0.05
+ERROR_RATE = 0
+WORKERS = ('celery', 'asyncio')
+BROKER = 'memory://'
+# Seconds to wait for the messages retried after the last one was sent
+TIMEOUT = 120
+
+
+def notification(number):
+    return {
+        'phoneNumber': f'080{number:08d}',
+        'email': f'passenger{number}@example.com',
+        'subject': 'Welcome',
+        'typeMessage': 'Welcome Message',
+        'Authorization': 'Bearer benchmark',
+    }
+
+
+def settled():
+    """
+    Messages sent or dead lettered, over both channels
+    """
+    return sum(metrics['sent'] + metrics['deadLettered']
+               for metrics in delivery.metrics().values())
+
+
+def dispatch(application, interval, stopping):
+    """
+    Drain the outbox every interval seconds, until stopping is set
+    """
+    with application.app_context():
+        while not stopping.is_set():
+            drain()
+            stopping.wait(interval)
+
+
+def offer(application, messages, rate, interval, sent_at):
+    stopping = threading.Event()
+    dispatcher = threading.Thread(target=dispatch,
+                                  args=(application, interval, stopping))
+    dispatcher.start()
+
+    began = time.perf_counter()
+    with application.app_context():
+        for number in range(messages):
+            data = notification(number)
+            queue_notification(data, 'Welcome to LAMATA',
+                               'Welcome to LAMATA')
+            application.db.session.commit()
+            sent_at[data['phoneNumber']] = sent_at[data['email']] = \
+                time.time()
+            delay = began + (number + 1) / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    deadline = time.perf_counter() + TIMEOUT
+    while settled() < 2 * messages and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    stopping.set()
+    dispatcher.join()
+
+
+def run_worker(worker, application, messages, rate, interval, sent_at):
+    """
+    Offer the messages while the worker consumes them, returns the CPU
+    seconds of the run
+    """
+    cpu = time.process_time()
+    if worker == 'celery':
+        with start_worker(celery, pool='solo', queues=['sms', 'email'],
+                          perform_ping_check=False, loglevel='WARNING'):
+            offer(application, messages, rate, interval, sent_at)
+    else:
+        consumer = AsyncWorker(application, queues=['sms', 'email'])
+
+        def send():
+            offer(application, messages, rate, interval, sent_at)
+            consumer._loop.call_soon_threadsafe(consumer.stop)
+
+        # The worker runs the event loop of the main thread
+        sender = threading.Thread(target=send)
+        sender.start()
+        consumer.run()
+        sender.join()
+    return time.process_time() - cpu
+
+
+def percentile(samples, share):
+    return samples[max(int(len(samples) * share) - 1, 0)]
+
+
+def measure(worker, application, url, messages, rate, interval):
+    delivery.backend = delivery.LocalBackend()
+    sent_at = {}
+    began = time.time()
+    cpu = run_worker(worker, application, messages, rate, interval,
+                     sent_at)
+
+    stats = requests.get(f'{url}stats/').json()
+    delivered = stats['delivered']
+    latencies = sorted((answered - sent_at[key]) * 1000
+                       for key, answered in delivered.items()
+                       if key in sent_at)
+    finished = max(delivered.values(), default=began)
+    return {
+        'worker': worker,
+        'delivered': len(latencies),
+        'failed': stats['failed'],
+        'rate': len(latencies) / max(finished - began, 1e-9),
+        'p50': statistics.median(latencies) if latencies else 0,
+        'p95': percentile(latencies, 0.95) if latencies else 0,
+        'p99': percentile(latencies, 0.99) if latencies else 0,
+        'cpu': cpu,
+        'rss': rss_mb(os.getpid()),
+    }
+
+
+def run(workers=WORKERS, broker=BROKER, messages=MESSAGES, rate=RATE,
+        latency=GATEWAY_LATENCY, error_rate=ERROR_RATE,
+        interval=OUTBOX_POLL_INTERVAL):
+    for config in delivery.CHANNELS.values():
+        config['rate'] = 0
+    celery.conf.broker_url = broker
+    if broker.startswith('memory'):
+        celery.conf.broker_transport_options = {'polling_interval': 0.001}
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory, \
+            stub_gateway(latency, error_rate) as url:
+        task.SMS_URL = f'{url}api/me/message/'
+        task.EMAIL_URL = f'{url}api/me/mail/'
+        # The outbox and the dead letters are in the database
+        application = benchmark_app(os.path.join(directory, 'db.sqlite3'))
+        init_celery(celery, application)
+        for worker in workers:
+            results.append(measure(worker, application, url, messages,
+                                   rate, interval))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--worker', action='append', choices=WORKERS)
+    parser.add_argument('--broker', default=BROKER)
+    parser.add_argument('--messages', type=int, default=MESSAGES,
+                        help='Notifications, an SMS and an email each')
+    parser.add_argument('--rate', type=float, default=RATE,
+                        help='Notifications offered per second')
+    parser.add_argument('--latency', type=float, default=GATEWAY_LATENCY)
+    parser.add_argument('--error-rate', type=float, default=ERROR_RATE)
+    parser.add_argument('--interval', type=float,
+                        default=OUTBOX_POLL_INTERVAL,
+                        help='Seconds between drains of the outbox')
+    args = parser.parse_args()
+
+    print(f'{"worker":>8} {"delivered":>10} {"failed":>7} '
+          f'{"messages":>10} {"p50":>9} {"p95":>9} {"p99":>9} '
+          f'{"cpu":>7} {"rss":>9}')
+    for result in run(args.worker or WORKERS, args.broker, args.messages,
+                      args.rate, args.latency, args.error_rate,
+                      args.interval):
+        print(f"{result['worker']:>8} {result['delivered']:>10} "
+              f"{result['failed']:>7} {result['rate']:>8.0f}/s "
+              f"{result['p50']:>7.0f}ms {result['p95']:>7.0f}ms "
+              f"{result['p99']:>7.0f}ms {result['cpu']:>6.1f}s "
+              f"{result['rss']:>7.1f}MB")
@@ -0,0 +1,112 @@
+"""
+Latency of the time-critical emails queued behind a backlog of bulk SMS,
+all the notification tasks on the one celery queue, or routed to the sms
+and email queues, each consumed by its own workers. The workers are
+threads consuming an in-memory broker, running a task by sleeping
+GATEWAY_LATENCY per message instead of posting it
+
+Run from the project directory:
+
+    python -m benchmarks.notification_queues
+"""
+import statistics
+import threading
+import time
+
+from kombu import Connection
+
+from taxipassengers_backend import celery, task
+
+BACKLOG = 100
+BATCH_SIZE = 10
+EMAILS = 50
+GATEWAY_LATENCY = 0.005
+WORKERS = 4
+SETUPS = {
+    # Queue of every task, and the queues of each group of workers
+    'shared': ('celery', [['celery']] * WORKERS),
+    'routed': (None, [['sms']] * (WORKERS // 2) +
+               [['email']] * (WORKERS // 2)),
+}
+SMS = {'phoneNumber': '08011112222', 'message': 'Service update'}
+EMAIL = {'emailAddress': 'ada@example.com', 'message': 'Your password'}
+HEADER = {'Authorization': 'Bearer benchmark'}
+
+
+def publish(broker, queue, queued):
+    with broker.clone() as connection:
+        producer = celery.amqp.Producer(connection)
+        options = {'queue': queue} if queue else {}
+        for _ in range(BACKLOG):
+            result = celery.send_task(task.send_batch.name, args=(
+                'sms', [SMS] * BATCH_SIZE, HEADER), producer=producer,
+                **options)
+            queued[result.id] = ('sms', time.perf_counter())
+        for _ in range(EMAILS):
+            result = celery.send_task(task.send_email.name, args=(
+                EMAIL, HEADER), producer=producer, **options)
+            queued[result.id] = ('email', time.perf_counter())
+
+
+def consume(broker, queues, queued, done, stopping):
+    def on_message(body, message):
+        args = body[0]
+        messages = args[1] if message.headers['task'] == \
+            task.send_batch.name else [args[0]]
+        time.sleep(GATEWAY_LATENCY * len(messages))
+        message.ack()
+        channel, enqueued = queued[message.headers['id']]
+        done.append((channel, time.perf_counter() - enqueued))
+
+    with broker.clone() as connection:
+        with connection.Consumer([celery.amqp.queues[name] for name in queues],
+                                 callbacks=[on_message],
+                                 accept=celery.conf.accept_content,
+                                 prefetch_count=1):
+            while not stopping.is_set():
+                try:
+                    connection.drain_events(timeout=0.01)
+                except OSError:
+                    pass
+
+
+def measure(queue, workers):
+    broker = Connection('memory://',
+                        transport_options={'polling_interval': 0.001})
+    queued, done = {}, []
+    publish(broker, queue, queued)
+
+    stopping = threading.Event()
+    threads = [threading.Thread(target=consume, args=(
+        broker, queues, queued, done, stopping)) for queues in workers]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    while len(done) < len(queued):
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - began
+    stopping.set()
+    for thread in threads:
+        thread.join()
+    broker.release()
+
+    emails = sorted(latency for channel, latency in done
+                    if channel == 'email')
+    return {
+        'email_p50': statistics.median(emails) * 1000,
+        'email_p95': emails[int(len(emails) * 0.95) - 1] * 1000,
+        'elapsed': elapsed,
+    }
+
+
+def run(setups=SETUPS):
+    return [dict(measure(queue, workers), setup=name)
+            for name, (queue, workers) in setups.items()]
+
+
+if __name__ == '__main__':
+    print(f'{"queues":>8} {"email p50":>12} {"email p95":>12} '
+          f'{"all done":>10}')
+    for result in run():
+        print(f"{result['setup']:>8} {result['email_p50']:>10.1f}ms "
+              f"{result['email_p95']:>10.1f}ms {result['elapsed']:>9.2f}s")
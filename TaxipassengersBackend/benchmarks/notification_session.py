@@ -0,0 +1,64 @@
+"""
+Notifications per second posted to a local stub gateway: requests.post
+opening a connection per message, as the tasks did before, or the pooled
+keep-alive session of the worker process
+
+Run from the project directory:
+
+    python -m benchmarks.notification_session
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from taxipassengers_backend import gateway
+from taxipassengers_backend.stub_gateway import stub_gateway
+
+MESSAGES = 2000
+THREADS = (1, 4)
+MESSAGE = {
+    'phoneNumber': '08011112222',
+    'message': 'Hi Ada, Welcome to the Lagos State Intermodal System.',
+    'typeMessage': 'Welcome Message',
+}
+HEADER = {'Authorization': 'Bearer benchmark'}
+
+
+def post_unpooled(url, data, headers):
+    return requests.post(url=url, data=data, headers=headers)
+
+
+def messages_per_second(post, url, threads):
+    def send(_):
+        return post(url, MESSAGE, HEADER).ok
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        sent = sum(pool.map(send, range(MESSAGES)))
+    elapsed = time.perf_counter() - began
+    assert sent == MESSAGES
+    return MESSAGES / elapsed
+
+
+def run(threads=THREADS):
+    results = []
+    with stub_gateway() as url:
+        for count in threads:
+            unpooled = messages_per_second(post_unpooled, url, count)
+            gateway.init_session()
+            pooled = messages_per_second(gateway.post, url, count)
+            gateway.close_session()
+            results.append({
+                'threads': count,
+                'unpooled': unpooled,
+                'pooled': pooled,
+            })
+    return results
+
+
+if __name__ == '__main__':
+    print(f'{"threads":>8} {"unpooled":>12} {"pooled":>12}')
+    for result in run():
+        print(f"{result['threads']:>8} {result['unpooled']:>10.0f}/s "
+              f"{result['pooled']:>10.0f}/s")
@@ -0,0 +1,92 @@
+"""
+Messages per second and memory of the notification workers, delivering
+send_sms tasks to a local stub gateway answering after GATEWAY_LATENCY:
+a prefork pool running the Celery task in each process, or the asyncio
+worker consuming them from an in-memory broker. RSS is the sum over the
+worker processes, pages shared after the fork counted in every one
+
+Run from the project directory:
+
+    python -m benchmarks.notification_worker
+"""
+import multiprocessing
+import os
+import time
+
+from kombu import Connection
+
+from taxipassengers_backend import celery, delivery, task
+from taxipassengers_backend.async_worker import AsyncWorker
+from taxipassengers_backend.stub_gateway import stub_gateway
+from taxipassengers_backend.task import init_celery
+
+from .common import benchmark_app, rss_mb
+
+MESSAGES = 2000
+GATEWAY_LATENCY = 0.05
+PROCESSES = (4, 16)
+CONCURRENCY = (50, 200)
+MESSAGE = {
+    'phoneNumber': '08011112222',
+    'message': 'Hi Ada, Welcome to the Lagos State Intermodal System.',
+    'typeMessage': 'Welcome Message',
+}
+HEADER = {'Authorization': 'Bearer benchmark'}
+
+
+def send(_):
+    task.send_sms(MESSAGE, HEADER)
+    return os.getpid()
+
+
+def prefork(processes):
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        began = time.perf_counter()
+        pids = set(pool.map(send, range(MESSAGES), chunksize=1))
+        elapsed = time.perf_counter() - began
+        rss = sum(rss_mb(pid) for pid in pids)
+    return MESSAGES / elapsed, rss
+
+
+def asyncio_worker(application, concurrency):
+    broker = Connection('memory://')
+    with broker.clone() as connection:
+        producer = celery.amqp.Producer(connection)
+        for _ in range(MESSAGES):
+            celery.send_task(task.send_sms.name, args=(MESSAGE, HEADER),
+                             producer=producer)
+
+    worker = AsyncWorker(application, connection=broker,
+                         concurrency=concurrency, max_messages=MESSAGES)
+    began = time.perf_counter()
+    worker.run()
+    elapsed = time.perf_counter() - began
+    return MESSAGES / elapsed, rss_mb(os.getpid())
+
+
+def run(processes=PROCESSES, concurrency=CONCURRENCY):
+    # Measuring the workers, not the gateway limits
+    for config in delivery.CHANNELS.values():
+        config['rate'] = 0
+
+    results = []
+    with stub_gateway(latency=GATEWAY_LATENCY) as url:
+        task.SMS_URL = url
+        application = benchmark_app(':memory:')
+        init_celery(celery, application)
+        for count in processes:
+            rate, rss = prefork(count)
+            results.append({'worker': f'prefork {count}', 'rate': rate,
+                            'rss': rss})
+        for count in concurrency:
+            rate, rss = asyncio_worker(application, count)
+            results.append({'worker': f'asyncio {count}', 'rate': rate,
+                            'rss': rss})
+    return results
+
+
+if __name__ == '__main__':
+    print(f'{"worker":>12} {"messages":>12} {"rss":>10}')
+    for result in run():
+        print(f"{result['worker']:>12} {result['rate']:>10.0f}/s "
+              f"{result['rss']:>8.1f}MB")
@@ -0,0 +1,70 @@
+"""
+Time to suspend many passengers: one set-based update, or a load, change
+and commit per passenger as a PUT per passenger does
+
+Run from the project directory:
+
+    python -m benchmarks.passenger_bulk_suspend
+"""
+import tempfile
+import time
+from datetime import datetime
+
+from taxipassengers_backend.bulk import suspend_passengers
+from taxipassengers_backend.models import PassengerModel
+from taxipassengers_backend.stats import (passenger_state, rebuild_stats,
+                                          record_passenger_updated)
+
+from .common import benchmark_app, seed_passengers
+
+PASSENGERS = 50000
+SIZES = (100, 1000, 10000)
+
+
+def suspend_one_by_one(db, ids):
+    for passengerId in ids:
+        passenger = PassengerModel.query.get(passengerId)
+        if passenger.suspendedAt is not None:
+            continue
+        oldState = passenger_state(passenger)
+        passenger.suspendedAt = datetime.utcnow()
+        record_passenger_updated(passenger, oldState)
+        db.session.commit()
+
+
+def elapsed(func):
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+
+def run(passengers=PASSENGERS, sizes=SIZES):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        application = benchmark_app(f'{tmp}/bulk.sqlite3')
+        db = application.db
+        seed_passengers(db, passengers)
+        rebuild_stats()
+        db.session.commit()
+
+        for size in sizes:
+            ids = list(range(1, size + 1))
+            condition = PassengerModel.id.in_(ids)
+            # Every run starts from active passengers
+            suspend_passengers(condition, suspend=False)
+            set_based = elapsed(lambda: suspend_passengers(condition))
+            suspend_passengers(condition, suspend=False)
+            one_by_one = elapsed(lambda: suspend_one_by_one(db, ids))
+            results.append({
+                'size': size,
+                'set_based': set_based,
+                'one_by_one': one_by_one,
+            })
+    return results
+
+
+if __name__ == '__main__':
+    print(f'{"suspended":>10} {"set based":>12} {"one by one":>12}')
+    for result in run():
+        print(f"{result['size']:>10} {result['set_based']:>10.1f}ms "
+              f"{result['one_by_one']:>10.1f}ms")
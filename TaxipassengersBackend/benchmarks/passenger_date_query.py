@@ -0,0 +1,94 @@
+"""
+Queries and latency of /api/stat/datequery/ for growing date ranges, read
+from the daily stats rollup vs the previous query per day. The stats
+cache is off, so every request runs the query
+
+Run from the project directory:
+
+    python -m benchmarks.passenger_date_query
+"""
+import tempfile
+from datetime import date, timedelta
+
+from sqlalchemy import event, func
+
+from taxipassengers_backend import config
+from taxipassengers_backend.cache import LocalBackend, ResultCache
+from taxipassengers_backend.models import PassengerModel
+from taxipassengers_backend.stats import rebuild_stats
+from taxipassengers_backend.token import generate_token_header
+
+from .common import benchmark_app, seed_passengers, timings
+
+PASSENGERS = 50000
+RANGES = (30, 365, 1000)
+ROUNDS = 3
+
+
+def query_per_day(db, start_date, end_date):
+    result = {}
+    while start_date <= end_date:
+        passengers = (db.session.query(func.count(
+            PassengerModel.id)).filter(
+                func.date(PassengerModel.timestamp) == start_date).all())
+        result[start_date.strftime("%d/%m/%Y")] = passengers[0][0]
+        start_date = start_date + timedelta(days=1)
+    return result
+
+
+def run(passengers=PASSENGERS, ranges=RANGES, rounds=ROUNDS):
+    header = generate_token_header({'id': 1}, config.PRIVATE_KEY)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        application = benchmark_app(f'{tmp}/stats.sqlite3')
+        application.stats_cache = ResultCache(LocalBackend(maxsize=0))
+        db = application.db
+        client = application.test_client()
+        seed_passengers(db, passengers, days=1000)
+        rebuild_stats()
+        db.session.commit()
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        end_date = date.today()
+        for days in ranges:
+            start_date = end_date - timedelta(days=days - 1)
+            url = ('/api/stat/datequery/'
+                   f'?startdate={start_date.strftime("%d/%m/%Y")}'
+                   f'&enddate={end_date.strftime("%d/%m/%Y")}')
+
+            statements.clear()
+            grouped = timings(
+                lambda: client.get(url, headers={'Authorization': header}),
+                rounds)
+            grouped_queries = len(statements) // rounds
+
+            statements.clear()
+            per_day = timings(
+                lambda: query_per_day(db, start_date, end_date), rounds)
+            per_day_queries = len(statements) // rounds
+
+            results.append({
+                'days': days,
+                'grouped': grouped,
+                'grouped_queries': grouped_queries,
+                'per_day': per_day,
+                'per_day_queries': per_day_queries,
+            })
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return results
+
+
+if __name__ == '__main__':
+    print(f'{PASSENGERS} passengers')
+    print(f'{"days":>5} {"grouped q":>10} {"grouped p95":>12} '
+          f'{"per day q":>10} {"per day p95":>12}')
+    for result in run():
+        print(f"{result['days']:>5} {result['grouped_queries']:>10} "
+              f"{result['grouped']['p95']:>10.1f}ms "
+              f"{result['per_day_queries']:>10} "
+              f"{result['per_day']['p95']:>10.1f}ms")
@@ -0,0 +1,59 @@
+"""
+Peak memory of the streaming passenger export as the table grows
+
+Run from the project directory:
+
+    python -m benchmarks.passenger_export
+"""
+import tempfile
+import time
+import tracemalloc
+
+from taxipassengers_backend import config
+from taxipassengers_backend.token import generate_token_header
+
+from .common import benchmark_app, seed_passengers
+
+SIZES = (10000, 50000, 200000)
+
+
+def run(sizes=SIZES):
+    header = generate_token_header({'id': 1, 'admin': 1}, config.PRIVATE_KEY)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        application = benchmark_app(f'{tmp}/export.sqlite3')
+        client = application.test_client()
+        seeded = 0
+        for size in sizes:
+            seed_passengers(application.db, size - seeded,
+                            start_id=seeded + 1)
+            seeded = size
+            for export_format in ('ndjson', 'csv'):
+                tracemalloc.start()
+                start = time.perf_counter()
+                response = client.get(
+                    f'/api/passenger/export/?format={export_format}',
+                    headers={'Authorization': header})
+                exported = sum(len(chunk) for chunk in response.response)
+                response.close()
+                elapsed = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                results.append({
+                    'size': size,
+                    'format': export_format,
+                    'bytes': exported,
+                    'seconds': elapsed,
+                    'peak_kb': peak / 1024,
+                })
+    return results
+
+
+if __name__ == '__main__':
+    print(f'{"rows":>8} {"format":>7} {"MB out":>8} {"rows/s":>9} '
+          f'{"peak KB":>8}')
+    for result in run():
+        print(f"{result['size']:>8} {result['format']:>7} "
+              f"{result['bytes'] / 1e6:>8.1f} "
+              f"{result['size'] / result['seconds']:>9.0f} "
+              f"{result['peak_kb']:>8.0f}")
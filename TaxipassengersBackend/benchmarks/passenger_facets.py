@@ -0,0 +1,67 @@
+"""
+Latency of the passenger facet counts: added up from the daily stats,
+one conditional aggregation pass, or a count query per facet as the admin
+UI did before
+
+Run from the project directory:
+
+    python -m benchmarks.passenger_facets
+"""
+import tempfile
+
+from sqlalchemy import func
+
+from taxipassengers_backend.models import PassengerModel
+from taxipassengers_backend.stats import passenger_facets, rebuild_stats
+
+from .common import benchmark_app, seed_passengers, timings
+
+SIZES = (10000, 50000, 200000)
+ROUNDS = 10
+
+
+def count_per_facet(db):
+    count = db.session.query(func.count(PassengerModel.id))
+    return {
+        'total': count.scalar(),
+        'suspended': count.filter(
+            PassengerModel.suspendedAt != None).scalar(),  # noqa: E711
+        'active': count.filter(
+            PassengerModel.suspendedAt == None).scalar(),  # noqa: E711
+        'emailVerified': count.filter(
+            PassengerModel.emailStatus == 1).scalar(),
+        'phoneVerified': count.filter(
+            PassengerModel.phoneNumberStatus == 1).scalar(),
+    }
+
+
+def run(sizes=SIZES, rounds=ROUNDS):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        application = benchmark_app(f'{tmp}/facets.sqlite3')
+        db = application.db
+        seeded = 0
+        for size in sizes:
+            seed_passengers(db, size - seeded, start_id=seeded + 1)
+            seeded = size
+            rebuild_stats()
+            db.session.commit()
+
+            results.append({
+                'size': size,
+                'rollup': timings(passenger_facets, rounds),
+                'one_pass': timings(
+                    lambda: passenger_facets(db.session.query(
+                        PassengerModel)), rounds),
+                'per_facet': timings(lambda: count_per_facet(db), rounds),
+            })
+    return results
+
+
+if __name__ == '__main__':
+    print(f'{"passengers":>10} {"rollup p95":>12} {"one pass p95":>14} '
+          f'{"per facet p95":>14}')
+    for result in run():
+        print(f"{result['size']:>10} {result['rollup']['p95']:>10.1f}ms "
+              f"{result['one_pass']['p95']:>12.1f}ms "
+              f"{result['per_facet']['p95']:>12.1f}ms")
@@ -0,0 +1,82 @@
+"""
+Passenger import throughput, batched inserts vs one ORM object and commit
+per passenger
+
+Run from the project directory:
+
+    python -m benchmarks.passenger_import
+"""
+import json
+import tempfile
+import time
+
+from taxipassengers_backend.importer import import_passengers
+from taxipassengers_backend.models import PassengerModel
+from taxipassengers_backend.namespaces.api import importRowParser
+from taxipassengers_backend.stats import record_passenger_created
+
+from .common import benchmark_app, random_word
+
+PASSENGERS = 20000
+# The one by one baseline is slow, its rate is measured on fewer rows
+BASELINE_PASSENGERS = 2000
+BATCH_SIZES = (100, 1000, 5000)
+
+
+def rows(count, start_id):
+    for number in range(start_id, start_id + count):
+        yield {
+            'authId': number,
+            'first': random_word(7).title(),
+            'last': random_word(9).title(),
+            'email': f'{random_word(8)}{number}@example.com',
+            'phone': f'080{number:08d}',
+        }
+
+
+def one_by_one(db, count, start_id):
+    for row in rows(count, start_id):
+        passenger = PassengerModel(authId=row['authId'],
+                                   firstName=row['first'],
+                                   lastName=row['last'],
+                                   email=row['email'],
+                                   phoneNumber=row['phone'])
+        db.session.add(passenger)
+        db.session.flush()
+        record_passenger_created(passenger)
+        db.session.commit()
+
+
+def run(passengers=PASSENGERS, batch_sizes=BATCH_SIZES):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        application = benchmark_app(f'{tmp}/import.sqlite3')
+        db = application.db
+        start_id = 1
+
+        baseline = min(passengers, BASELINE_PASSENGERS)
+        started = time.perf_counter()
+        one_by_one(db, baseline, start_id)
+        results.append({'method': 'one by one', 'rows': baseline,
+                        'seconds': time.perf_counter() - started})
+        start_id += baseline
+
+        for batch_size in batch_sizes:
+            lines = [json.dumps(row) for row in rows(passengers, start_id)]
+            started = time.perf_counter()
+            result = import_passengers(lines, 'ndjson', importRowParser.args,
+                                       batch_size)
+            assert result.inserted == passengers
+            results.append({'method': f'batches of {batch_size}',
+                            'rows': passengers,
+                            'seconds': time.perf_counter() - started})
+            start_id += passengers
+    return results
+
+
+if __name__ == '__main__':
+    print(f'{"method":<18} {"rows":>8} {"seconds":>8} {"rows/s":>8}')
+    for result in run():
+        print(f"{result['method']:<18} {result['rows']:>8} "
+              f"{result['seconds']:>8.2f} "
+              f"{result['rows'] / result['seconds']:>8.0f}")
@@ -0,0 +1,61 @@
+"""
+Passenger search latency as the table grows, indexed search vs the
+previous ILIKE scan
+
+Run from the project directory:
+
+    python -m benchmarks.passenger_search
+"""
+import random
+import tempfile
+
+from taxipassengers_backend.models import PassengerModel
+from taxipassengers_backend.search import like_filter, search_passengers
+
+from .common import benchmark_app, random_word, seed_passengers, timings
+
+SIZES = (10000, 50000, 200000)
+ROUNDS = 50
+PAGE_SIZE = 50
+
+
+def run(sizes=SIZES, rounds=ROUNDS):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        application = benchmark_app(f'{tmp}/search.sqlite3')
+        db = application.db
+        seeded = 0
+        for size in sizes:
+            seed_passengers(db, size - seeded, start_id=seeded + 1)
+            seeded = size
+            terms = [random_word(4) for _ in range(rounds)]
+            columns = [PassengerModel.firstName, PassengerModel.lastName,
+                       PassengerModel.email, PassengerModel.phoneNumber]
+
+            def indexed():
+                query = search_passengers(PassengerModel.query,
+                                          random.choice(terms))
+                query.limit(PAGE_SIZE).all()
+
+            def scan():
+                query = PassengerModel.query.filter(
+                    like_filter(columns, random.choice(terms)))
+                query.order_by(PassengerModel.id).limit(PAGE_SIZE).all()
+
+            results.append({
+                'size': size,
+                'indexed': timings(indexed, rounds),
+                'scan': timings(scan, rounds),
+            })
+    return results
+
+
+if __name__ == '__main__':
+    print(f'{"rows":>8} {"indexed p50":>12} {"indexed p95":>12} '
+          f'{"scan p50":>9} {"scan p95":>9}')
+    for result in run():
+        print(f"{result['size']:>8} "
+              f"{result['indexed']['p50']:>10.2f}ms "
+              f"{result['indexed']['p95']:>10.2f}ms "
+              f"{result['scan']['p50']:>7.2f}ms "
+              f"{result['scan']['p95']:>7.2f}ms")
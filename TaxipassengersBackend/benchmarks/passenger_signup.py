@@ -0,0 +1,111 @@
+"""
+Throughput of concurrent passenger signups: a SELECT by authId before an
+ORM insert, as MePassenger.post did before, or a single INSERT ignoring
+the collisions. A quarter of the signups reuse a taken email address
+
+Run from the project directory:
+
+    python -m benchmarks.passenger_signup
+"""
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+
+from sqlalchemy.exc import IntegrityError
+
+from taxipassengers_backend.db import insert_returning
+from taxipassengers_backend.models import PassengerModel
+from taxipassengers_backend.stats import record_passenger_created
+
+from .common import benchmark_app
+
+SIGNUPS = 2000
+THREADS = (1, 4, 16)
+
+
+def signup_values(number):
+    email = number - 1 if number % 4 == 0 else number
+    return {
+        'authId': number,
+        'firstName': f'First{number}',
+        'lastName': f'Last{number}',
+        'email': f'signup{email}@example.com',
+        'phoneNumber': f'080{number:08d}',
+        'emailStatus': 1,
+        'timestamp': datetime.utcnow(),
+    }
+
+
+def create_checked(db, values):
+    if PassengerModel.query.filter(
+            PassengerModel.authId == values['authId']).first():
+        return False
+    passenger = PassengerModel(**values)
+    db.session.add(passenger)
+    try:
+        db.session.flush()
+        record_passenger_created(passenger)
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+        return False
+
+
+def create_upsert(db, values):
+    passenger = PassengerModel.__table__
+    row = insert_returning(passenger, values, list(passenger.c))
+    if row is None:
+        db.session.rollback()
+        return False
+    record_passenger_created(
+        SimpleNamespace(**dict(zip(passenger.c.keys(), row))))
+    db.session.commit()
+    return True
+
+
+def signups_per_second(application, create, start, threads):
+    db = application.db
+
+    def signup(number):
+        with application.app_context():
+            try:
+                return create(db, signup_values(number))
+            finally:
+                db.session.remove()
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        created = sum(pool.map(signup, range(start, start + SIGNUPS)))
+    elapsed = time.perf_counter() - began
+    assert created == SIGNUPS - SIGNUPS // 4
+    return SIGNUPS / elapsed
+
+
+def run(threads=THREADS):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        application = benchmark_app(f'{tmp}/signup.sqlite3')
+        start = 1
+        for count in threads:
+            checked = signups_per_second(application, create_checked, start,
+                                         count)
+            start += SIGNUPS
+            upsert = signups_per_second(application, create_upsert, start,
+                                        count)
+            start += SIGNUPS
+            results.append({
+                'threads': count,
+                'checked': checked,
+                'upsert': upsert,
+            })
+    return results
+
+
+if __name__ == '__main__':
+    print(f'{"threads":>8} {"checked":>12} {"upsert":>12}')
+    for result in run():
+        print(f"{result['threads']:>8} {result['checked']:>10.0f}/s "
+              f"{result['upsert']:>10.0f}/s")
@@ -0,0 +1,75 @@
+"""
+Latency of the /api/stat/timeseries/ computation, added up from the hourly
+stats rollup, or grouped from the passengers for zones with a half hour
+offset
+
+Run from the project directory:
+
+    python -m benchmarks.passenger_timeseries
+"""
+import tempfile
+from datetime import datetime, time, timedelta
+
+import pytz
+
+from taxipassengers_backend.models import PassengerModel
+from taxipassengers_backend.stats import rebuild_stats
+from taxipassengers_backend.timeseries import signup_series
+
+from .common import benchmark_app, seed_passengers, timings
+
+PASSENGERS = 200000
+ROUNDS = 20
+
+
+def cases(db):
+    end = datetime.combine(datetime.utcnow().date(), time.min)
+    year = end - timedelta(days=365)
+    week = end - timedelta(days=7)
+    lagos = pytz.timezone('Africa/Lagos')
+    kolkata = pytz.timezone('Asia/Kolkata')
+
+    def active():
+        return db.session.query(PassengerModel).filter(
+            PassengerModel.suspendedAt == None)  # noqa: E711
+
+    return {
+        'year by day, UTC':
+            lambda: signup_series(year, end, 'day'),
+        'year by week, UTC':
+            lambda: signup_series(year, end, 'week'),
+        'year by day, Lagos':
+            lambda: signup_series(year, end, 'day', lagos),
+        'year by month, active':
+            lambda: signup_series(year, end, 'month',
+                                  filters={'status': 'active'}),
+        'week by hour, Lagos':
+            lambda: signup_series(week, end, 'hour', lagos),
+        'year by day, Kolkata (grouped)':
+            lambda: signup_series(year, end, 'day', kolkata),
+        'year by month, active, Kolkata (grouped)':
+            lambda: signup_series(year, end, 'month', kolkata,
+                                  query=active()),
+    }
+
+
+def run(passengers=PASSENGERS, rounds=ROUNDS):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        application = benchmark_app(f'{tmp}/timeseries.sqlite3')
+        db = application.db
+        seed_passengers(db, passengers)
+        rebuild_stats()
+        db.session.commit()
+
+        for name, func in cases(db).items():
+            results.append({'case': name, **timings(func, rounds)})
+    return results
+
+
+if __name__ == '__main__':
+    print(f'{PASSENGERS} passengers')
+    print(f'{"case":<42} {"p50":>10} {"p95":>10}')
+    for result in run():
+        print(f"{result['case']:<42} {result['p50']:>8.1f}ms "
+              f"{result['p95']:>8.1f}ms")
@@ -0,0 +1,45 @@
+"""
+Rendering a notification from the template registry, against reading the
+template file for every message as before
+
+Run from the project directory:
+
+    python -m benchmarks.template_render
+"""
+import codecs
+import timeit
+
+from taxipassengers_backend.templating import TEMPLATES_PATH
+from taxipassengers_backend.utils import templates
+
+ROUNDS = 2000
+DATA = {'firstName': 'Ada', 'pin': '1234'}
+
+
+def read_and_format(data):
+    location = TEMPLATES_PATH / 'email' / 'welcome.html'
+    with codecs.open(location, 'r', 'utf-8') as file:
+        return file.read().format(**data)
+
+
+def run(rounds=ROUNDS):
+    assert read_and_format(DATA) == templates.render('email/welcome.html',
+                                                     DATA)
+    read = min(timeit.repeat(lambda: read_and_format(DATA), number=rounds,
+                             repeat=5))
+    cached = min(timeit.repeat(
+        lambda: templates.render('email/welcome.html', DATA), number=rounds,
+        repeat=5))
+    return {
+        'rounds': rounds,
+        'read_us': read / rounds * 1e6,
+        'cached_us': cached / rounds * 1e6,
+    }
+
+
+if __name__ == '__main__':
+    result = run()
+    print(f"rounds:   {result['rounds']}")
+    print(f"file:     {result['read_us']:.1f} us/message")
+    print(f"registry: {result['cached_us']:.1f} us/message")
+    print(f"speedup:  {result['read_us'] / result['cached_us']:.0f}x")
@@ -0,0 +1,50 @@
+"""
+Per-request authentication cost with and without the verified token cache,
+and with the PEM key string vs the pre-parsed key ring
+
+Run from the project directory:
+
+    python -m benchmarks.token_cache
+"""
+import timeit
+
+from taxipassengers_backend import config
+from taxipassengers_backend.keyring import KeyRing
+from taxipassengers_backend.token import (TokenCache, generate_token_header,
+                                          validate_token_header)
+
+ROUNDS = 2000
+
+
+def run(rounds=ROUNDS):
+    header = generate_token_header({'id': 1}, config.PRIVATE_KEY)
+    cache = TokenCache()
+    keyring = KeyRing(default_key=config.PUBLIC_KEY)
+
+    uncached = timeit.timeit(
+        lambda: validate_token_header(header, config.PUBLIC_KEY, cache=None),
+        number=rounds)
+    keyring_uncached = timeit.timeit(
+        lambda: validate_token_header(header, keyring, cache=None),
+        number=rounds)
+    cached = timeit.timeit(
+        lambda: validate_token_header(header, config.PUBLIC_KEY, cache=cache),
+        number=rounds)
+
+    return {
+        'rounds': rounds,
+        'uncached_us': uncached / rounds * 1e6,
+        'keyring_uncached_us': keyring_uncached / rounds * 1e6,
+        'cached_us': cached / rounds * 1e6,
+        'cache': cache.stats(),
+    }
+
+
+if __name__ == '__main__':
+    result = run()
+    print(f"rounds:   {result['rounds']}")
+    print(f"uncached: {result['uncached_us']:.1f} us/request")
+    print(f"key ring: {result['keyring_uncached_us']:.1f} us/request")
+    print(f"cached:   {result['cached_us']:.1f} us/request")
+    print(f"speedup:  {result['uncached_us'] / result['cached_us']:.0f}x")
+    print(f"cache:    {result['cache']}")
@@ -1,5 +1,6 @@
 from taxipassengers_backend.app import create_app
 from taxipassengers_backend.models import PassengerModel
+from taxipassengers_backend.stats import rebuild_stats
 from datetime import datetime
 
 if __name__ == '__main__':
@@ -49,3 +50,7 @@ if __name__ == '__main__':
         application.db.session.add(user)
 
     application.db.session.commit()
+
+    # Stats are kept by the API, bring them in line with the rows above
+    rebuild_stats()
+    application.db.session.commit()
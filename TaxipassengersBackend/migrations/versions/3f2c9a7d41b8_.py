@@ -0,0 +1,86 @@
+"""passenger search indexes
+
+Revision ID: 3f2c9a7d41b8
+Revises: 66a637ddc47c
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+import sqlite3
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2c9a7d41b8'
+down_revision = '66a637ddc47c'
+branch_labels = None
+depends_on = None
+
+SEARCH_COLUMNS = ('firstName', 'lastName', 'email', 'phoneNumber')
+# The FTS5 trigram tokenizer needs SQLite 3.34, as models.FTS_TRIGRAM
+FTS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for column in SEARCH_COLUMNS:
+            op.create_index(f'ix_passenger_model_{column}_trgm',
+                            'passenger_model', [column],
+                            postgresql_using='gin',
+                            postgresql_ops={column: 'gin_trgm_ops'})
+
+    elif dialect == 'sqlite' and FTS_TRIGRAM:
+        op.execute(
+            'CREATE VIRTUAL TABLE passenger_search USING fts5('
+            'firstName, lastName, email, phoneNumber, '
+            "content='passenger_model', content_rowid='id', "
+            "tokenize='trigram')")
+        op.execute(
+            'CREATE TRIGGER passenger_search_insert AFTER INSERT ON '
+            'passenger_model BEGIN '
+            'INSERT INTO passenger_search'
+            '(rowid, firstName, lastName, email, phoneNumber) VALUES '
+            '(new.id, new.firstName, new.lastName, new.email, '
+            'new.phoneNumber); '
+            'END')
+        op.execute(
+            'CREATE TRIGGER passenger_search_delete AFTER DELETE ON '
+            'passenger_model BEGIN '
+            'INSERT INTO passenger_search'
+            '(passenger_search, rowid, firstName, lastName, email, '
+            'phoneNumber) '
+            "VALUES ('delete', old.id, old.firstName, old.lastName, "
+            'old.email, old.phoneNumber); '
+            'END')
+        op.execute(
+            'CREATE TRIGGER passenger_search_update AFTER UPDATE OF '
+            'firstName, lastName, email, phoneNumber ON passenger_model '
+            'BEGIN '
+            'INSERT INTO passenger_search'
+            '(passenger_search, rowid, firstName, lastName, email, '
+            'phoneNumber) '
+            "VALUES ('delete', old.id, old.firstName, old.lastName, "
+            'old.email, old.phoneNumber); '
+            'INSERT INTO passenger_search'
+            '(rowid, firstName, lastName, email, phoneNumber) VALUES '
+            '(new.id, new.firstName, new.lastName, new.email, '
+            'new.phoneNumber); '
+            'END')
+        # Index the existing passengers
+        op.execute("INSERT INTO passenger_search(passenger_search) "
+                   "VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for column in SEARCH_COLUMNS:
+            op.drop_index(f'ix_passenger_model_{column}_trgm',
+                          table_name='passenger_model')
+
+    elif dialect == 'sqlite':
+        for trigger in ('insert', 'delete', 'update'):
+            op.execute(f'DROP TRIGGER IF EXISTS passenger_search_{trigger}')
+        op.execute('DROP TABLE IF EXISTS passenger_search')
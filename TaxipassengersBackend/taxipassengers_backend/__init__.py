@@ -1,11 +1,57 @@
 import os
 from celery import Celery
+from kombu import Exchange, Queue
 
 BROKER = os.environ.get('BROKER', 'amqp://localhost:5672')
+# Nothing reads the task results, set it to keep them
+RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND') or None
+# Messages reserved per worker process, 1 keeps a long task from holding
+# back the messages behind it
+PREFETCH_MULTIPLIER = int(os.environ.get('CELERY_PREFETCH_MULTIPLIER', 1))
+# Ack after the task ran instead of before, a task of a worker lost while
+# running it is delivered again
+ACKS_LATE = os.environ.get('CELERY_ACKS_LATE', '0') == '1'
+
+# Priorities of the notification queues, higher first
+PRIORITY_MAX = 10
+PRIORITY_EVENT = 8
+PRIORITY_BULK = 2
+NOTIFICATION_QUEUES = ('sms', 'email', 'bulk')
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """
+    Messages to a queue per channel, so a backlog of one doesn't delay the
+    other. The batches of both channels go to the bulk queue
+    """
+    if name.endswith('.send_batch'):
+        channel = args[0] if args else kwargs['channel']
+        return {'queue': channel}
+    if name.endswith('.send_sms'):
+        return {'queue': 'sms'}
+    if name.endswith('.send_email'):
+        return {'queue': 'email'}
+    if name.endswith(('.send_welcome_batch', '.send_suspension_batch')):
+        return {'queue': 'bulk', 'priority': PRIORITY_BULK}
+    return None
 
 
 def make_celery(app_name=__name__):
-    return Celery(app_name, backend='rpc://', broker=BROKER)
+    celery = Celery(app_name, backend=RESULT_BACKEND, broker=BROKER)
+    celery.conf.update(
+        task_ignore_result=RESULT_BACKEND is None,
+        # Declared as before, changing the arguments of an existing queue
+        # fails
+        task_queues=[Queue('celery', Exchange('celery'), 'celery')] + [
+            Queue(name, Exchange(name), name,
+                  queue_arguments={'x-max-priority': PRIORITY_MAX})
+            for name in NOTIFICATION_QUEUES],
+        task_routes=(route_task,),
+        task_default_priority=PRIORITY_EVENT,
+        worker_prefetch_multiplier=PREFETCH_MULTIPLIER,
+        task_acks_late=ACKS_LATE,
+    )
+    return celery
 
 
 celery = make_celery()
@@ -3,6 +3,9 @@ from flask import Flask
 from flask_restplus import Api
 from flask_migrate import Migrate, MigrateCommand
 from flask_cors import CORS
+from taxipassengers_backend import config
+from taxipassengers_backend.cache import result_cache_from_url
+from taxipassengers_backend.keyring import KeyRing
 from taxipassengers_backend.task import init_celery
 
 PKG_NAME = os.path.dirname(os.path.realpath(__file__)).split("/")[-1]
@@ -10,11 +13,22 @@ PKG_NAME = os.path.dirname(os.path.realpath(__file__)).split("/")[-1]
 migrate = Migrate()
 
 
+def include_object(object, name, type_, reflected, compare_to):
+    # Search tables and indexes are created outside of the models metadata,
+    # keep autogenerate from dropping them
+    if reflected and compare_to is None:
+        return not name.startswith(('passenger_search', 'ix_passenger_model_'))
+    return True
+
+
 def create_app(app_name=PKG_NAME, **kwargs):
     from taxipassengers_backend.namespaces.api import api as apiNamespace
+    from taxipassengers_backend.commands import (idempotency_cli,
+                                                 outbox_cli, passengers_cli,
+                                                 stats_cli)
 
     application = Flask(app_name)
-    CORS(application)
+    CORS(application, expose_headers=['ETag', 'X-Next-Cursor'])
     api = Api(application,
               version='0.1',
               title='Passenger Backend API',
@@ -24,13 +38,22 @@ def create_app(app_name=PKG_NAME, **kwargs):
         init_celery(kwargs.get("celery"), application)
 
     from taxipassengers_backend.db import db, db_config
+    # Parse the token verification keys once, instead of on every request
+    application.keyring = KeyRing(default_key=config.PUBLIC_KEY)
+    # Results of the stat endpoints, dropped on passenger writes
+    application.stats_cache = result_cache_from_url()
+
     application.config['RESTPLUS_MASK_SWAGGER'] = False
     application.config.update(db_config)
     db.init_app(application)
     application.db = db
 
-    migrate.init_app(application, db=db)
+    migrate.init_app(application, db=db, include_object=include_object)
     application.cli.add_command(MigrateCommand, name="db")
+    application.cli.add_command(stats_cli)
+    application.cli.add_command(passengers_cli)
+    application.cli.add_command(idempotency_cli)
+    application.cli.add_command(outbox_cli)
 
     api.add_namespace(apiNamespace)
 
@@ -0,0 +1,313 @@
+"""
+asyncio notification worker
+
+An alternative to the prefork Celery worker for the notification tasks.
+It consumes the Celery task messages of ASYNC_WORKER_QUEUES, the sms and
+email queues by default, and delivers send_sms, send_email and
+send_batch with aiohttp. Up to ASYNC_WORKER_CONCURRENCY gateway requests
+are in flight in the process, instead of one per prefork process. The
+rate limits, retries and dead letters of delivery.py apply as in the
+Celery tasks. Any other task of the queues runs in a thread of
+ASYNC_WORKER_THREADS, as the prefork worker runs it.
+
+kombu is not thread safe, so a consumer thread reads the messages and
+acks them once handled; messages not handled when the worker stops are
+delivered again. Retries held until their countdown is due don't count
+against the prefetch, as in the Celery worker, so they don't stop the
+other messages during a gateway outage. Start it from the project
+directory with:
+
+    python async_worker.py
+"""
+import asyncio
+import logging
+import os
+import queue
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from celery.utils.iso8601 import parse_iso8601
+
+from taxipassengers_backend import celery, gateway
+from taxipassengers_backend.delivery import LocalBackend, limiter
+from taxipassengers_backend.task import (channel_urls, send_batch,
+                                         send_email, send_sms, settle)
+
+logger = logging.getLogger(__name__)
+
+# Gateway requests in flight per process
+ASYNC_WORKER_CONCURRENCY = int(os.environ.get('ASYNC_WORKER_CONCURRENCY',
+                                              200))
+# Task messages taken from the broker before they are acked
+ASYNC_WORKER_PREFETCH = int(os.environ.get('ASYNC_WORKER_PREFETCH',
+                                           2 * ASYNC_WORKER_CONCURRENCY))
+# Threads for the database work and the other tasks
+ASYNC_WORKER_THREADS = int(os.environ.get('ASYNC_WORKER_THREADS', 4))
+ASYNC_WORKER_QUEUES = os.environ.get('ASYNC_WORKER_QUEUES',
+                                     'sms,email').split(',')
+# Seconds between checks for acks and stop while no message arrives
+POLL_INTERVAL = 0.05
+
+DELIVERY_CALLS = {
+    send_sms.name: lambda data, header: ('sms', [data], header),
+    send_email.name: lambda data, headers: ('email', [data], headers),
+    send_batch.name: lambda channel, messages, header, attempt=0: (
+        channel, messages, header, attempt),
+}
+
+
+def task_call(message):
+    """
+    Task name, args, kwargs and eta of a Celery message, of protocol 2 or 1
+    """
+    body = message.decode()
+    if 'task' in message.headers:
+        args, kwargs = body[0], body[1]
+        return (message.headers['task'], args, kwargs,
+                message.headers.get('eta'))
+    return (body['task'], body.get('args', []), body.get('kwargs', {}),
+            body.get('eta'))
+
+
+def eta_delay(eta):
+    """
+    Seconds until the eta of a message, a retry with a countdown
+    """
+    if not eta:
+        return 0
+    return max((parse_iso8601(eta) - celery.now()).total_seconds(), 0)
+
+
+class AsyncWorker:
+    def __init__(self, app, connection=None, queues=ASYNC_WORKER_QUEUES,
+                 concurrency=ASYNC_WORKER_CONCURRENCY,
+                 prefetch=ASYNC_WORKER_PREFETCH,
+                 threads=ASYNC_WORKER_THREADS, max_messages=None):
+        self.app = app
+        self.connection = connection or celery.connection_for_read()
+        self.queues = [celery.amqp.queues[name] for name in queues]
+        self.concurrency = concurrency
+        self.prefetch = prefetch
+        self.max_messages = max_messages
+        self.processed = 0
+        # Messages held until their eta, the prefetch is raised by as many
+        self._held = 0
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._acks = queue.Queue()
+        self._stopping = threading.Event()
+        self._handled = threading.Event()
+        self._stopped = None
+        self._loop = None
+
+    def run(self):
+        self._loop = asyncio.get_event_loop()
+        handled = []
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self._loop.add_signal_handler(signum, self.stop)
+                handled.append(signum)
+            except (RuntimeError, ValueError):
+                # Not the main thread
+                pass
+        try:
+            self._loop.run_until_complete(self.main())
+        finally:
+            # Processes forked later get the default handlers
+            for signum in handled:
+                self._loop.remove_signal_handler(signum)
+
+    def stop(self):
+        if not self._stopped.is_set():
+            logger.info('Stopping, waiting for the messages in progress')
+            self._stopped.set()
+
+    async def main(self):
+        self._stopped = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        handlers = set()
+
+        def received(message):
+            handler = asyncio.ensure_future(self.handle(message))
+            handlers.add(handler)
+            handler.add_done_callback(handlers.discard)
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=gateway.HTTP_CONNECT_TIMEOUT,
+            sock_read=gateway.HTTP_READ_TIMEOUT)
+        consumer = threading.Thread(target=self.consume, args=(received,),
+                                    name='async-worker-consumer')
+        logger.info(f'Consuming {", ".join(q.name for q in self.queues)} '
+                    f'with {self.concurrency} requests in flight')
+        async with aiohttp.ClientSession(connector=connector,
+                                         timeout=timeout) as session:
+            self._session = session
+            consumer.start()
+            try:
+                await self._stopped.wait()
+            finally:
+                self._stopping.set()
+                while handlers:
+                    await asyncio.gather(*handlers)
+                self._handled.set()
+                await self._loop.run_in_executor(None, consumer.join)
+        self._executor.shutdown()
+
+    def consume(self, received):
+        def on_message(body, message):
+            self._loop.call_soon_threadsafe(received, message)
+
+        with self.connection.clone() as connection:
+            with connection.Consumer(self.queues, callbacks=[on_message],
+                                     accept=celery.conf.accept_content,
+                                     prefetch_count=self.prefetch) as consumer:
+                prefetch = self.prefetch
+                while not self._stopping.is_set():
+                    try:
+                        connection.drain_events(timeout=POLL_INTERVAL)
+                    except socket.timeout:
+                        pass
+                    self._ack_handled()
+                    prefetch = self._update_prefetch(consumer, prefetch)
+            # Not consuming anymore, the messages in progress are acked
+            # once handled
+            while not self._handled.wait(POLL_INTERVAL):
+                self._ack_handled()
+            self._ack_handled()
+
+    def _ack_handled(self):
+        while True:
+            try:
+                self._acks.get_nowait().ack()
+            except queue.Empty:
+                return
+
+    def _update_prefetch(self, consumer, prefetch):
+        """
+        Raise the prefetch by the messages held until their eta, or lower
+        it back once they are handled
+        """
+        wanted = self.prefetch + self._held if self.prefetch else 0
+        if wanted != prefetch:
+            consumer.qos(prefetch_count=wanted)
+        return wanted
+
+    async def due(self, eta):
+        """
+        Wait for the eta of a message, False if the worker stops before
+        """
+        delay = eta_delay(eta)
+        if delay:
+            try:
+                await asyncio.wait_for(self._stopped.wait(), delay)
+            except asyncio.TimeoutError:
+                return True
+            return False
+        return True
+
+    async def handle(self, message):
+        try:
+            name, args, kwargs, eta = task_call(message)
+        except Exception:
+            logger.exception('Invalid task message')
+            self.handled(message)
+            return
+        # Held unacked until due, as the Celery worker does. Not acked if
+        # the worker stops before, the broker delivers it again
+        held = bool(eta_delay(eta))
+        self._held += held
+        try:
+            if await self.due(eta):
+                await self.run_task(name, args, kwargs)
+                self.handled(message)
+        finally:
+            # The ack is queued first, the consumer acks it before it lowers
+            # the prefetch
+            self._held -= held
+
+    async def run_task(self, name, args, kwargs):
+        try:
+            call = DELIVERY_CALLS.get(name)
+            if call is not None:
+                await self.send_batch(*call(*args, **kwargs))
+            else:
+                await self.in_thread(celery.tasks[name], *args, **kwargs)
+        except Exception:
+            logger.exception(f'Task {name} failed')
+
+    def handled(self, message):
+        self._acks.put(message)
+        self.processed += 1
+        if self.max_messages and self.processed >= self.max_messages:
+            self.stop()
+
+    async def in_thread(self, func, *args, **kwargs):
+        def call():
+            with self.app.app_context():
+                return func(*args, **kwargs)
+
+        return await self._loop.run_in_executor(self._executor, call)
+
+    async def send_batch(self, channel, messages, header, attempt=0):
+        url, bulk_url = channel_urls(channel)
+        if bulk_url:
+            results = await self.post_bulk(channel, bulk_url, messages,
+                                           header)
+        else:
+            results = await asyncio.gather(*[
+                self.post(channel, url, message, header)
+                for message in messages])
+        await self.in_thread(settle, channel, messages, header, attempt,
+                             list(results))
+        return results
+
+    async def reserve(self, channel, tokens=1):
+        if isinstance(limiter.backend, LocalBackend):
+            delay = limiter.reserve(channel, tokens)
+        else:
+            delay = await self._loop.run_in_executor(
+                self._executor, limiter.reserve, channel, tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def post(self, channel, url, data, header):
+        await self.reserve(channel)
+        async with self._semaphore:
+            try:
+                async with self._session.post(url, data=data,
+                                              headers=header) as response:
+                    await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                return {'ok': False, 'status': None,
+                        'error': str(error) or type(error).__name__}
+        ok = response.status < 400
+        return {'ok': ok, 'status': response.status,
+                'error': None if ok else response.reason}
+
+    async def post_bulk(self, channel, url, messages, header):
+        """
+        As task.post_bulk
+        """
+        await self.reserve(channel, len(messages))
+        async with self._semaphore:
+            try:
+                async with self._session.post(
+                        url, json={'messages': messages},
+                        headers=header) as response:
+                    if response.status < 400:
+                        body = await response.json(content_type=None)
+                        return [{'ok': bool(result.get('ok')),
+                                 'status': response.status,
+                                 'error': result.get('error')}
+                                for result in body['results']]
+                    error = {'ok': False, 'status': response.status,
+                             'error': response.reason}
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError,
+                    KeyError) as exception:
+                error = {'ok': False, 'status': None,
+                         'error': str(exception) or
+                         type(exception).__name__}
+        return [error] * len(messages)
@@ -0,0 +1,78 @@
+"""
+Suspension and reactivation of many passengers at once
+
+A single set-based UPDATE changes the passengers whose state actually
+changes, the rows already suspended (or active) are left untouched, and
+returns what the rollups and the notifications need. The notifications are
+queued in batches, their progress is kept in a bulk job row.
+"""
+from datetime import datetime
+
+from sqlalchemy import and_
+
+from taxipassengers_backend.db import db, update_returning
+from taxipassengers_backend.models import BulkJobModel, PassengerModel
+from taxipassengers_backend.stats import (PassengerState,
+                                          record_passenger_changes,
+                                          status_key)
+
+BULK_ACTIONS = ('suspend', 'unsuspend')
+# Columns returned by the update, for the rollups and the notifications
+RETURNED = ('id', 'firstName', 'email', 'phoneNumber', 'timestamp',
+            'emailStatus', 'phoneNumberStatus')
+
+
+def changed_states(rows, suspend):
+    """
+    (old, new) rollup states of the updated passengers
+    """
+    for row in rows:
+        new = PassengerState(row['timestamp'] or datetime.utcnow(),
+                             int(suspend),
+                             status_key(row['emailStatus']),
+                             status_key(row['phoneNumberStatus']))
+        yield new._replace(suspended=int(not suspend)), new
+
+
+def suspend_passengers(condition, suspend=True):
+    """
+    Suspend, or reactivate, the passengers matching the condition in one
+    transaction. Returns the bulk job and the updated passengers
+    """
+    passenger = PassengerModel.__table__
+    if suspend:
+        condition = and_(condition, passenger.c.suspendedAt.is_(None))
+        values = {'suspendedAt': datetime.utcnow()}
+    else:
+        condition = and_(condition, passenger.c.suspendedAt.isnot(None))
+        values = {'suspendedAt': None}
+
+    columns = [passenger.c[name] for name in RETURNED]
+    rows = [dict(zip(RETURNED, row)) for row in
+            update_returning(passenger, condition, values, columns)]
+    record_passenger_changes(changed_states(rows, suspend))
+
+    job = BulkJobModel(action='suspend' if suspend else 'unsuspend',
+                       changed=len(rows))
+    if not suspend or not rows:
+        # Nothing to send
+        job.finishedAt = datetime.utcnow()
+    db.session.add(job)
+    db.session.commit()
+    return job, rows
+
+
+def record_notified(job_id, count, sent=0, failed=0):
+    """
+    Add count notified passengers to the job, and the messages sent and
+    failed for them, in its own transaction
+    """
+    job = BulkJobModel.__table__
+    db.session.execute(job.update().where(job.c.id == job_id).values(
+        notified=job.c.notified + count, sent=job.c.sent + sent,
+        failed=job.c.failed + failed))
+    db.session.execute(job.update().where(and_(
+        job.c.id == job_id, job.c.finishedAt.is_(None),
+        job.c.notified >= job.c.changed)).values(
+            finishedAt=datetime.utcnow()))
+    db.session.commit()
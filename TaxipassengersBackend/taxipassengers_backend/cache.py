@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# redis://host:port/db to share the cache between processes, in-process
+# otherwise
+STATS_CACHE_URL = os.environ.get('STATS_CACHE_URL')
+STATS_CACHE_TTL = float(os.environ.get('STATS_CACHE_TTL', 60))
+STATS_CACHE_SIZE = int(os.environ.get('STATS_CACHE_SIZE', 1024))
+
+
+class LocalBackend:
+    """
+    In-process LRU of values with an expiry time
+    """
+
+    def __init__(self, maxsize=STATS_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expiry, value = entry
+            if expiry <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def generation(self):
+        return self._generation
+
+    def next_generation(self):
+        with self._lock:
+            self._generation += 1
+            # Entries of older generations can't be reached anymore
+            self._entries.clear()
+            return self._generation
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """
+    Values stored as JSON in Redis, shared by all the API processes
+    """
+
+    def __init__(self, client, prefix='stats'):
+        self.client = client
+        self.prefix = prefix
+        self._generation_key = f'{prefix}:generation'
+
+    def get(self, key):
+        value = self.client.get(f'{self.prefix}:{key}')
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def set(self, key, value, ttl):
+        self.client.set(f'{self.prefix}:{key}', json.dumps(value),
+                        px=int(ttl * 1000))
+
+    def generation(self):
+        return int(self.client.get(self._generation_key) or 0)
+
+    def next_generation(self):
+        return self.client.incr(self._generation_key)
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one, the other callers
+    wait for its result
+    """
+
+    class Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self.Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class ResultCache:
+    """
+    Cache of computed results, keyed by name and normalized arguments
+
+    invalidate() moves the cache to a new generation, the key of every
+    entry includes the generation it was computed in.
+    """
+
+    def __init__(self, backend=None, ttl=STATS_CACHE_TTL):
+        self.backend = backend if backend is not None else LocalBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._flight = SingleFlight()
+
+    @staticmethod
+    def key(name, args):
+        return f'{name}:' + json.dumps(args, sort_keys=True, default=str,
+                                       separators=(',', ':'))
+
+    def get_or_compute(self, name, args, compute):
+        """
+        Cached result of compute() for the name and arguments
+        """
+        key = f'{self.backend.generation()}:{self.key(name, args)}'
+        value = self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        def compute_and_store():
+            # A concurrent leader may have stored it in the meantime
+            value = self.backend.get(key)
+            if value is None:
+                self.misses += 1
+                value = compute()
+                self.backend.set(key, value, self.ttl)
+            return value
+
+        return self._flight.do(key, compute_and_store)
+
+    def invalidate(self):
+        self.backend.next_generation()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+def result_cache_from_url(url=STATS_CACHE_URL, ttl=STATS_CACHE_TTL):
+    if not url:
+        return ResultCache(LocalBackend(), ttl)
+
+    import redis
+    logger.info(f'Stats cache on {url}')
+    return ResultCache(RedisBackend(redis.Redis.from_url(url)), ttl)
@@ -0,0 +1,104 @@
+import click
+from flask.cli import AppGroup
+
+from taxipassengers_backend.db import db
+from taxipassengers_backend.idempotency import purge_expired
+from taxipassengers_backend.importer import (IMPORT_BATCH_SIZE,
+                                             IMPORT_FORMATS, MAX_BATCH_SIZE,
+                                             import_passengers)
+from taxipassengers_backend.delivery import CHANNELS
+from taxipassengers_backend.outbox import (OUTBOX_BATCH_SIZE,
+                                           OUTBOX_POLL_INTERVAL, drain,
+                                           requeue_dead_letters,
+                                           run_dispatcher)
+from taxipassengers_backend.stats import rebuild_stats
+from taxipassengers_backend.utils import send_welcome_notifications
+
+stats_cli = AppGroup('stats', help='Passenger statistics')
+passengers_cli = AppGroup('passengers', help='Passenger data')
+idempotency_cli = AppGroup('idempotency', help='Idempotency keys')
+outbox_cli = AppGroup('outbox', help='Notification outbox')
+
+
+@stats_cli.command('rebuild')
+def rebuild():
+    """
+    Recompute the stats rollups from the passengers table
+    """
+    days, hours = rebuild_stats()
+    db.session.commit()
+    click.echo(f'Rebuilt stats for {days} days and {hours} hourly rows')
+
+
+@passengers_cli.command('import')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'import_format', type=click.Choice(IMPORT_FORMATS),
+              help='Format of the source, from its extension by default')
+@click.option('--batch-size', type=click.IntRange(1, MAX_BATCH_SIZE),
+              default=IMPORT_BATCH_SIZE, show_default=True,
+              help='Passengers inserted per transaction')
+@click.option('--notify/--no-notify', default=False, show_default=True,
+              help='Send welcome messages to the passengers')
+@click.option('--authorization', envvar='NOTIFICATION_AUTHORIZATION',
+              help='Authorization header of the notification services')
+def import_command(source, import_format, batch_size, notify,
+                   authorization):
+    """
+    Create passengers from an NDJSON or CSV file, - for stdin
+    """
+    from taxipassengers_backend.namespaces.api import importRowParser
+
+    if import_format is None:
+        import_format = 'csv' if source.name.endswith('.csv') else 'ndjson'
+    if notify and not authorization:
+        raise click.UsageError('--notify needs --authorization')
+
+    def on_batch(passengers):
+        if notify:
+            send_welcome_notifications(passengers, authorization)
+        click.echo(f'Inserted {len(passengers)} passengers', err=True)
+
+    result = import_passengers(source, import_format, importRowParser.args,
+                               batch_size, on_batch)
+    for error in result.errors:
+        click.echo(f'Line {error["line"]}: {", ".join(error["errors"])}',
+                   err=True)
+    click.echo(f'Imported {result.inserted} passengers, '
+               f'rejected {result.rejected}')
+
+
+@idempotency_cli.command('purge')
+def purge():
+    """
+    Delete the expired idempotency keys
+    """
+    click.echo(f'Deleted {purge_expired()} expired idempotency keys')
+
+
+@outbox_cli.command('dispatch')
+@click.option('--batch-size', type=click.IntRange(1),
+              default=OUTBOX_BATCH_SIZE, show_default=True,
+              help='Messages taken per transaction')
+@click.option('--follow', is_flag=True,
+              help='Keep dispatching new messages until stopped')
+@click.option('--interval', type=float, default=OUTBOX_POLL_INTERVAL,
+              show_default=True,
+              help='Seconds between checks of an empty outbox')
+def dispatch(batch_size, follow, interval):
+    """
+    Publish the messages waiting in the outbox
+    """
+    if follow:
+        run_dispatcher(batch_size, interval)
+    click.echo(f'Published {drain(batch_size)} outbox messages')
+
+
+@outbox_cli.command('requeue-dead')
+@click.option('--channel', type=click.Choice(sorted(CHANNELS)),
+              help='Only the messages of this channel')
+def requeue_dead(channel):
+    """
+    Send the dead lettered messages again, through the outbox
+    """
+    click.echo(f'Requeued {requeue_dead_letters(channel)} dead lettered '
+               f'messages')
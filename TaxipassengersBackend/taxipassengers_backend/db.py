@@ -1,6 +1,8 @@
 import os
 from pathlib import Path
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import false, select
+from sqlalchemy.dialects import postgresql
 
 DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'SQLITE')
 
@@ -34,3 +36,67 @@ else:
     raise Exception('Incorrect DATABASE_ENGINE')
 
 db = SQLAlchemy()
+
+# Ids per UPDATE when RETURNING is emulated, under the SQLite limit
+UPDATE_CHUNK_SIZE = 500
+
+
+def update_returning(table, condition, values, columns, old_columns=()):
+    """
+    UPDATE the rows matching the condition and return, for every updated
+    row, the columns after the update followed by the old_columns before
+    it. With a single UPDATE ... RETURNING where it's supported
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        if not old_columns:
+            statement = (table.update().where(condition).values(values)
+                         .returning(*columns))
+            return db.session.execute(statement).fetchall()
+
+        # RETURNING only sees the new values, the old ones come from the
+        # rows locked by a self join
+        old = (select([table.c.id, *old_columns]).where(condition)
+               .with_for_update().alias('old'))
+        statement = (table.update().where(table.c.id == old.c.id)
+                     .values(values).returning(*columns, *[
+                         old.c[column.name].label(f'old_{column.name}')
+                         for column in old_columns]))
+        return db.session.execute(statement).fetchall()
+
+    # SQLAlchemy can't render RETURNING for SQLite. An UPDATE matching no
+    # rows takes the database write lock first, so the rows can't change
+    # between the selects and the updates by id
+    db.session.execute(table.update().where(false()).values(values))
+    # The key is labelled, select() would merge it with a selected id
+    key = table.c.id.label('updated_id')
+    before = db.session.execute(
+        select([key, *old_columns]).where(condition)).fetchall()
+    after = {}
+    for start in range(0, len(before), UPDATE_CHUNK_SIZE):
+        chunk = [row[0] for row in before[start:start + UPDATE_CHUNK_SIZE]]
+        db.session.execute(
+            table.update().where(table.c.id.in_(chunk)).values(values))
+        after.update((row[0], tuple(row[1:])) for row in db.session.execute(
+            select([key, *columns]).where(table.c.id.in_(chunk))))
+    return [after[row[0]] + tuple(row[1:]) for row in before]
+
+
+def insert_returning(table, values, columns):
+    """
+    INSERT the row unless it collides with a unique key, and return its
+    columns, None on a collision. Concurrent inserts of the same key are
+    settled by the database, not by a check before
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        statement = (postgresql.insert(table).values(values)
+                     .on_conflict_do_nothing().returning(*columns))
+        return db.session.execute(statement).first()
+
+    # SQLAlchemy can't render RETURNING for SQLite, the row is read back
+    # by its rowid
+    result = db.session.execute(
+        table.insert().prefix_with('OR IGNORE').values(values))
+    if not result.rowcount:
+        return None
+    return db.session.execute(
+        select(columns).where(table.c.id == result.lastrowid)).first()
@@ -0,0 +1,220 @@
+"""
+Rate limits, retries and dead letters of the notification channels
+
+Each channel has a token bucket of {CHANNEL}_RATE messages per second
+and {CHANNEL}_BURST messages, shared by all the workers through Redis
+when NOTIFICATION_REDIS_URL is set, per process otherwise. A message
+takes a token before it's posted, waiting for the bucket to refill when
+it's empty, 0 disables the limit. Messages failing with a timeout, a
+connection error, a 429 or a 5xx are retried up to {CHANNEL}_MAX_RETRIES
+times with exponential backoff from {CHANNEL}_RETRY_BACKOFF seconds, up
+to {CHANNEL}_RETRY_BACKOFF_MAX. The others, and the ones out of retries,
+are stored in the notification_dead_letter table. The sent, retried and
+dead lettered messages are counted per channel.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from taxipassengers_backend.db import db
+from taxipassengers_backend.models import NotificationDeadLetterModel
+
+logger = logging.getLogger(__name__)
+
+# redis://host:port/db to share the limits and metrics between workers
+NOTIFICATION_REDIS_URL = os.environ.get('NOTIFICATION_REDIS_URL')
+CHANNEL_DEFAULTS = {
+    'sms': {'rate': 10, 'burst': 20},
+    'email': {'rate': 20, 'burst': 40},
+}
+METRICS = ('sent', 'retried', 'deadLettered')
+
+
+def channel_config(channel):
+    prefix = channel.upper()
+    defaults = CHANNEL_DEFAULTS[channel]
+    return {
+        'rate': float(os.environ.get(f'{prefix}_RATE', defaults['rate'])),
+        'burst': float(os.environ.get(f'{prefix}_BURST', defaults['burst'])),
+        'max_retries': int(os.environ.get(f'{prefix}_MAX_RETRIES', 5)),
+        'retry_backoff': float(os.environ.get(f'{prefix}_RETRY_BACKOFF', 2)),
+        'retry_backoff_max': float(
+            os.environ.get(f'{prefix}_RETRY_BACKOFF_MAX', 300)),
+    }
+
+
+CHANNELS = {channel: channel_config(channel) for channel in CHANNEL_DEFAULTS}
+
+
+class LocalBackend:
+    """
+    Token buckets and counters of this process
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+    def take(self, key, tokens, rate, burst):
+        """
+        Take the tokens, returns the level left, negative when they have
+        to be waited for
+        """
+        now = time.monotonic()
+        with self._lock:
+            level, updated = self._buckets.get(key, (burst, now))
+            level = min(burst, level + (now - updated) * rate) - tokens
+            self._buckets[key] = (level, now)
+        return level
+
+    def incr(self, name, amount):
+        with self._lock:
+            self._counters[name] += amount
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+class RedisBackend:
+    """
+    Token buckets and counters in Redis, shared by all the workers
+    """
+
+    def __init__(self, client, prefix='notifications'):
+        self.client = client
+        self.prefix = prefix
+        self._counters_key = f'{prefix}:metrics'
+
+    def take(self, key, tokens, rate, burst):
+        import redis
+
+        name = f'{self.prefix}:bucket:{key}'
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(name)
+                    level, updated = pipe.hmget(name, 'level', 'updated')
+                    seconds, microseconds = pipe.time()
+                    now = seconds + microseconds / 1e6
+                    if level is None:
+                        level = burst
+                    else:
+                        level = min(burst, float(level) +
+                                    (now - float(updated)) * rate)
+                    level -= tokens
+                    pipe.multi()
+                    pipe.hset(name, mapping={'level': level, 'updated': now})
+                    # Full again by then, no need to keep it
+                    pipe.expire(name, int(burst / rate) + 60)
+                    pipe.execute()
+                    return level
+                except redis.WatchError:
+                    continue
+
+    def incr(self, name, amount):
+        self.client.hincrby(self._counters_key, name, amount)
+
+    def counters(self):
+        return {name.decode(): int(value) for name, value in
+                self.client.hgetall(self._counters_key).items()}
+
+
+class RateLimiter:
+    """
+    Token bucket per channel
+    """
+
+    def __init__(self, backend, channels=CHANNELS):
+        self.backend = backend
+        self.channels = channels
+
+    def reserve(self, channel, tokens=1):
+        """
+        Take the tokens of the messages to send, returns the seconds to wait
+        before sending them
+        """
+        config = self.channels[channel]
+        if config['rate'] <= 0:
+            return 0
+        level = self.backend.take(channel, tokens, config['rate'],
+                                  config['burst'])
+        return max(0, -level / config['rate'])
+
+    def wait(self, channel, tokens=1):
+        """
+        Take the tokens, sleeping until the bucket has them. Returns the
+        seconds slept
+        """
+        delay = self.reserve(channel, tokens)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+def backend_from_url(url=NOTIFICATION_REDIS_URL):
+    if not url:
+        return LocalBackend()
+
+    import redis
+    logger.info(f'Notification limits and metrics on {url}')
+    return RedisBackend(redis.Redis.from_url(url))
+
+
+backend = backend_from_url()
+limiter = RateLimiter(backend)
+
+
+def retryable(result):
+    status = result['status']
+    return status is None or status == 429 or status >= 500
+
+
+def retry_delay(channel, attempt):
+    """
+    Seconds before retry attempt, from 0, with jitter
+    """
+    config = CHANNELS[channel]
+    delay = min(config['retry_backoff_max'],
+                config['retry_backoff'] * 2 ** attempt)
+    return delay * random.uniform(0.5, 1)
+
+
+def count(channel, metric, amount):
+    if amount:
+        backend.incr(f'{channel}:{metric}', amount)
+
+
+def metrics():
+    counters = backend.counters()
+    return {
+        channel: {metric: counters.get(f'{channel}:{metric}', 0)
+                  for metric in METRICS}
+        for channel in CHANNELS
+    }
+
+
+def dead_letter(channel, header, failures, attempts):
+    """
+    Store the (message, result) pairs that won't be retried
+    """
+    now = datetime.utcnow()
+    db.session.execute(NotificationDeadLetterModel.__table__.insert(), [{
+        'channel': channel,
+        'authorization': header.get('Authorization', ''),
+        'message': json.dumps(message),
+        'status': result['status'],
+        'error': result['error'],
+        'attempts': attempts,
+        'failedAt': now,
+    } for message, result in failures])
+    db.session.commit()
+    count(channel, 'deadLettered', len(failures))
+    logger.warning(f'{len(failures)} {channel} messages dead lettered: '
+                   f'{failures[0][1]["error"]}')
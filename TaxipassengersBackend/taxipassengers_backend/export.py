@@ -0,0 +1,53 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# Rows per chunk written to the response
+CHUNK_SIZE = 1000
+
+
+def json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'{type(value)} is not JSON serializable')
+
+
+def ndjson_chunks(rows, names):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(names, row)), default=json_default))
+        if len(lines) == CHUNK_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def csv_chunks(rows, names):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for number, row in enumerate(rows, start=1):
+        writer.writerow(value.isoformat()
+                        if isinstance(value, (date, datetime)) else value
+                        for value in row)
+        if number % CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_chunks(rows, names, export_format):
+    """
+    Serialize rows lazily, in chunks of CHUNK_SIZE rows
+    """
+    if export_format == 'csv':
+        return csv_chunks(rows, names)
+    return ndjson_chunks(rows, names)
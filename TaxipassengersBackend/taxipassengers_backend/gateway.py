@@ -0,0 +1,67 @@
+"""
+HTTP client of the SMS and email gateways
+
+Each worker process keeps a requests.Session, so the notifications reuse
+pooled keep-alive connections instead of connecting for every message.
+The session is created when a Celery worker process starts, and again
+in a process forked after it was created, as connections can't be
+shared between processes.
+"""
+import logging
+import os
+
+import requests
+from celery.signals import worker_process_init, worker_process_shutdown
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Connections kept open per gateway host
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+# Seconds to connect, and to wait for the response after sending
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 10))
+
+_session = None
+_session_pid = None
+
+
+def make_session(pool_size=HTTP_POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def init_session(**kwargs):
+    global _session, _session_pid
+    _session = make_session()
+    _session_pid = os.getpid()
+    logger.info(f'HTTP session with {HTTP_POOL_SIZE} connections per host '
+                f'for process {_session_pid}')
+
+
+def close_session(**kwargs):
+    global _session, _session_pid
+    if _session is not None:
+        _session.close()
+    _session = _session_pid = None
+
+
+def session():
+    """
+    The session of this process
+    """
+    if _session is None or _session_pid != os.getpid():
+        init_session()
+    return _session
+
+
+def post(url, data, headers, json=None):
+    return session().post(url, data=data, headers=headers, json=json,
+                          timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+
+
+worker_process_init.connect(init_session, weak=False)
+worker_process_shutdown.connect(close_session, weak=False)
@@ -0,0 +1,152 @@
+"""
+Idempotency-Key support for the write endpoints
+
+The first request with a key reserves it before running. When it
+completes, its status, body and headers are saved for IDEMPOTENCY_TTL
+seconds. Retries with the same key and body then get the saved response,
+without running the endpoint again or sending its notifications. A retry
+arriving while the first request runs gets a 409 Conflict, and the same
+key with another body gets a 422. Keys are scoped to the caller, the
+method and the path.
+"""
+import hashlib
+import http.client
+import json
+import os
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import abort, current_app, request
+from flask_restplus.utils import unpack
+
+from taxipassengers_backend.db import db, insert_returning
+from taxipassengers_backend.models import IdempotencyKeyModel
+from taxipassengers_backend.token import validate_token_header
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600))
+# Reservations of requests that never completed are released after this
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.environ.get('IDEMPOTENCY_LOCK_TIMEOUT',
+                                              60))
+MAX_KEY_LENGTH = 255
+
+
+def sha256(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else
+                      str(part).encode('utf8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def reserve(key, fingerprint):
+    """
+    Reserve the key for this request, returns the saved entry when the key
+    is already taken and None when reserved
+    """
+    table = IdempotencyKeyModel.__table__
+    now = datetime.utcnow()
+    # Expired entries and abandoned reservations can be taken over
+    db.session.execute(table.delete().where(
+        (table.c.key == key) & (table.c.expiresAt <= now)))
+    row = insert_returning(table, {
+        'key': key,
+        'fingerprint': fingerprint,
+        'expiresAt': now + timedelta(seconds=IDEMPOTENCY_LOCK_TIMEOUT),
+    }, [table.c.id])
+    db.session.commit()
+    if row is not None:
+        return None
+    return IdempotencyKeyModel.query.filter_by(key=key).first()
+
+
+def release(key):
+    db.session.rollback()
+    table = IdempotencyKeyModel.__table__
+    db.session.execute(table.delete().where(table.c.key == key))
+    db.session.commit()
+
+
+def save(key, data, code, headers):
+    table = IdempotencyKeyModel.__table__
+    db.session.execute(table.update().where(table.c.key == key).values(
+        status=code,
+        body=json.dumps(data),
+        headers=json.dumps(dict(headers)),
+        expiresAt=datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_TTL)))
+    db.session.commit()
+
+
+def replay(entry, fingerprint):
+    if entry is None:
+        # Released by the first request in the meantime
+        abort(http.client.CONFLICT, 'The request with this Idempotency-Key '
+              'did not complete, retry it')
+    if entry.fingerprint != fingerprint:
+        abort(http.client.UNPROCESSABLE_ENTITY,
+              'The Idempotency-Key was used for another request')
+    if entry.status is None:
+        abort(http.client.CONFLICT,
+              'A request with this Idempotency-Key is in progress')
+
+    headers = json.loads(entry.headers)
+    headers['Idempotent-Replayed'] = 'true'
+    return json.loads(entry.body), entry.status, headers
+
+
+def idempotent(func):
+    """
+    Decorate a Resource method to honour the Idempotency-Key header.
+    Requests without a key or a valid token run as usual. Only the
+    responses returned with a status under 500 are saved, not streamed
+    ones
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return func(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            abort(http.client.BAD_REQUEST, f'{IDEMPOTENCY_HEADER} is longer '
+                  f'than {MAX_KEY_LENGTH} characters')
+
+        payload = validate_token_header(
+            request.headers.get('Authorization'), current_app.keyring)
+        if payload is None:
+            # Rejected by the endpoint
+            return func(*args, **kwargs)
+
+        key = sha256(payload.get('id'), request.method, request.path, key)
+        fingerprint = sha256(request.query_string, request.get_data())
+        entry = reserve(key, fingerprint)
+        if entry is not None:
+            return replay(entry, fingerprint)
+
+        try:
+            response = func(*args, **kwargs)
+        except Exception:
+            # Aborted or failed, the retry runs again
+            release(key)
+            raise
+
+        data, code, headers = unpack(response)
+        streamed = isinstance(data, current_app.response_class)
+        if code >= http.client.INTERNAL_SERVER_ERROR or streamed:
+            release(key)
+        else:
+            save(key, data, code, headers)
+        return response
+
+    return wrapper
+
+
+def purge_expired():
+    """
+    Delete the expired entries, returns how many
+    """
+    table = IdempotencyKeyModel.__table__
+    result = db.session.execute(
+        table.delete().where(table.c.expiresAt <= datetime.utcnow()))
+    db.session.commit()
+    return result.rowcount
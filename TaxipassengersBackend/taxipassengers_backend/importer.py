@@ -0,0 +1,270 @@
+"""
+Bulk import of passengers from NDJSON or CSV
+
+Rows use the passengerParser argument names, plus authId and an optional
+signup timestamp. They are validated with the parser rules and inserted in
+batches, with COPY on PostgreSQL and executemany on SQLite. Rows clashing
+with an existing passenger, or with another row of the same batch, on
+authId, email or phone are rejected and reported by line.
+"""
+import csv
+import io
+import json
+import os
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from sqlalchemy.exc import IntegrityError
+
+from taxipassengers_backend.db import db
+from taxipassengers_backend.models import PassengerModel
+from taxipassengers_backend.stats import (passenger_state,
+                                          record_passenger_changes)
+from taxipassengers_backend.timeseries import iso_datetime
+
+IMPORT_FORMATS = ('ndjson', 'csv')
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+MAX_BATCH_SIZE = 10000
+# Rejected rows listed in the result, the others are only counted
+MAX_REPORTED_ERRORS = 1000
+# Values per IN (...) of the conflict checks, under the SQLite limit
+CHECK_CHUNK_SIZE = 500
+
+# Row fields to passenger columns
+COLUMNS = {
+    'authId': 'authId',
+    'first': 'firstName',
+    'last': 'lastName',
+    'dob': 'dateOfBirth',
+    'email': 'email',
+    'phone': 'phoneNumber',
+    'image': 'image',
+    'homeLocation': 'homeLocation',
+    'homePickupTime': 'homePickupTime',
+    'workLocation': 'workLocation',
+    'workPickupTime': 'workPickupTime',
+    'paymentMethod': 'paymentMethod',
+    'emailStatus': 'emailStatus',
+    'phoneNumberStatus': 'phoneNumberStatus',
+    'timestamp': 'timestamp',
+}
+UNIQUE_FIELDS = ('authId', 'email', 'phone')
+
+
+def signup_time(value):
+    """
+    ISO 8601 time as naive UTC, like the stored timestamps
+    """
+    moment = iso_datetime(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+class ImportResult:
+    def __init__(self):
+        self.inserted = 0
+        self.rejected = 0
+        self.errors = []
+
+    def reject(self, line, errors):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def to_dict(self):
+        return {
+            'inserted': self.inserted,
+            'rejected': self.rejected,
+            'errors': self.errors,
+        }
+
+
+def read_rows(lines, import_format):
+    """
+    (line number, row) for every record of the text lines, row is None
+    when the line can't be parsed
+    """
+    if import_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def validate_row(row, arguments):
+    """
+    Convert the row fields with the reqparse arguments, returns the
+    passenger column values and the errors
+    """
+    values = {}
+    errors = []
+    for argument in arguments:
+        value = row.get(argument.name)
+        if value is None or value == '':
+            if argument.required:
+                errors.append(f'{argument.name} is required')
+            continue
+        try:
+            value = argument.type(value)
+        except (TypeError, ValueError):
+            errors.append(f'{argument.name} is not valid')
+            continue
+        if argument.choices and value not in argument.choices:
+            errors.append(f'{argument.name} must be one of '
+                          f'{", ".join(map(str, argument.choices))}')
+            continue
+        if argument.name in COLUMNS:
+            values[COLUMNS[argument.name]] = value
+    return values, errors
+
+
+def passenger_values(values):
+    """
+    Values of every inserted column, same defaults as MePassenger.post
+    """
+    passenger = {column: None for column in COLUMNS.values()}
+    passenger.update(emailStatus=1, phoneNumberStatus=0, rating=0.0,
+                     timestamp=datetime.utcnow())
+    passenger.update({column: value for column, value in values.items()
+                      if value is not None})
+    return passenger
+
+
+def existing_values(column, values):
+    found = set()
+    values = list(values)
+    for start in range(0, len(values), CHECK_CHUNK_SIZE):
+        chunk = values[start:start + CHECK_CHUNK_SIZE]
+        found.update(value for value, in db.session.query(column)
+                     .filter(column.in_(chunk)))
+    return found
+
+
+def reject_conflicts(rows, result):
+    """
+    Rows of the batch not clashing with each other or existing passengers
+    """
+    columns = {field: COLUMNS[field] for field in UNIQUE_FIELDS}
+    existing = {
+        field: existing_values(getattr(PassengerModel, column),
+                               {values[column] for _, values in rows})
+        for field, column in columns.items()
+    }
+
+    accepted = []
+    for line, values in rows:
+        errors = [f'{field} {values[column]} is already used'
+                  for field, column in columns.items()
+                  if values[column] in existing[field]]
+        if errors:
+            result.reject(line, errors)
+            continue
+        for field, column in columns.items():
+            existing[field].add(values[column])
+        accepted.append((line, values))
+    return accepted
+
+
+def copy_rows(passengers):
+    columns = list(passengers[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for passenger in passengers:
+        writer.writerow(passenger[column] for column in columns)
+    buffer.seek(0)
+
+    names = ', '.join(f'"{column}"' for column in columns)
+    statement = (f'COPY {PassengerModel.__tablename__} ({names}) '
+                 'FROM STDIN WITH (FORMAT csv)')
+    connection = db.session.connection()
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(statement, buffer)
+    except connection.dialect.dbapi.IntegrityError as error:
+        # Raw DBAPI call, not wrapped by SQLAlchemy
+        raise IntegrityError(statement, None, error)
+
+
+def insert_rows(passengers):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        copy_rows(passengers)
+    else:
+        db.session.execute(PassengerModel.__table__.insert(), passengers)
+
+
+def insert_batch(rows, result):
+    """
+    Insert the valid rows of a batch in one transaction, returns the
+    values of the passengers inserted
+    """
+    rows = reject_conflicts(rows, result)
+    if not rows:
+        return []
+
+    passengers = [values for _, values in rows]
+    try:
+        with db.session.begin_nested():
+            insert_rows(passengers)
+    except IntegrityError:
+        # Keys taken by another transaction since the check, find the
+        # clashing rows one by one
+        passengers = []
+        for line, values in rows:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(
+                        PassengerModel.__table__.insert().values(**values))
+                passengers.append(values)
+            except IntegrityError:
+                result.reject(line, ['authId, email or phone is already '
+                                     'used'])
+
+    record_passenger_changes(
+        (None, passenger_state(SimpleNamespace(suspendedAt=None, **values)))
+        for values in passengers)
+    db.session.commit()
+    result.inserted += len(passengers)
+    return passengers
+
+
+def import_passengers(lines, import_format, arguments,
+                      batch_size=IMPORT_BATCH_SIZE, on_batch=None):
+    """
+    Import the passengers of the NDJSON or CSV lines, validated with the
+    reqparse arguments. on_batch is called with the values of the
+    passengers of every committed batch
+    """
+    result = ImportResult()
+    batch = []
+
+    def flush():
+        passengers = insert_batch(batch, result)
+        batch.clear()
+        if passengers and on_batch is not None:
+            on_batch(passengers)
+
+    for line, row in read_rows(lines, import_format):
+        if row is None:
+            result.reject(line, ['not a valid record'])
+            continue
+        values, errors = validate_row(row, arguments)
+        if errors:
+            result.reject(line, errors)
+            continue
+        batch.append((line, passenger_values(values)))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    return result
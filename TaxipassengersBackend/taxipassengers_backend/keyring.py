@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import jwt
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from jwt.algorithms import RSAAlgorithm
+
+logger = logging.getLogger(__name__)
+
+# Directory with <kid>.pem files or a JWKS json file
+KEYRING_PATH = os.environ.get('KEYRING_PATH')
+KEYRING_RELOAD_INTERVAL = float(os.environ.get('KEYRING_RELOAD_INTERVAL', 30))
+
+# Key used for tokens without a kid in their header
+DEFAULT_KID = 'default'
+
+
+def load_pem(pem):
+    if isinstance(pem, str):
+        pem = pem.strip().encode('utf8')
+    return load_pem_public_key(pem, backend=default_backend())
+
+
+def load_directory(path):
+    keys = {}
+    for key_file in sorted(path.glob('*.pem')):
+        keys[key_file.stem] = load_pem(key_file.read_bytes())
+    return keys
+
+
+def load_jwks(path):
+    keys = {}
+    for jwk in json.loads(path.read_text())['keys']:
+        if jwk.get('kty') != 'RSA' or 'kid' not in jwk:
+            logger.warning(f'Ignoring unsupported JWK in {path}')
+            continue
+        keys[jwk['kid']] = RSAAlgorithm.from_jwk(json.dumps(jwk))
+    return keys
+
+
+class KeyRing:
+    """
+    Deserialized public keys indexed by key id (kid)
+
+    Keys are parsed once, and the source is checked for changes every
+    reload_interval seconds, so keys can be rotated without a restart.
+    """
+
+    def __init__(self, path=KEYRING_PATH, default_key=None,
+                 reload_interval=KEYRING_RELOAD_INTERVAL):
+        self.path = Path(path) if path else None
+        self.default_key = load_pem(default_key) if default_key else None
+        self.reload_interval = reload_interval
+        # Increased on every reload, to invalidate anything verified
+        # with the previous keys
+        self.generation = 0
+        self.keys = {}
+        self._signature = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def _source_signature(self):
+        if self.path is None or not self.path.exists():
+            return None
+        if self.path.is_dir():
+            files = sorted(self.path.glob('*.pem'))
+        else:
+            files = [self.path]
+        return tuple((str(f), f.stat().st_mtime_ns, f.stat().st_size)
+                     for f in files)
+
+    def _load(self):
+        keys = {}
+        if self.default_key is not None:
+            keys[DEFAULT_KID] = self.default_key
+        if self.path is None:
+            return keys
+
+        if self.path.is_dir():
+            keys.update(load_directory(self.path))
+        elif self.path.exists():
+            keys.update(load_jwks(self.path))
+        else:
+            logger.warning(f'Key ring source {self.path} does not exist')
+        return keys
+
+    def reload(self):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            signature = self._source_signature()
+            try:
+                keys = self._load()
+            except (OSError, ValueError, KeyError):
+                logger.exception(f'Error loading keys from {self.path}, '
+                                 'keeping previous keys')
+                return False
+
+            self.keys = keys
+            self._signature = signature
+            self.generation += 1
+            logger.info(f'Loaded keys {sorted(keys)}')
+            return True
+
+    def maybe_reload(self):
+        if time.monotonic() - self._checked_at < self.reload_interval:
+            return False
+
+        with self._lock:
+            self._checked_at = time.monotonic()
+            changed = self._source_signature() != self._signature
+        if changed:
+            return self.reload()
+        return False
+
+    def get_key(self, token):
+        """
+        Return the key matching the kid in the token header
+        """
+        kid = jwt.get_unverified_header(token).get('kid', DEFAULT_KID)
+        key = self.keys.get(kid)
+        if key is None:
+            raise jwt.exceptions.InvalidKeyError(f'Unknown key id "{kid}"')
+        return key
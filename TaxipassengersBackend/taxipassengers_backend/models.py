@@ -1,6 +1,7 @@
+import sqlite3
 from datetime import datetime
 
-from sqlalchemy import func
+from sqlalchemy import DDL, event, func
 from taxipassengers_backend.db import db
 
 
@@ -26,4 +27,157 @@ class PassengerModel(db.Model):
 
     suspendedAt = db.Column(db.DateTime, nullable=True)
     updateTimestamp = db.Column(db.DateTime, onupdate=datetime.now)
-    timestamp = db.Column(db.DateTime, server_default=func.now())
+    timestamp = db.Column(db.DateTime, server_default=func.now(), index=True)
+
+
+class BulkJobModel(db.Model):
+    """
+    Progress of a bulk operation on passengers, whose notifications are
+    sent in the background
+    """
+    __tablename__ = 'bulk_job'
+
+    id = db.Column(db.Integer, primary_key=True)
+    action = db.Column(db.String(50), nullable=False)
+    changed = db.Column(db.Integer, nullable=False, default=0)
+    notified = db.Column(db.Integer, nullable=False, default=0)
+    # SMS and emails of the notified passengers accepted by the gateways,
+    # and not, the failed ones are retried or dead lettered
+    sent = db.Column(db.Integer, nullable=False, default=0,
+                     server_default='0')
+    failed = db.Column(db.Integer, nullable=False, default=0,
+                       server_default='0')
+    createdAt = db.Column(db.DateTime, default=datetime.utcnow)
+    finishedAt = db.Column(db.DateTime, nullable=True)
+
+
+class IdempotencyKeyModel(db.Model):
+    """
+    Response of a write request, replayed for retries with the same
+    Idempotency-Key. status is NULL while the first request is running
+    """
+    __tablename__ = 'idempotency_key'
+
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), unique=True, nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.Integer, nullable=True)
+    body = db.Column(db.Text, nullable=True)
+    headers = db.Column(db.Text, nullable=True)
+    expiresAt = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class NotificationOutboxModel(db.Model):
+    """
+    Message to send, written in the transaction of the change it reports
+    and deleted once published by the outbox dispatcher
+    """
+    __tablename__ = 'notification_outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(10), nullable=False)
+    authorization = db.Column(db.Text, nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    availableAt = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class NotificationDeadLetterModel(db.Model):
+    """
+    Message that failed permanently or ran out of retries, with the last
+    gateway status and error
+    """
+    __tablename__ = 'notification_dead_letter'
+
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(10), nullable=False)
+    authorization = db.Column(db.Text, nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    status = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False)
+    failedAt = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class PassengerDailyStatsModel(db.Model):
+    """
+    Counters of the current passengers, grouped by signup day. Kept up to
+    date by taxipassengers_backend.stats on every passenger change
+    """
+    __tablename__ = 'passenger_daily_stats'
+
+    date = db.Column(db.Date, primary_key=True)
+    signups = db.Column(db.Integer, nullable=False, default=0)
+    suspensions = db.Column(db.Integer, nullable=False, default=0)
+    emailVerified = db.Column(db.Integer, nullable=False, default=0)
+    phoneVerified = db.Column(db.Integer, nullable=False, default=0)
+
+
+class PassengerHourlyStatsModel(db.Model):
+    """
+    Signups of the current passengers by UTC signup hour and status, so
+    time series in any time zone and with any status filter can be added
+    up from it
+    """
+    __tablename__ = 'passenger_hourly_stats'
+
+    hour = db.Column(db.DateTime, primary_key=True)
+    suspended = db.Column(db.Integer, primary_key=True)
+    emailStatus = db.Column(db.Integer, primary_key=True)
+    phoneNumberStatus = db.Column(db.Integer, primary_key=True)
+    signups = db.Column(db.Integer, nullable=False, default=0)
+
+
+# The FTS5 trigram tokenizer is in SQLite 3.34 and later, older versions
+# search with LIKE
+FTS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+# Search indexes used by taxipassengers_backend.search. Migrations create
+# the same objects, keep them in sync
+SEARCH_DDL = {
+    'postgresql': [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    ] + [
+        f'CREATE INDEX IF NOT EXISTS ix_passenger_model_{column}_trgm '
+        f'ON passenger_model USING gin ("{column}" gin_trgm_ops)'
+        for column in ('firstName', 'lastName', 'email', 'phoneNumber')
+    ],
+    'sqlite': [
+        'CREATE VIRTUAL TABLE IF NOT EXISTS passenger_search USING fts5('
+        'firstName, lastName, email, phoneNumber, '
+        "content='passenger_model', content_rowid='id', tokenize='trigram')",
+        'CREATE TRIGGER passenger_search_insert AFTER INSERT ON '
+        'passenger_model BEGIN '
+        'INSERT INTO passenger_search'
+        '(rowid, firstName, lastName, email, phoneNumber) VALUES '
+        '(new.id, new.firstName, new.lastName, new.email, new.phoneNumber); '
+        'END',
+        'CREATE TRIGGER passenger_search_delete AFTER DELETE ON '
+        'passenger_model BEGIN '
+        'INSERT INTO passenger_search'
+        '(passenger_search, rowid, firstName, lastName, email, phoneNumber) '
+        "VALUES ('delete', old.id, old.firstName, old.lastName, old.email, "
+        'old.phoneNumber); '
+        'END',
+        'CREATE TRIGGER passenger_search_update AFTER UPDATE OF '
+        'firstName, lastName, email, phoneNumber ON passenger_model BEGIN '
+        'INSERT INTO passenger_search'
+        '(passenger_search, rowid, firstName, lastName, email, phoneNumber) '
+        "VALUES ('delete', old.id, old.firstName, old.lastName, old.email, "
+        'old.phoneNumber); '
+        'INSERT INTO passenger_search'
+        '(rowid, firstName, lastName, email, phoneNumber) VALUES '
+        '(new.id, new.firstName, new.lastName, new.email, new.phoneNumber); '
+        'END',
+    ] if FTS_TRIGRAM else [],
+}
+
+for dialect, statements in SEARCH_DDL.items():
+    for statement in statements:
+        event.listen(PassengerModel.__table__, 'after_create',
+                     DDL(statement).execute_if(dialect=dialect))
+
+# The FTS table is not part of the metadata, drop it with its content table
+event.listen(PassengerModel.__table__, 'after_drop',
+             DDL('DROP TABLE IF EXISTS passenger_search').execute_if(
+                 dialect='sqlite'))
@@ -1,23 +1,71 @@
+import hashlib
 import http.client
-from datetime import datetime, timedelta
-
-from flask import abort
-from flask_restplus import Namespace, Resource, fields
-from sqlalchemy import func
+import io
+from datetime import datetime
+from functools import lru_cache
+from types import SimpleNamespace
+
+from flask import (Response, abort, current_app, request,
+                   stream_with_context, url_for)
+from flask_restplus import Namespace, Resource, fields, inputs
+from sqlalchemy import and_, or_, select
 from sqlalchemy.exc import IntegrityError
-
-from taxipassengers_backend import config
-from taxipassengers_backend.db import db
-from taxipassengers_backend.models import PassengerModel
-from taxipassengers_backend.templates.sms import template
+from sqlalchemy.orm import load_only
+from werkzeug.http import http_date, quote_etag
+
+from taxipassengers_backend.bulk import suspend_passengers
+from taxipassengers_backend.db import (db, insert_returning,
+                                       update_returning)
+from taxipassengers_backend.delivery import metrics as delivery_metrics
+from taxipassengers_backend.export import EXPORT_FORMATS, export_chunks
+from taxipassengers_backend.idempotency import idempotent
+from taxipassengers_backend.importer import (COLUMNS, IMPORT_BATCH_SIZE,
+                                             IMPORT_FORMATS, MAX_BATCH_SIZE,
+                                             import_passengers, signup_time)
+from taxipassengers_backend.models import (BulkJobModel,
+                                           NotificationDeadLetterModel,
+                                           NotificationOutboxModel,
+                                           PassengerModel)
+from taxipassengers_backend.outbox import queue_notification
+from taxipassengers_backend.search import (SEARCH_FIELDS, search_cursor,
+                                           search_passengers)
+from taxipassengers_backend.stats import (daily_signups, monthly_signups,
+                                          passenger_facets,
+                                          passenger_state,
+                                          record_passenger_changes,
+                                          record_passenger_created,
+                                          record_passenger_deleted,
+                                          record_passenger_updated,
+                                          record_search_update,
+                                          total_signups)
+from taxipassengers_backend.timeseries import (GRANULARITIES, MAX_BUCKETS,
+                                               count_buckets, iso_datetime,
+                                               signup_series, time_zone,
+                                               to_local)
 from taxipassengers_backend.token import validate_token_header
-from taxipassengers_backend.utils import html_to_string, format_string, send_notification
+from taxipassengers_backend.utils import (send_suspension_notifications,
+                                          send_welcome_notifications,
+                                          templates)
 
 api = Namespace('api', description='General API operations')
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+EXPORT_BATCH_SIZE = 1000
+MAX_BULK_IDS = 10000
+# Unique passenger columns, with the error when they are already used
+UNIQUE_COLUMNS = {
+    'authId': 'Auth Id has already been used to create a passenger',
+    'email': 'Email address has already been used by a passenger',
+    'phoneNumber': 'Phone number has already been used by a passenger',
+}
+# PATCH fields that can be set to null
+NULLABLE_FIELDS = ('dob', 'image', 'homeLocation', 'homePickupTime',
+                   'workLocation', 'workPickupTime', 'paymentMethod')
+
 
 def authentication_header_parser(value):
-    payload = validate_token_header(value, config.PUBLIC_KEY)
+    payload = validate_token_header(value, current_app.keyring)
     if payload is None:
         abort(401)
     return payload
@@ -63,6 +111,236 @@ model = {
 }
 passengerModel = api.model('Passenger', model)
 
+bulkJobModel = api.model('BulkJob', {
+    'id': fields.Integer(),
+    'action': fields.String(),
+    'changed': fields.Integer(),
+    'notified': fields.Integer(),
+    'sent': fields.Integer(),
+    'failed': fields.Integer(),
+    'createdAt': fields.DateTime(),
+    'finishedAt': fields.DateTime(),
+})
+
+
+def passenger_fields(value):
+    """
+    Comma separated list of passenger fields, for sparse fieldsets
+    """
+    selected = {field.strip() for field in value.split(',') if field.strip()}
+    unknown = selected - set(model)
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}')
+    # Keep the model order, so equal selections share the same output model
+    return tuple(field for field in model if field in selected)
+
+
+def page_cursor(value):
+    """
+    X-Next-Cursor of a page: the last id, or rank:id for search results
+    """
+    rank, _, passenger_id = value.rpartition(':')
+    if rank:
+        return float(rank), int(passenger_id)
+    return int(passenger_id)
+
+
+def passenger_ids(value):
+    """
+    JSON list of passenger ids, at most MAX_BULK_IDS
+    """
+    if not isinstance(value, list):
+        raise ValueError('A list of passenger ids is required')
+    if len(value) > MAX_BULK_IDS:
+        raise ValueError(f'At most {MAX_BULK_IDS} ids per request')
+    return [int(passengerId) for passengerId in value]
+
+
+@lru_cache(maxsize=None)
+def passenger_output(selected=None):
+    """
+    Output format restricted to the selected fields
+    """
+    if not selected:
+        return passengerModel
+    return {field: model[field] for field in selected}
+
+
+def passenger_query(selected=None):
+    """
+    Query loading only the columns of the selected fields, plus the ones
+    needed for the validators
+    """
+    query = PassengerModel.query
+    if selected:
+        columns = [getattr(PassengerModel, field) for field in selected]
+        columns += [PassengerModel.updateTimestamp, PassengerModel.timestamp]
+        query = query.options(load_only(*columns))
+    return query
+
+
+def validators_query():
+    """
+    Query loading only the columns needed for the validators
+    """
+    return db.session.query(PassengerModel.id,
+                            PassengerModel.updateTimestamp,
+                            PassengerModel.timestamp)
+
+
+def passenger_validators(rows, *parts):
+    """
+    Strong ETag and last modification time of the passengers, from the id
+    and last update of each one. The parts identify the representation
+    """
+    digest = hashlib.sha1()
+    modified = None
+    for part in parts:
+        if part is not None:
+            digest.update(f'{part};'.encode('utf8'))
+    for row in rows:
+        version = row.updateTimestamp or row.timestamp
+        digest.update(f'{row.id}:{version};'.encode('utf8'))
+        if version and (modified is None or version > modified):
+            modified = version
+    return digest.hexdigest(), modified
+
+
+def conflicting_columns(values):
+    """
+    Unique columns of the values already used by a passenger
+    """
+    passenger = PassengerModel.__table__
+    rows = db.session.execute(
+        select([passenger.c[name] for name in UNIQUE_COLUMNS]).where(or_(*[
+            passenger.c[name] == values[name] for name in UNIQUE_COLUMNS
+        ]))).fetchall()
+    return [name for name in UNIQUE_COLUMNS
+            if any(row[name] == values[name] for row in rows)]
+
+
+def queue_suspension_notification(passenger, authorization):
+    data = {'name': passenger.firstName}
+    email_message = templates.render('email/cascading_suspend.html', data)
+    sms_message = templates.render('sms/template.SUSPEND_MSG', data)
+
+    data = {
+        'phoneNumber': passenger.phoneNumber,
+        'email': passenger.email,
+        'subject': 'Alert: You have Been Suspended',
+        'typeMessage': 'Passenger Account Suspension',
+        'Authorization': authorization
+    }
+    queue_notification(data, email_message, sms_message)
+
+
+def validator_headers(etag, modified):
+    headers = {
+        'ETag': quote_etag(etag),
+        'Cache-Control': 'private, no-cache',
+    }
+    if modified is not None:
+        headers['Last-Modified'] = http_date(modified)
+    return headers
+
+
+def conditional_request():
+    return (bool(request.if_none_match)
+            or request.if_modified_since is not None)
+
+
+def not_modified(etag, modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and modified:
+        return modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def passenger_response(criterion, selected=None):
+    """
+    Response with the passenger matching the criterion and its validators.
+    Conditional requests are checked without loading the passenger
+    """
+    if conditional_request():
+        row = validators_query().filter(criterion).first()
+        if not row:
+            # The passenger does not exist
+            return '', http.client.NOT_FOUND
+        etag, modified = passenger_validators([row], selected)
+        if not_modified(etag, modified):
+            return ('', http.client.NOT_MODIFIED,
+                    validator_headers(etag, modified))
+
+    passenger = passenger_query(selected).filter(criterion).first()
+    if not passenger:
+        # The passenger does not exist
+        return '', http.client.NOT_FOUND
+
+    etag, modified = passenger_validators([passenger], selected)
+    return (api.marshal(passenger, passenger_output(selected)),
+            http.client.OK, validator_headers(etag, modified))
+
+
+def filter_passengers(query, args, search=True):
+    """
+    Apply the filterParser filters, search matches are not ranked
+    """
+    if args['status']:
+        if args['status'] == 'active' or args['status'] == 'suspended':
+            if args['status'] == 'active':
+                query = (query.filter(PassengerModel.suspendedAt == None))
+            else:
+                query = (query.filter(PassengerModel.suspendedAt != None))
+    if args['emailStatus']:
+        if args['emailStatus'] == 'verified' or args[
+                'emailStatus'] == 'unverified':
+            emailStatus = 1 if args['emailStatus'] == 'verified' else 0
+            query = (query.filter(
+                PassengerModel.emailStatus == emailStatus))
+    if args['phoneStatus']:
+        if args['phoneStatus'] == 'verified' or args[
+                'phoneStatus'] == 'unverified':
+            phoneStatus = 1 if args['phoneStatus'] == 'verified' else 0
+            query = (query.filter(
+                PassengerModel.phoneNumberStatus == phoneStatus))
+    if search and args['search']:
+        query = search_passengers(query, args['search'], args['searchField'],
+                                  ranked=False)
+
+    return query
+
+
+def passenger_page(query, args, limit):
+    """
+    Page of the filtered passengers. Keyset pagination on id, fetching one
+    more passenger to know if there is a next page. Search results are
+    ordered by relevance, and paginated on (rank, id)
+    """
+    query = filter_passengers(query, args, search=False)
+    after = args['after']
+    if (after is not None and
+            isinstance(after, tuple) != bool(args['search'])):
+        abort(http.client.BAD_REQUEST, 'Cursor of another listing')
+
+    if args['search']:
+        query = search_passengers(query, args['search'], args['searchField'],
+                                  after=after)
+        return query.limit(limit + 1)
+
+    # Every page is an index range scan on id
+    if after is not None:
+        query = query.filter(PassengerModel.id > after)
+    return query.order_by(PassengerModel.id).limit(limit + 1)
+
+
+def next_cursor(passenger, args):
+    if args['search']:
+        return search_cursor(passenger.id, args['search'],
+                             args['searchField'])
+    return str(passenger.id)
+
+
 # Input formats
 authenticationParser = api.parser()
 authenticationParser.add_argument('Authorization',
@@ -70,6 +348,13 @@ authenticationParser.add_argument('Authorization',
                                   type=str,
                                   help='Bearer Access Token')
 
+fieldsParser = authenticationParser.copy()
+fieldsParser.add_argument('fields',
+                          type=passenger_fields,
+                          location='args',
+                          help='Comma separated passenger fields to return, '
+                          'all by default')
+
 passengerParser = authenticationParser.copy()
 # passengerParser.add_argument(
 #     'authId',
@@ -134,6 +419,18 @@ passengerParser.add_argument('phoneNumberStatus',
                              required=False,
                              help="Has passenger's phone number been verified")
 
+# Rows of a passenger import, checked with the same rules
+importRowParser = passengerParser.copy()
+importRowParser.remove_argument('Authorization')
+importRowParser.add_argument('authId',
+                             type=int,
+                             required=True,
+                             help='Passenger\'s authentication Id')
+importRowParser.add_argument('timestamp',
+                             type=signup_time,
+                             required=False,
+                             help='Signup time, ISO 8601. Now by default')
+
 updatePassengerParser = passengerParser.copy()
 # updatePassengerParser.remove_argument('authId')
 updatePassengerParser.replace_argument('first',
@@ -166,11 +463,29 @@ updatePassengerParser.add_argument('rating',
                                    required=False,
                                    help="User's rating")
 
+# Fields left out of the JSON body are not changed, null clears a field.
+# Stored under the column names
+patchPassengerParser = updatePassengerParser.copy()
+patchPassengerParser.remove_argument('username')
+for argument in patchPassengerParser.args:
+    if argument.name != 'Authorization':
+        argument.location = 'json'
+        argument.store_missing = False
+        argument.nullable = argument.name in NULLABLE_FIELDS
+        argument.dest = COLUMNS.get(argument.name, argument.name)
+
 filterParser = authenticationParser.copy()
 filterParser.add_argument('search',
                           type=str,
                           location='args',
-                          help='Search for passenger by first name')
+                          help='Search for passenger by part of the name, '
+                          'email or phone number')
+filterParser.add_argument('searchField',
+                          type=str,
+                          choices=tuple(SEARCH_FIELDS),
+                          default='all',
+                          location='args',
+                          help='Passenger fields to search')
 filterParser.add_argument('status',
                           type=str,
                           choices=('active', 'suspended'),
@@ -187,6 +502,94 @@ filterParser.add_argument('emailStatus',
                           location='args',
                           help='Filter by passenger\'s email status')
 
+listParser = filterParser.copy()
+listParser.add_argument('limit',
+                        type=inputs.positive,
+                        location='args',
+                        help=f'Passengers per page, at most {MAX_PAGE_SIZE}')
+listParser.add_argument('after',
+                        type=page_cursor,
+                        location='args',
+                        help='Cursor from the X-Next-Cursor header of the '
+                        'previous page')
+listParser.add_argument('fields',
+                        type=passenger_fields,
+                        location='args',
+                        help='Comma separated passenger fields to return, '
+                        'all by default')
+
+exportParser = filterParser.copy()
+exportParser.add_argument('format',
+                          type=str,
+                          choices=tuple(EXPORT_FORMATS),
+                          default='ndjson',
+                          location='args',
+                          help='Export format')
+exportParser.add_argument('fields',
+                          type=passenger_fields,
+                          location='args',
+                          help='Comma separated passenger fields to export, '
+                          'all by default')
+
+timeseriesParser = filterParser.copy()
+timeseriesParser.remove_argument('search')
+timeseriesParser.remove_argument('searchField')
+timeseriesParser.add_argument('granularity',
+                              type=str,
+                              choices=GRANULARITIES,
+                              default='day',
+                              location='args',
+                              help='Bucket size')
+timeseriesParser.add_argument('tz',
+                              type=str,
+                              default='UTC',
+                              location='args',
+                              help='Time zone of the buckets, e.g. '
+                              'Africa/Lagos')
+timeseriesParser.add_argument('from',
+                              type=iso_datetime,
+                              required=True,
+                              location='args',
+                              help='Start, included. ISO 8601 date or time, '
+                              'in the tz time zone without an offset')
+timeseriesParser.add_argument('to',
+                              type=iso_datetime,
+                              required=True,
+                              location='args',
+                              help='End, excluded. ISO 8601 date or time, '
+                              'in the tz time zone without an offset')
+
+importParser = authenticationParser.copy()
+importParser.add_argument('format',
+                          type=str,
+                          choices=IMPORT_FORMATS,
+                          location='args',
+                          help='Format of the request body, from its '
+                          'Content-Type by default')
+importParser.add_argument('batchSize',
+                          type=inputs.int_range(1, MAX_BATCH_SIZE),
+                          default=IMPORT_BATCH_SIZE,
+                          location='args',
+                          help='Passengers inserted per transaction')
+importParser.add_argument('notify',
+                          type=inputs.boolean,
+                          default=True,
+                          location='args',
+                          help='Send welcome messages to the passengers')
+
+bulkSuspendParser = filterParser.copy()
+bulkSuspendParser.add_argument('ids',
+                               type=passenger_ids,
+                               location='json',
+                               help='Ids of the passengers')
+bulkSuspendParser.add_argument('suspend',
+                               type=int,
+                               choices=(0, 1),
+                               default=1,
+                               location='json',
+                               help='1 to suspend the passengers, 0 to '
+                               'reactivate them')
+
 dateQuery_parser = authenticationParser.copy()
 dateQuery_parser.add_argument('startdate',
                               type=str,
@@ -207,49 +610,37 @@ monthQuery_parser.add_argument('year',
 @api.route('/get/auth/<int:authId>/')
 class GetPassenger(Resource):
     @api.doc('get_auth_passenger')
-    @api.marshal_with(passengerModel)
-    @api.expect(authenticationParser)
+    @api.response(http.client.OK, 'Success', passengerModel)
+    @api.expect(fieldsParser)
     def get(self, authId: int):
         """
         Get passenger from auth Id
         """
-        args = authenticationParser.parse_args()
+        args = fieldsParser.parse_args()
         authentication_header_parser(args['Authorization'])
 
-        passenger = (
-            PassengerModel.query.filter(
-                PassengerModel.authId == authId
-            ).first()
-        )
-        if not passenger:
-            # The passenger does not exist
-            return '', http.client.NOT_FOUND
-
-        return passenger
+        return passenger_response(PassengerModel.authId == authId,
+                                  args['fields'])
 
 
 @api.route('/me/passenger/')
 class MePassenger(Resource):
     @api.doc('get_passenger')
-    @api.marshal_with(passengerModel)
-    @api.expect(authenticationParser)
+    @api.response(http.client.OK, 'Success', passengerModel)
+    @api.expect(fieldsParser)
     def get(self):
         """
         Get passenger from id in bearer token
         """
-        args = authenticationParser.parse_args()
+        args = fieldsParser.parse_args()
         payload = authentication_header_parser(args['Authorization'])
 
-        passenger = (PassengerModel.query.filter(
-            PassengerModel.authId == payload['id']).first())
-        if not passenger:
-            # The passenger does not exist
-            return '', http.client.NOT_FOUND
-
-        return passenger
+        return passenger_response(PassengerModel.authId == payload['id'],
+                                  args['fields'])
 
     @api.doc('create_passenger')
     @api.expect(passengerParser)
+    @idempotent
     def post(self):
         """
         Create a new passenger
@@ -258,35 +649,39 @@ class MePassenger(Resource):
         args = passengerParser.parse_args()
         payload = authentication_header_parser(args['Authorization'])
 
-        passenger = (PassengerModel.query.filter(
-            PassengerModel.authId == payload['id']).first())
-        if passenger:
-            result = {
-                'result': 'Auth Id has already been used to create a passenger'
-            }
-            return result, http.client.UNPROCESSABLE_ENTITY
+        values = {
+            'authId': payload['id'],
+            'firstName': args['first'],
+            'lastName': args['last'],
+            'dateOfBirth': args['dob'],
+            'email': args['email'],
+            'phoneNumber': args['phone'],
+            'image': args['image'],
+            'homeLocation': args['homeLocation'],
+            'homePickupTime': args['homePickupTime'],
+            'workLocation': args['workLocation'],
+            'workPickupTime': args['workPickupTime'],
+            'paymentMethod': args['paymentMethod'],
+            'emailStatus': 1,
+            'timestamp': datetime.utcnow(),
+        }
 
-        newPassenger = PassengerModel(authId=payload['id'],
-                                      firstName=args['first'],
-                                      lastName=args['last'],
-                                      dateOfBirth=args['dob'],
-                                      email=args['email'],
-                                      phoneNumber=args['phone'],
-                                      image=args['image'],
-                                      homeLocation=args['homeLocation'],
-                                      homePickupTime=args['homePickupTime'],
-                                      workLocation=args['workLocation'],
-                                      workPickupTime=args['workPickupTime'],
-                                      paymentMethod=args['paymentMethod'],
-                                      emailStatus=1,
-                                      timestamp=datetime.utcnow())
-
-        db.session.add(newPassenger)
-        try:
-            db.session.commit()
-        except IntegrityError:
+        # A single statement, a taken authId, email or phone number is not
+        # inserted instead of failing
+        passenger = PassengerModel.__table__
+        row = insert_returning(passenger, values, list(passenger.c))
+        if row is None:
             db.session.rollback()
-            return '', http.client.UNPROCESSABLE_ENTITY
+            conflicts = conflicting_columns(values)
+            messages = [UNIQUE_COLUMNS[name] for name in conflicts]
+            if not messages:
+                # The other passenger was deleted in the meantime
+                messages = ['The passenger could not be created, try again']
+            result = {'result': ' '.join(messages), 'conflicts': conflicts}
+            return result, http.client.UNPROCESSABLE_ENTITY
+
+        newPassenger = SimpleNamespace(**dict(zip(passenger.c.keys(), row)))
+        record_passenger_created(newPassenger)
 
         # todo: update
         data = {
@@ -295,9 +690,8 @@ class MePassenger(Resource):
             'pin': '1234'
         }
 
-        email_message = html_to_string('templates/email/welcome.html',
-                                       data=data)
-        sms_message = format_string(template.WELCOME_MSG, data=data)
+        email_message = templates.render('email/welcome.html', data)
+        sms_message = templates.render('sms/template.WELCOME_MSG', data)
 
         data = {
             'phoneNumber': args['phone'],
@@ -307,7 +701,9 @@ class MePassenger(Resource):
             'Authorization': args['Authorization']
         }
 
-        send_notification(data, email_message, sms_message)
+        # Sent by the outbox dispatcher once committed
+        queue_notification(data, email_message, sms_message)
+        db.session.commit()
 
         result = api.marshal(newPassenger, passengerModel)
         return result, http.client.CREATED
@@ -316,66 +712,169 @@ class MePassenger(Resource):
 @api.route('/passenger/')
 class PassengerList(Resource):
     @api.doc('list_passengers')
-    @api.marshal_with(passengerModel, as_list=True)
-    @api.expect(filterParser)
+    @api.response(http.client.OK, 'Success', [passengerModel])
+    @api.expect(listParser)
     def get(self):
         """
-        Retrieve all passengers
+        Retrieve a page of passengers, ordered by id
         """
-        args = filterParser.parse_args()
+        args = listParser.parse_args()
         authentication_header_parser(args['Authorization'])
 
-        query = PassengerModel.query
-        if args['search']:
-            search_param = args['search']
-            param = f'%{search_param}%'
-            query = (query.filter(PassengerModel.firstName.ilike(param)))
-        if args['status']:
-            if args['status'] == 'active' or args['status'] == 'suspended':
-                if args['status'] == 'active':
-                    query = (query.filter(PassengerModel.suspendedAt == None))
-                else:
-                    query = (query.filter(PassengerModel.suspendedAt != None))
-        if args['emailStatus']:
-            if args['emailStatus'] == 'verified' or args[
-                    'emailStatus'] == 'unverified':
-                emailStatus = 1 if args['emailStatus'] == 'verified' else 0
-                query = (query.filter(
-                    PassengerModel.emailStatus == emailStatus))
-        if args['phoneStatus']:
-            if args['phoneStatus'] == 'verified' or args[
-                    'phoneStatus'] == 'unverified':
-                phoneStatus = 1 if args['phoneStatus'] == 'verified' else 0
-                query = (query.filter(
-                    PassengerModel.phoneNumberStatus == phoneStatus))
-
-        query = query.order_by('id')
-        passengers = query.all()
-
-        return passengers
+        limit = min(args['limit'] or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        parts = (args['fields'], bool(args['search']))
+        if conditional_request():
+            rows = passenger_page(validators_query(), args, limit).all()
+            etag, modified = passenger_validators(rows, *parts)
+            if not_modified(etag, modified):
+                return ('', http.client.NOT_MODIFIED,
+                        validator_headers(etag, modified))
+
+        passengers = passenger_page(passenger_query(args['fields']), args,
+                                    limit).all()
+        etag, modified = passenger_validators(passengers, *parts)
+        headers = validator_headers(etag, modified)
+        if len(passengers) > limit:
+            passengers = passengers[:limit]
+            headers['X-Next-Cursor'] = next_cursor(passengers[-1], args)
+
+        output = passenger_output(args['fields'])
+        return api.marshal(passengers, output), http.client.OK, headers
+
+
+@api.route('/passenger/export/')
+class PassengerExport(Resource):
+    @api.doc('export_passengers')
+    @api.expect(exportParser)
+    def get(self):
+        """
+        Stream all the passengers matching the filters, only accessible by
+        admins
+        """
+        check_admin_return_payload(exportParser)
+        args = exportParser.parse_args()
+
+        names = args['fields'] or tuple(model)
+        columns = [getattr(PassengerModel, name) for name in names]
+        query = filter_passengers(db.session.query(*columns), args)
+        # Rows are fetched in batches through a server side cursor, so
+        # memory use doesn't depend on the table size
+        rows = (query.order_by(PassengerModel.id)
+                .execution_options(stream_results=True)
+                .yield_per(EXPORT_BATCH_SIZE))
+
+        export_format = args['format']
+        filename = f'passengers.{export_format}'
+        return Response(
+            stream_with_context(export_chunks(rows, names, export_format)),
+            mimetype=EXPORT_FORMATS[export_format],
+            headers={
+                'Content-Disposition': f'attachment; filename={filename}'
+            })
+
+
+@api.route('/passenger/import/')
+class PassengerImport(Resource):
+    @api.doc('import_passengers')
+    @api.expect(importParser)
+    def post(self):
+        """
+        Create passengers from an NDJSON or CSV request body, only
+        accessible by admins
+        """
+        check_admin_return_payload(importParser)
+        args = importParser.parse_args()
+
+        on_batch = None
+        if args['notify']:
+            def on_batch(passengers):
+                send_welcome_notifications(passengers, args['Authorization'])
+
+        # Read as it's received, not loaded in memory
+        lines = io.TextIOWrapper(request.stream, encoding='utf-8')
+        import_format = args['format'] or (
+            'csv' if request.mimetype == EXPORT_FORMATS['csv'] else 'ndjson')
+        result = import_passengers(lines, import_format,
+                                   importRowParser.args, args['batchSize'],
+                                   on_batch)
+        return result.to_dict(), http.client.OK
+
+
+@api.route('/passenger/suspend/')
+class PassengerBulkSuspend(Resource):
+    @api.doc('bulk_suspend_passengers',
+             responses={http.client.ACCEPTED: 'Notifications queued'})
+    @api.response(http.client.OK, 'Success', bulkJobModel)
+    @api.expect(bulkSuspendParser)
+    @idempotent
+    def post(self):
+        """
+        Suspend or reactivate the passengers with the ids and matching the
+        filters, only accessible by admins. The suspension messages are
+        sent in the background, GET the Location for their progress
+        """
+        check_admin_return_payload(bulkSuspendParser)
+        args = bulkSuspendParser.parse_args()
+
+        conditions = []
+        if args['ids']:
+            conditions.append(PassengerModel.id.in_(args['ids']))
+        if any(args[name] for name in ('search', 'status', 'emailStatus',
+                                       'phoneStatus')):
+            query = filter_passengers(db.session.query(PassengerModel.id),
+                                      args)
+            conditions.append(PassengerModel.id.in_(query.subquery()))
+        if not conditions:
+            # Not every passenger at once by mistake
+            abort(http.client.BAD_REQUEST, 'ids or a filter are required')
+
+        job, passengers = suspend_passengers(and_(*conditions),
+                                             args['suspend'] == 1)
+        if job.finishedAt is not None:
+            return api.marshal(job, bulkJobModel), http.client.OK
+
+        send_suspension_notifications(job, passengers, args['Authorization'])
+        location = url_for(PassengerBulkJob.endpoint, jobId=job.id)
+        return (api.marshal(job, bulkJobModel), http.client.ACCEPTED,
+                {'Location': location})
+
+
+@api.route('/passenger/suspend/<int:jobId>/')
+class PassengerBulkJob(Resource):
+    @api.doc('retrieve_bulk_job')
+    @api.response(http.client.OK, 'Success', bulkJobModel)
+    @api.expect(authenticationParser)
+    def get(self, jobId: int):
+        """
+        Progress of a bulk suspension, only accessible by admins
+        """
+        check_admin_return_payload(authenticationParser)
+
+        job = BulkJobModel.query.get(jobId)
+        if not job:
+            return '', http.client.NOT_FOUND
+
+        return api.marshal(job, bulkJobModel), http.client.OK
 
 
 @api.route('/passenger/<int:passengerId>/')
 class Passenger(Resource):
     @api.doc('retrieve_passenger')
-    @api.marshal_with(passengerModel)
-    @api.expect(authenticationParser)
+    @api.response(http.client.OK, 'Success', passengerModel)
+    @api.expect(fieldsParser)
     def get(self, passengerId: int):
         """
         Retrieve a passenger using Id
         """
         # authenticate bearer token
-        args = authenticationParser.parse_args()
+        args = fieldsParser.parse_args()
         authentication_header_parser(args['Authorization'])
 
-        passenger = PassengerModel.query.get(passengerId)
-        if not passenger:
-            # The passenger does not exist
-            return '', http.client.NOT_FOUND
-
-        return passenger
+        return passenger_response(PassengerModel.id == passengerId,
+                                  args['fields'])
 
     @api.doc('update_passenger')
+    @idempotent
     @api.marshal_with(passengerModel)
     @api.expect(updatePassengerParser)
     def put(self, passengerId: int):
@@ -401,7 +900,14 @@ class Passenger(Resource):
             else:
                 abort(403)
 
+        # optimistic concurrency, the client copy has to be current
+        if request.if_match:
+            etag, _ = passenger_validators([passenger])
+            if not request.if_match.contains(etag):
+                abort(http.client.PRECONDITION_FAILED)
+
         oldStatus = passenger.suspendedAt
+        oldState = passenger_state(passenger)
 
         passenger.firstName = args['first'] or passenger.firstName
         passenger.lastName = args['last'] or passenger.lastName
@@ -432,26 +938,84 @@ class Passenger(Resource):
             else:
                 passenger.suspendedAt = None
 
-            # send notification after updating passenger status
+            # notify with the change, once committed
             if args['suspend'] == 1 and oldStatus is None:
-                data = {'name': passenger.firstName}
-                email_message = html_to_string(
-                    'templates/email/cascading_suspend.html', data=data)
-                sms_message = format_string(template.SUSPEND_MSG, data=data)
-
-                data = {
-                    'phoneNumber': passenger.phoneNumber,
-                    'email': passenger.email,
-                    'subject': 'Alert: You have Been Suspended',
-                    'typeMessage': 'Passenger Account Suspension',
-                    'Authorization': args['Authorization']
-                }
-                send_notification(data, email_message, sms_message)
+                queue_suspension_notification(passenger,
+                                              args['Authorization'])
 
         db.session.add(passenger)
+        record_passenger_updated(passenger, oldState)
+        db.session.commit()
+
+        etag, modified = passenger_validators([passenger])
+        return passenger, http.client.OK, validator_headers(etag, modified)
+
+    @api.doc('patch_passenger')
+    @api.response(http.client.OK, 'Success', passengerModel)
+    @api.expect(patchPassengerParser)
+    @idempotent
+    def patch(self, passengerId: int):
+        """
+        Update the fields given of a passenger, in a single UPDATE. Only
+        accessible by the passenger and admins
+        """
+        args = patchPassengerParser.parse_args()
+        authorization = args.pop('Authorization')
+        payload = authentication_header_parser(authorization)
+
+        passenger = PassengerModel.__table__
+        condition = passenger.c.id == passengerId
+        if 'admin' not in payload:
+            # Other passengers are not found, without reading the owner
+            condition = and_(condition, passenger.c.authId == payload['id'])
+
+        values = dict(args)
+        suspend = values.pop('suspend', None)
+        if suspend is not None:
+            values['suspendedAt'] = datetime.utcnow() if suspend else None
+        if not values:
+            abort(http.client.BAD_REQUEST, 'No fields to update')
+
+        # The old state is returned for the rollups and the If-Match check
+        old_columns = (passenger.c.id, passenger.c.timestamp,
+                       passenger.c.suspendedAt, passenger.c.emailStatus,
+                       passenger.c.phoneNumberStatus,
+                       passenger.c.updateTimestamp)
+        try:
+            rows = update_returning(passenger, condition, values,
+                                    list(passenger.c), old_columns)
+        except IntegrityError:
+            db.session.rollback()
+            return '', http.client.UNPROCESSABLE_ENTITY
+        if not rows:
+            db.session.rollback()
+            return '', http.client.NOT_FOUND
+
+        columns = len(passenger.c)
+        updated = SimpleNamespace(**dict(zip(passenger.c.keys(),
+                                             rows[0][:columns])))
+        old = SimpleNamespace(**{
+            column.name: value
+            for column, value in zip(old_columns, rows[0][columns:])
+        })
+
+        # optimistic concurrency, the update is undone for a stale copy
+        if request.if_match:
+            etag, _ = passenger_validators([old])
+            if not request.if_match.contains(etag):
+                db.session.rollback()
+                abort(http.client.PRECONDITION_FAILED)
+
+        record_passenger_changes([(passenger_state(old),
+                                   passenger_state(updated))])
+        record_search_update(values)
+        if suspend and old.suspendedAt is None:
+            queue_suspension_notification(updated, authorization)
         db.session.commit()
 
-        return passenger
+        etag, modified = passenger_validators([updated])
+        return (api.marshal(updated, passengerModel), http.client.OK,
+                validator_headers(etag, modified))
 
     @api.doc('delete_passenger',
              responses={http.client.NO_CONTENT: 'No content'})
@@ -469,6 +1033,7 @@ class Passenger(Resource):
             # The passenger does not exist
             return '', http.client.NO_CONTENT
 
+        record_passenger_deleted(passenger)
         db.session.delete(passenger)
         db.session.commit()
 
@@ -514,8 +1079,37 @@ class PassengerSummaryQuery(Resource):
         args = authenticationParser.parse_args()
         authentication_header_parser(args['Authorization'])
 
-        count = (PassengerModel.query.count())
-        return count
+        return current_app.stats_cache.get_or_compute('sumquery', {},
+                                                      total_signups)
+
+
+@api.route('/stat/facets/')
+class PassengerFacets(Resource):
+    @api.doc('query count in db: by status and verification')
+    @api.expect(filterParser)
+    def get(self):
+        """
+        Help find the passenger counts by status, email and phone
+        verification, for the passengers matching the filters
+        """
+        args = filterParser.parse_args()
+        authentication_header_parser(args['Authorization'])
+
+        filters = {name: args[name]
+                   for name in ('search', 'status', 'emailStatus',
+                                'phoneStatus')}
+        if filters['search']:
+            filters['searchField'] = args['searchField']
+
+        def compute():
+            query = None
+            if any(filters.values()):
+                query = filter_passengers(db.session.query(PassengerModel),
+                                          args)
+            return passenger_facets(query)
+
+        return current_app.stats_cache.get_or_compute('facets', filters,
+                                                      compute)
 
 
 @api.route('/stat/datequery/')
@@ -535,21 +1129,64 @@ class PassengerDateQuery(Resource):
         start_date = datetime.strptime(start_date_str, "%d/%m/%Y").date()
         end_date = datetime.strptime(end_date_str, "%d/%m/%Y").date()
 
-        result = {}
-
         if start_date > end_date:
             return '', http.client.BAD_REQUEST
 
-        while start_date <= end_date:
-            passengers = (db.session.query(func.count(
-                PassengerModel.id)).filter(
-                    func.date(PassengerModel.timestamp) == start_date).all())
-            date = start_date.strftime("%d/%m/%Y")
-            result[date] = passengers[0][0]
+        def compute():
+            signups = daily_signups(start_date, end_date)
+            return {day.strftime("%d/%m/%Y"): count
+                    for day, count in signups.items()}
 
-            start_date = start_date + timedelta(days=1)
+        return current_app.stats_cache.get_or_compute(
+            'datequery', {'start': start_date, 'end': end_date}, compute)
 
-        return result
+
+@api.route('/stat/timeseries/')
+class PassengerTimeseries(Resource):
+    @api.doc('query count in db: by hour, day, week or month')
+    @api.expect(timeseriesParser)
+    def get(self):
+        """
+        Help find the signups per hour, day, week or month in a time zone
+        """
+        args = timeseriesParser.parse_args()
+        authentication_header_parser(args['Authorization'])
+
+        try:
+            zone = time_zone(args['tz'])
+        except ValueError as error:
+            abort(http.client.BAD_REQUEST, str(error))
+        granularity = args['granularity']
+        start = to_local(args['from'], zone)
+        end = to_local(args['to'], zone)
+        if start >= end:
+            abort(http.client.BAD_REQUEST, '"from" must be before "to"')
+        if count_buckets(start, end, granularity) > MAX_BUCKETS:
+            abort(http.client.BAD_REQUEST,
+                  f'More than {MAX_BUCKETS} buckets, use a larger '
+                  'granularity or a shorter range')
+
+        filters = {name: args[name]
+                   for name in ('status', 'emailStatus', 'phoneStatus')}
+
+        def compute():
+            query = filter_passengers(db.session.query(PassengerModel), args,
+                                      search=False)
+            series = signup_series(start, end, granularity, zone, filters,
+                                   query)
+            return {
+                'granularity': granularity,
+                'tz': zone.zone,
+                'from': zone.localize(start).isoformat(),
+                'to': zone.localize(end).isoformat(),
+                'buckets': [{'start': bucket.isoformat(), 'count': count}
+                            for bucket, count in series],
+            }
+
+        key = dict(filters, granularity=granularity, tz=zone.zone,
+                   start=start.isoformat(), end=end.isoformat())
+        return current_app.stats_cache.get_or_compute('timeseries', key,
+                                                      compute)
 
 
 @api.route('/stat/monthquery/')
@@ -569,19 +1206,30 @@ class PassengerMonthQuery(Resource):
         except ValueError:
             return '', http.client.BAD_REQUEST
 
-        result = {}
-
         if year < 2020:
             return '', http.client.BAD_REQUEST
 
-        for month in range(1, 13):
-            passengers = (db.session.query(func.count(
-                PassengerModel.id)).filter(
-                    func.extract('year', PassengerModel.timestamp) ==
-                    year).filter(
-                        func.extract('month', PassengerModel.timestamp) ==
-                        month).all())
+        def compute():
+            signups = monthly_signups(year)
+            return {f'{month}': count for month, count in signups.items()}
+
+        return current_app.stats_cache.get_or_compute(
+            'monthquery', {'year': year}, compute)
+
 
-            result[f'{month}'] = passengers[0][0]
+@api.route('/stat/notifications/')
+class NotificationMetrics(Resource):
+    @api.doc('notification delivery metrics')
+    @api.expect(authenticationParser)
+    def get(self):
+        """
+        Messages sent, retried and dead lettered per channel, and the
+        messages waiting in the outbox and the dead letters. Only
+        accessible by admins
+        """
+        check_admin_return_payload(authenticationParser)
 
+        result = delivery_metrics()
+        result['outbox'] = NotificationOutboxModel.query.count()
+        result['deadLetters'] = NotificationDeadLetterModel.query.count()
         return result
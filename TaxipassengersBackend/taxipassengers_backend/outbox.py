@@ -0,0 +1,157 @@
+"""
+Transactional outbox of the notifications
+
+The API writes the messages of a change to the notification_outbox table
+in the transaction of the change, instead of publishing them to the
+broker during the request. They are sent if and only if the change is
+committed, and a slow or unavailable broker doesn't delay or fail the
+request. The dispatcher takes the oldest messages in batches, publishes
+them as a send_batch task per channel and header and deletes them in the
+same transaction. On PostgreSQL the batch is locked with FOR UPDATE SKIP
+LOCKED, so several dispatchers take distinct messages; SQLite runs one
+dispatcher at a time. Messages that failed to publish are retried after
+OUTBOX_RETRY_DELAY seconds. Delivery is at least once, a dispatcher
+stopped between publishing and committing publishes the batch again.
+"""
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import false, select
+
+from taxipassengers_backend.db import db
+from taxipassengers_backend.models import (NotificationDeadLetterModel,
+                                           NotificationOutboxModel)
+from taxipassengers_backend.utils import notification_messages, queue_batch
+
+logger = logging.getLogger(__name__)
+
+# Messages taken per dispatcher transaction
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 500))
+# Seconds before a message that failed to publish is tried again
+OUTBOX_RETRY_DELAY = int(os.environ.get('OUTBOX_RETRY_DELAY', 30))
+# Seconds the dispatcher waits when the outbox is empty
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 1))
+
+
+def queue_notification(data, email_msg, sms_msg):
+    """
+    Add the SMS and email of a notification to the outbox, committed
+    with the session
+    """
+    sms_data, email_data, header = notification_messages(data, email_msg,
+                                                         sms_msg)
+    now = datetime.utcnow()
+    db.session.execute(NotificationOutboxModel.__table__.insert(), [{
+        'channel': channel,
+        'authorization': header['Authorization'],
+        'message': json.dumps(message),
+        'attempts': 0,
+        'availableAt': now,
+    } for channel, message in (('sms', sms_data), ('email', email_data))])
+
+
+def take_batch(batch_size):
+    table = NotificationOutboxModel.__table__
+    query = select([table]).where(
+        table.c.availableAt <= datetime.utcnow()
+    ).order_by(table.c.id).limit(batch_size)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+    else:
+        # Takes the write lock first, another dispatcher waits for the
+        # commit instead of reading the same messages
+        db.session.execute(table.update().where(false()).values(attempts=0))
+    return db.session.execute(query).fetchall()
+
+
+def dispatch(batch_size=OUTBOX_BATCH_SIZE, publish=queue_batch):
+    """
+    Publish a batch of messages, returns how many were taken
+    """
+    table = NotificationOutboxModel.__table__
+    rows = take_batch(batch_size)
+    groups = {}
+    for row in rows:
+        ids, messages = groups.setdefault((row.channel, row.authorization),
+                                          ([], []))
+        ids.append(row.id)
+        messages.append(json.loads(row.message))
+
+    published, failed = [], []
+    for (channel, authorization), (ids, messages) in groups.items():
+        try:
+            publish(channel, messages, {'Authorization': authorization})
+            published.extend(ids)
+        except Exception:
+            logger.exception(f'Publishing {len(ids)} {channel} messages '
+                             f'failed, retrying in {OUTBOX_RETRY_DELAY}s')
+            failed.extend(ids)
+
+    if published:
+        db.session.execute(table.delete().where(table.c.id.in_(published)))
+    if failed:
+        db.session.execute(table.update().where(table.c.id.in_(failed)).values(
+            attempts=table.c.attempts + 1,
+            availableAt=datetime.utcnow() + timedelta(
+                seconds=OUTBOX_RETRY_DELAY)))
+    db.session.commit()
+    return len(rows)
+
+
+def drain(batch_size=OUTBOX_BATCH_SIZE, publish=queue_batch):
+    """
+    Dispatch until no message is waiting, returns how many were taken
+    """
+    total = 0
+    while True:
+        taken = dispatch(batch_size, publish)
+        total += taken
+        if taken < batch_size:
+            return total
+
+
+def requeue_dead_letters(channel=None):
+    """
+    Move the dead lettered messages back to the outbox, returns how many
+    """
+    dead = NotificationDeadLetterModel.__table__
+    query = select([dead])
+    if channel:
+        query = query.where(dead.c.channel == channel)
+    rows = db.session.execute(query).fetchall()
+    if rows:
+        now = datetime.utcnow()
+        db.session.execute(NotificationOutboxModel.__table__.insert(), [{
+            'channel': row.channel,
+            'authorization': row.authorization,
+            'message': row.message,
+            'attempts': 0,
+            'availableAt': now,
+        } for row in rows])
+        db.session.execute(dead.delete().where(
+            dead.c.id.in_([row.id for row in rows])))
+    db.session.commit()
+    return len(rows)
+
+
+def run_dispatcher(batch_size=OUTBOX_BATCH_SIZE,
+                   interval=OUTBOX_POLL_INTERVAL):
+    """
+    Drain the outbox every interval seconds, until stopped. An error, e.g.
+    the database unavailable, is logged and the outbox drained again after
+    the interval
+    """
+    while True:
+        try:
+            taken = drain(batch_size)
+        except Exception:
+            logger.exception(f'Dispatching the outbox failed, retrying in '
+                             f'{interval}s')
+            db.session.rollback()
+        else:
+            if taken:
+                logger.info(f'Published {taken} outbox messages')
+        time.sleep(interval)
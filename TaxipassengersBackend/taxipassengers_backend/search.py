@@ -0,0 +1,135 @@
+"""
+Indexed substring search over passenger names, email and phone number
+
+On PostgreSQL the ILIKE filters are served by pg_trgm GIN indexes and
+ranked by trigram similarity. On SQLite 3.34 and later they go through
+the FTS5 trigram table passenger_search, kept in sync with triggers; older
+versions have no trigram tokenizer and scan with LIKE.
+"""
+from sqlalchemy import and_, cast, column, func, or_, select, table
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+
+from taxipassengers_backend.db import db
+from taxipassengers_backend import models
+from taxipassengers_backend.models import PassengerModel
+
+SEARCH_FIELDS = {
+    'name': ('firstName', 'lastName'),
+    'email': ('email',),
+    'phone': ('phoneNumber',),
+    'all': ('firstName', 'lastName', 'email', 'phoneNumber'),
+}
+
+# Trigram indexes can't match shorter terms
+MIN_INDEXED_LENGTH = 3
+
+passenger_search = table('passenger_search', column('rowid'), column('rank'),
+                         column('passenger_search'))
+
+
+def like_pattern(term):
+    escaped = (term.replace('\\', '\\\\').replace('%', '\\%')
+               .replace('_', '\\_'))
+    return f'%{escaped}%'
+
+
+def like_filter(columns, term):
+    pattern = like_pattern(term)
+    return or_(*[col.ilike(pattern, escape='\\') for col in columns])
+
+
+def fts_query(names, term):
+    phrase = '"{}"'.format(term.replace('"', '""'))
+    return '{%s} : %s' % (' '.join(names), phrase)
+
+
+def search_method(term):
+    """
+    'fts' for the FTS5 table, 'trigram' for the pg_trgm indexes, or 'like'
+    """
+    if len(term) < MIN_INDEXED_LENGTH:
+        return 'like'
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        return 'fts' if models.FTS_TRIGRAM else 'like'
+    return {'postgresql': 'trigram'}.get(dialect, 'like')
+
+
+def fts_matches(names, term):
+    return select([
+        passenger_search.c.rowid.label('id'),
+        passenger_search.c.rank.label('rank'),
+    ]).where(passenger_search.c.passenger_search.match(
+        fts_query(names, term)))
+
+
+def similarity(columns, term):
+    # real in PostgreSQL, as double precision the rank of a cursor is read
+    # and compared back exactly
+    return cast(func.greatest(*[func.similarity(col, term)
+                                for col in columns]), DOUBLE_PRECISION)
+
+
+def after_rank(rank, after, descending=False):
+    """
+    Condition of the passengers after the (rank, id) cursor
+    """
+    value, passenger_id = after
+    beyond = rank < value if descending else rank > value
+    return or_(beyond, and_(rank == value, PassengerModel.id > passenger_id))
+
+
+def search_passengers(query, term, field='all', ranked=True, after=None):
+    """
+    Filter the passenger query by the term, ordered by relevance unless
+    ranked is False. after is the (rank, id) of the last passenger of the
+    previous page, from search_cursor
+    """
+    names = SEARCH_FIELDS[field]
+    columns = [getattr(PassengerModel, name) for name in names]
+    method = search_method(term)
+
+    if method == 'fts':
+        matches = fts_matches(names, term)
+        if not ranked:
+            return query.filter(PassengerModel.id.in_(
+                matches.with_only_columns([passenger_search.c.rowid])))
+
+        matches = matches.alias('matches')
+        query = query.join(matches, matches.c.id == PassengerModel.id)
+        if after is not None:
+            query = query.filter(after_rank(matches.c.rank, after))
+        return query.order_by(matches.c.rank, PassengerModel.id)
+
+    query = query.filter(like_filter(columns, term))
+    if not ranked:
+        return query
+
+    if method == 'trigram':
+        rank = similarity(columns, term)
+        if after is not None:
+            query = query.filter(after_rank(rank, after, descending=True))
+        return query.order_by(rank.desc(), PassengerModel.id)
+
+    if after is not None:
+        query = query.filter(PassengerModel.id > after[1])
+    return query.order_by(PassengerModel.id)
+
+
+def search_cursor(passenger_id, term, field='all'):
+    """
+    Cursor of the search results after the passenger, as rank:id
+    """
+    names = SEARCH_FIELDS[field]
+    method = search_method(term)
+    rank = 0.0
+    if method == 'fts':
+        rank = db.session.execute(
+            fts_matches(names, term)
+            .with_only_columns([passenger_search.c.rank])
+            .where(passenger_search.c.rowid == passenger_id)).scalar()
+    elif method == 'trigram':
+        columns = [getattr(PassengerModel, name) for name in names]
+        rank = (db.session.query(similarity(columns, term))
+                .filter(PassengerModel.id == passenger_id).scalar())
+    return f'{rank!r}:{passenger_id}'
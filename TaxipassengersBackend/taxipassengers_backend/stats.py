@@ -0,0 +1,381 @@
+from collections import Counter, defaultdict, namedtuple
+from datetime import date, datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import and_, bindparam, case, event, func, inspect, select
+from sqlalchemy.exc import IntegrityError
+
+from taxipassengers_backend.db import db
+from taxipassengers_backend.models import (PassengerDailyStatsModel,
+                                           PassengerHourlyStatsModel,
+                                           PassengerModel)
+from taxipassengers_backend.search import SEARCH_FIELDS
+
+COUNTERS = ('signups', 'suspensions', 'emailVerified', 'phoneVerified')
+HOURLY_KEY = ('hour', 'suspended', 'emailStatus', 'phoneNumberStatus')
+# Stands for a NULL status in the hourly rollup
+NO_STATUS = -1
+
+# Session info flag, set when the transaction changes the rollups
+STATS_CHANGED = 'daily_stats_changed'
+# Keys per IN (...) when looking for existing rollup rows
+KEY_CHUNK_SIZE = 500
+
+
+def date_range(start_date, end_date):
+    day = start_date
+    while day <= end_date:
+        yield day
+        day += timedelta(days=1)
+
+
+# Strings of date() and strftime() in SQLite, parsed with strptime as
+# fromisoformat needs Python 3.7
+SQLITE_DATE = '%Y-%m-%d'
+SQLITE_DATETIME = '%Y-%m-%d %H:%M:%S'
+
+
+def as_date(value):
+    # date() is a string in SQLite and a date in PostgreSQL
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, SQLITE_DATE).date()
+
+
+def as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.strptime(value, SQLITE_DATETIME)
+
+
+class PassengerState(namedtuple('PassengerState', (
+        'timestamp', 'suspended', 'emailStatus', 'phoneNumberStatus'))):
+    """
+    What a passenger counts for in the rollups
+    """
+
+    def daily_counters(self):
+        return {
+            'signups': 1,
+            'suspensions': self.suspended,
+            'emailVerified': int(self.emailStatus == 1),
+            'phoneVerified': int(self.phoneNumberStatus == 1),
+        }
+
+    def hourly_key(self):
+        return (self.timestamp.replace(minute=0, second=0, microsecond=0),
+                self.suspended, self.emailStatus, self.phoneNumberStatus)
+
+
+def status_key(status):
+    # Key columns can't be NULL
+    return NO_STATUS if status is None else status
+
+
+def passenger_state(passenger):
+    return PassengerState(passenger.timestamp or datetime.utcnow(),
+                          int(passenger.suspendedAt is not None),
+                          status_key(passenger.emailStatus),
+                          status_key(passenger.phoneNumberStatus))
+
+
+def increment(table, key, deltas):
+    """
+    Add the deltas to the counters of the row with the key, in the current
+    transaction
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    # Pending passenger changes go first, their errors are not ours
+    db.session.flush()
+
+    condition = and_(*[table.c[name] == value for name, value in key.items()])
+    update = (table.update().where(condition).values({
+        name: table.c[name] + delta
+        for name, delta in deltas.items()
+    }))
+    if not db.session.execute(update).rowcount:
+        # First change of the row. Another transaction can create it at the
+        # same time, then the update goes through
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(**key, **deltas))
+        except IntegrityError:
+            db.session.execute(update)
+
+    db.session.info[STATS_CHANGED] = True
+
+
+def existing_keys(table, key_names, keys):
+    """
+    Keys of the rollup table rows already there, looked up by the first
+    key column
+    """
+    first = table.c[key_names[0]]
+    values = sorted({key[0] for key in keys})
+    found = set()
+    for start in range(0, len(values), KEY_CHUNK_SIZE):
+        chunk = values[start:start + KEY_CHUNK_SIZE]
+        found.update(tuple(row) for row in db.session.execute(
+            select([table.c[name] for name in key_names])
+            .where(first.in_(chunk))))
+    return found
+
+
+def increment_many(table, key_names, changes):
+    """
+    increment() for many rows at once, changes maps key tuples to deltas.
+    The existing rows are updated with one executemany statement and the
+    new ones inserted with another
+    """
+    changes = {key: deltas for key, deltas in changes.items()
+               if any(deltas.values())}
+    if len(changes) <= 1:
+        for key, deltas in changes.items():
+            increment(table, dict(zip(key_names, key)), deltas)
+        return
+    db.session.flush()
+
+    counters = sorted({name for deltas in changes.values()
+                       for name in deltas})
+    existing = existing_keys(table, key_names, changes)
+    updated = sorted(key for key in changes if key in existing)
+    created = sorted(key for key in changes if key not in existing)
+
+    def params(key):
+        deltas = changes[key]
+        values = {f'key_{name}': value for name, value in zip(key_names, key)}
+        values.update({f'delta_{name}': deltas.get(name, 0)
+                       for name in counters})
+        return values
+
+    if updated:
+        update = table.update().where(and_(*[
+            table.c[name] == bindparam(f'key_{name}') for name in key_names
+        ])).values({
+            name: table.c[name] + bindparam(f'delta_{name}')
+            for name in counters
+        })
+        db.session.execute(update, [params(key) for key in updated])
+    if created:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert(), [
+                    dict(zip(key_names, key), **changes[key])
+                    for key in created])
+        except IntegrityError:
+            # Some rows were created by another transaction meanwhile
+            for key in created:
+                increment(table, dict(zip(key_names, key)), changes[key])
+
+    db.session.info[STATS_CHANGED] = True
+
+
+def record_passenger_changes(changes):
+    """
+    Update the rollups for (old state, new state) pairs, None for a
+    passenger created or deleted
+    """
+    daily = defaultdict(Counter)
+    hourly = Counter()
+    for old, new in changes:
+        for state, sign in ((old, -1), (new, 1)):
+            if state is None:
+                continue
+            counters = daily[state.timestamp.date()]
+            for name, value in state.daily_counters().items():
+                counters[name] += sign * value
+            hourly[state.hourly_key()] += sign
+
+    increment_many(PassengerDailyStatsModel.__table__, ('date',),
+                   {(day,): deltas for day, deltas in daily.items()})
+    increment_many(PassengerHourlyStatsModel.__table__, HOURLY_KEY,
+                   {key: {'signups': delta}
+                    for key, delta in hourly.items()})
+
+
+def record_passenger_created(passenger):
+    record_passenger_changes([(None, passenger_state(passenger))])
+
+
+def record_passenger_updated(passenger, old_state):
+    record_passenger_changes([(old_state, passenger_state(passenger))])
+
+
+def record_passenger_deleted(passenger):
+    record_passenger_changes([(passenger_state(passenger), None)])
+
+
+def replace_rows(table, rows):
+    db.session.execute(table.delete())
+    if rows:
+        db.session.execute(table.insert(), rows)
+
+
+def rebuild_daily_stats():
+    """
+    Recompute all the daily counters from the passengers table, returns the
+    number of days
+    """
+    day = func.date(PassengerModel.timestamp)
+    rows = (db.session.query(
+        day,
+        func.count(PassengerModel.id),
+        func.sum(case([(PassengerModel.suspendedAt.isnot(None), 1)],
+                      else_=0)),
+        func.sum(case([(PassengerModel.emailStatus == 1, 1)], else_=0)),
+        func.sum(case([(PassengerModel.phoneNumberStatus == 1, 1)],
+                      else_=0)),
+    ).filter(PassengerModel.timestamp.isnot(None)).group_by(day).all())
+
+    replace_rows(PassengerDailyStatsModel.__table__, [
+        dict(zip(('date', ) + COUNTERS,
+                 (as_date(row[0]), ) + tuple(int(v) for v in row[1:])))
+        for row in rows
+    ])
+    db.session.info[STATS_CHANGED] = True
+    return len(rows)
+
+
+def rebuild_hourly_stats():
+    """
+    Recompute all the hourly counters from the passengers table, returns
+    the number of rows
+    """
+    timestamp = PassengerModel.timestamp
+    if db.session.get_bind().dialect.name == 'postgresql':
+        hour = func.date_trunc('hour', timestamp)
+    else:
+        hour = func.strftime('%Y-%m-%d %H:00:00', timestamp)
+    suspended = case([(PassengerModel.suspendedAt.isnot(None), 1)], else_=0)
+    emailStatus = func.coalesce(PassengerModel.emailStatus, NO_STATUS)
+    phoneStatus = func.coalesce(PassengerModel.phoneNumberStatus, NO_STATUS)
+    key = (hour, suspended, emailStatus, phoneStatus)
+    rows = (db.session.query(*key, func.count(PassengerModel.id))
+            .filter(timestamp.isnot(None)).group_by(*key).all())
+
+    replace_rows(PassengerHourlyStatsModel.__table__, [
+        dict(zip(HOURLY_KEY + ('signups', ),
+                 (as_datetime(row[0]), ) + tuple(row[1:])))
+        for row in rows
+    ])
+    db.session.info[STATS_CHANGED] = True
+    return len(rows)
+
+
+def rebuild_stats():
+    """
+    Recompute the rollups from the passengers table, returns the number of
+    days and hourly rows
+    """
+    return rebuild_daily_stats(), rebuild_hourly_stats()
+
+
+def record_search_update(values):
+    """
+    The facets are cached per search too, a passenger renamed can match
+    other searches without changing the rollups. For the UPDATE statements
+    of the values, the ORM changes are seen when flushed
+    """
+    if any(name in values for name in SEARCH_FIELDS['all']):
+        db.session.info[STATS_CHANGED] = True
+
+
+@event.listens_for(db.session, 'before_flush')
+def search_columns_changed(session, flush_context, instances):
+    for instance in session.dirty:
+        if isinstance(instance, PassengerModel):
+            attrs = inspect(instance).attrs
+            if any(attrs[name].history.has_changes()
+                   for name in SEARCH_FIELDS['all']):
+                session.info[STATS_CHANGED] = True
+                return
+
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_stats_cache(session):
+    # Cached stats are dropped once the change is visible to other sessions
+    if session.info.pop(STATS_CHANGED, False) and has_app_context():
+        current_app.stats_cache.invalidate()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_stats_changes(session):
+    session.info.pop(STATS_CHANGED, None)
+
+
+def total_signups():
+    total = db.session.query(func.sum(
+        PassengerDailyStatsModel.signups)).scalar()
+    return int(total or 0)
+
+
+def facet_counts(total, suspended, email_verified, phone_verified):
+    total, suspended = int(total or 0), int(suspended or 0)
+    email_verified, phone_verified = (int(email_verified or 0),
+                                      int(phone_verified or 0))
+    return {
+        'total': total,
+        'active': total - suspended,
+        'suspended': suspended,
+        'emailVerified': email_verified,
+        'emailUnverified': total - email_verified,
+        'phoneVerified': phone_verified,
+        'phoneUnverified': total - phone_verified,
+    }
+
+
+def passenger_facets(query=None):
+    """
+    Counts of the passengers by status, email and phone verification, in a
+    single pass. Unverified counts everything not verified. The query
+    restricts the passengers counted, without it the counts are added up
+    from the daily stats
+    """
+    if query is None:
+        daily = PassengerDailyStatsModel
+        row = db.session.query(func.sum(daily.signups),
+                               func.sum(daily.suspensions),
+                               func.sum(daily.emailVerified),
+                               func.sum(daily.phoneVerified)).one()
+        return facet_counts(*row)
+
+    row = query.with_entities(
+        func.count(PassengerModel.id),
+        func.sum(case([(PassengerModel.suspendedAt.isnot(None), 1)],
+                      else_=0)),
+        func.sum(case([(PassengerModel.emailStatus == 1, 1)], else_=0)),
+        func.sum(case([(PassengerModel.phoneNumberStatus == 1, 1)],
+                      else_=0)),
+    ).order_by(None).one()
+    return facet_counts(*row)
+
+
+def daily_signups(start_date, end_date):
+    """
+    Signups per day between both dates included. Days without signups are
+    counted as 0
+    """
+    rows = (db.session.query(PassengerDailyStatsModel.date,
+                             PassengerDailyStatsModel.signups)
+            .filter(PassengerDailyStatsModel.date >= start_date)
+            .filter(PassengerDailyStatsModel.date <= end_date).all())
+    counts = dict(rows)
+    return {day: counts.get(day, 0)
+            for day in date_range(start_date, end_date)}
+
+
+def monthly_signups(year):
+    """
+    Signups per month of the year, keyed by month number
+    """
+    rows = (db.session.query(PassengerDailyStatsModel.date,
+                             PassengerDailyStatsModel.signups)
+            .filter(PassengerDailyStatsModel.date >= date(year, 1, 1))
+            .filter(PassengerDailyStatsModel.date < date(year + 1, 1, 1))
+            .all())
+    counts = Counter()
+    for day, signups in rows:
+        counts[day.month] += signups
+    return {month: counts[month] for month in range(1, 13)}
@@ -0,0 +1,166 @@
+"""
+Stub SMS and email gateway
+
+Accepts the messages posted by the notification tasks, so the pipeline
+can run and be measured without the real gateways. Every path takes a
+form encoded message, as SMS_URL and EMAIL_URL, except a path ending in
+bulk/, which takes {"messages": [...]} and answers a result per message,
+as SMS_BULK_URL and EMAIL_BULK_URL. It answers after the latency, and
+fails error_rate of the messages with a 503.
+
+GET /stats/ returns the requests and messages received, the messages
+failed, and when each message delivered was answered, by phoneNumber or
+emailAddress. It clears them, so read them once per run. Start it with:
+
+    python -m taxipassengers_backend.stub_gateway --port 7048
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qsl
+
+# Fields of the SMS and email messages telling them apart
+MESSAGE_KEYS = ('phoneNumber', 'emailAddress')
+
+
+class StubGatewayHandler(BaseHTTPRequestHandler):
+    """
+    Answers every request keeping the connection open
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        bulk = self.path.rstrip('/').endswith('bulk')
+        try:
+            if bulk:
+                messages = json.loads(body)['messages']
+            else:
+                messages = [dict(parse_qsl(body.decode('utf-8')))]
+        except (ValueError, KeyError, TypeError):
+            self.reply(400, {'error': 'Invalid message'})
+            return
+
+        time.sleep(self.server.latency)
+        results = self.server.receive(messages)
+        if bulk:
+            self.reply(200, {'results': results})
+        elif results[0]['ok']:
+            self.reply(200, {'status': 'sent'})
+        else:
+            self.reply(503, {'error': results[0]['error']})
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/stats':
+            self.reply(404, {'error': 'Not Found'})
+            return
+        self.reply(200, self.server.take_stats())
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubGatewayServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, latency=0, error_rate=0):
+        super().__init__(address, StubGatewayHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._stats = self._new_stats()
+
+    @staticmethod
+    def _new_stats():
+        return {'requests': 0, 'messages': 0, 'failed': 0, 'delivered': {}}
+
+    def receive(self, messages):
+        """
+        Count the messages and return their results
+        """
+        answered = time.time()
+        results = []
+        with self._lock:
+            self._stats['requests'] += 1
+            for message in messages:
+                self._stats['messages'] += 1
+                if random.random() < self.error_rate:
+                    self._stats['failed'] += 1
+                    results.append({'ok': False, 'error': 'Unavailable'})
+                    continue
+                key = next((message[name] for name in MESSAGE_KEYS
+                            if name in message), None)
+                if key is not None:
+                    self._stats['delivered'][key] = answered
+                results.append({'ok': True, 'error': None})
+        return results
+
+    def take_stats(self):
+        with self._lock:
+            stats, self._stats = self._stats, self._new_stats()
+        return stats
+
+
+@contextmanager
+def stub_gateway(latency=0, error_rate=0):
+    """
+    Run a stub gateway on a free local port, yields its URL. It runs in a
+    process of its own, so it doesn't compete for the GIL with the client
+    measured
+    """
+    server = StubGatewayServer(('127.0.0.1', 0), latency, error_rate)
+    process = multiprocessing.get_context('fork').Process(
+        target=server.serve_forever, daemon=True)
+    process.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}/'
+    finally:
+        process.terminate()
+        process.join(5)
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stub SMS and email gateway')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=7048)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Seconds before answering a request')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='Share of the messages failed, from 0 to 1')
+    args = parser.parse_args(argv)
+
+    server = StubGatewayServer((args.host, args.port), args.latency,
+                               args.error_rate)
+    print(f'Stub gateway on http://{args.host}:{args.port}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,23 @@
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-from taxipassengers_backend import celery
+from taxipassengers_backend import PRIORITY_BULK, celery, gateway
+from taxipassengers_backend.bulk import record_notified
+from taxipassengers_backend.delivery import (CHANNELS, count, dead_letter,
+                                             limiter, retry_delay, retryable)
+
+# The local stub gateway by default, see stub_gateway.py
+SMS_URL = os.environ.get('SMS_URL', 'http://localhost:7048/api/me/message/')
+EMAIL_URL = os.environ.get('EMAIL_URL', 'http://localhost:7048/api/me/mail/')
+# Endpoints taking many messages in a request, when the gateways have one
+SMS_BULK_URL = os.environ.get('SMS_BULK_URL')
+EMAIL_BULK_URL = os.environ.get('EMAIL_BULK_URL')
+# Concurrent posts of a batch to a gateway without a bulk endpoint
+NOTIFICATION_FANOUT = int(os.environ.get('NOTIFICATION_FANOUT', 8))
 
-SMS_URL = os.environ.get('SMS_URL', 'http://167.172.57.163:7048/api/me/message/')
-EMAIL_URL = os.environ.get('EMAIL_URL', 'http://167.172.57.163:7049/api/me/mail/')
+logger = logging.getLogger(__name__)
 
 
 def init_celery(celery, app):
@@ -19,13 +33,191 @@ def init_celery(celery, app):
 
 @celery.task()
 def send_sms(data, header):
-    response = requests.post(url=SMS_URL, data=data, headers=header)
-    print(response.status_code)
-    print('SMS SENT')
+    return send_batch('sms', [data], header)
 
 
 @celery.task()
 def send_email(data, headers):
-    response = requests.post(url=EMAIL_URL, data=data, headers=headers)
-    print(response.status_code)
-    print('MAIL SENT')
+    return send_batch('email', [data], headers)
+
+
+def channel_urls(channel):
+    return {
+        'sms': (SMS_URL, SMS_BULK_URL),
+        'email': (EMAIL_URL, EMAIL_BULK_URL),
+    }[channel]
+
+
+def post_result(channel, url, data, header):
+    limiter.wait(channel)
+    try:
+        response = gateway.post(url, data, header)
+    except requests.RequestException as error:
+        return {'ok': False, 'status': None, 'error': str(error)}
+    return {'ok': response.ok, 'status': response.status_code,
+            'error': None if response.ok else response.reason}
+
+
+def post_bulk(url, messages, header):
+    """
+    Post the messages in a request, to an endpoint answering with a result
+    per message in the same order: {"results": [{"ok": true}, ...]}
+    """
+    try:
+        response = gateway.post(url, None, header,
+                                json={'messages': messages})
+        if response.ok:
+            return [{'ok': bool(result.get('ok')),
+                     'status': response.status_code,
+                     'error': result.get('error')}
+                    for result in response.json()['results']]
+        error = {'ok': False, 'status': response.status_code,
+                 'error': response.reason}
+    except (requests.RequestException, ValueError, KeyError) as exception:
+        error = {'ok': False, 'status': None, 'error': str(exception)}
+    return [error] * len(messages)
+
+
+def deliver(channel, messages, header):
+    """
+    Send the messages of a channel, returns a result per message
+    """
+    url, bulk_url = channel_urls(channel)
+    if bulk_url:
+        limiter.wait(channel, len(messages))
+        return post_bulk(bulk_url, messages, header)
+
+    def post(message):
+        return post_result(channel, url, message, header)
+
+    if len(messages) == 1 or NOTIFICATION_FANOUT <= 1:
+        return [post(message) for message in messages]
+    workers = min(NOTIFICATION_FANOUT, len(messages))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(post, messages))
+
+
+def settle(channel, messages, header, attempt, results):
+    """
+    Count the results, queue the retryable failures with backoff and dead
+    letter the others
+    """
+    retries, failures = [], []
+    for message, result in zip(messages, results):
+        if result['ok']:
+            continue
+        if retryable(result) and attempt < CHANNELS[channel]['max_retries']:
+            retries.append(message)
+        else:
+            failures.append((message, result))
+
+    count(channel, 'sent', len(messages) - len(retries) - len(failures))
+    if retries:
+        delay = retry_delay(channel, attempt)
+        logger.info(f'Retrying {len(retries)} {channel} messages in '
+                    f'{delay:.1f}s')
+        # Behind the messages sent for the first time
+        send_batch.apply_async((channel, retries, header, attempt + 1),
+                               countdown=delay, priority=PRIORITY_BULK)
+        count(channel, 'retried', len(retries))
+    if failures:
+        dead_letter(channel, header, failures, attempt + 1)
+
+
+@celery.task()
+def send_batch(channel, messages, header, attempt=0):
+    """
+    Messages of a channel published together by the outbox dispatcher,
+    or retried. attempt counts the previous tries
+    """
+    results = deliver(channel, messages, header)
+    settle(channel, messages, header, attempt, results)
+    return results
+
+
+@celery.task()
+def dispatch_outbox():
+    """
+    Publish the messages waiting in the outbox, for a periodic schedule
+    when no dispatcher is running
+    """
+    from taxipassengers_backend.outbox import drain
+
+    return drain()
+
+
+def send_paced(messages, header):
+    """
+    Send the (sms, email) data pairs, each channel on its own and paced by
+    its rate limit, shared by the workers. Returns the number of messages
+    sent and failed; the failures are retried or dead lettered as in
+    send_batch
+    """
+    sent = failed = 0
+    for channel, batch in zip(('sms', 'email'), zip(*messages)):
+        batch = list(batch)
+        results = deliver(channel, batch, header)
+        settle(channel, batch, header, 0, results)
+        delivered = sum(1 for result in results if result['ok'])
+        sent += delivered
+        failed += len(batch) - delivered
+    return sent, failed
+
+
+@celery.task()
+def send_welcome_batch(recipients, header):
+    """
+    Welcome SMS and mail for a batch of passengers
+    """
+    # utils queues the tasks of this module
+    from taxipassengers_backend.utils import templates
+    sms = templates.get('sms/template.WELCOME_MSG')
+    mail = templates.get('email/welcome.html')
+
+    def messages():
+        for recipient in recipients:
+            data = {
+                'firstName': recipient['firstName'],
+                'receiverNo': recipient['lastName'],
+                'pin': '1234'
+            }
+            yield {
+                'phoneNumber': recipient['phoneNumber'],
+                'message': sms.render(data),
+                'typeMessage': 'Welcome Message'
+            }, {
+                'emailAddress': recipient['email'],
+                'mail': mail.render(data),
+                'subject': "Welcome To Lagos State Intermodal System!",
+                'typeEmail': 'Welcome Message'
+            }
+
+    send_paced(messages(), header)
+
+
+@celery.task()
+def send_suspension_batch(recipients, header, job_id):
+    """
+    Suspension SMS and mail for a batch of passengers of a bulk job, then
+    count them as notified in the job, with the messages sent and failed
+    """
+    from taxipassengers_backend.utils import templates
+    sms = templates.get('sms/template.SUSPEND_MSG')
+    mail = templates.get('email/cascading_suspend.html')
+
+    def messages():
+        for recipient in recipients:
+            data = {'name': recipient['firstName']}
+            yield {
+                'phoneNumber': recipient['phoneNumber'],
+                'message': sms.render(data),
+                'typeMessage': 'Passenger Account Suspension'
+            }, {
+                'emailAddress': recipient['email'],
+                'mail': mail.render(data),
+                'subject': 'Alert: You have Been Suspended',
+                'typeEmail': 'Passenger Account Suspension'
+            }
+
+    sent, failed = send_paced(messages(), header)
+    record_notified(job_id, len(recipients), sent, failed)
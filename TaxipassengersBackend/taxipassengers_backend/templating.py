@@ -0,0 +1,127 @@
+"""
+Notification templates, loaded once instead of read on every message
+
+Every file under templates/email and templates/sms is read when the
+registry is created: .html and .txt files by their path, like
+'email/welcome.html', and the upper case string constants of .py modules
+by module path and name, like 'sms/template.WELCOME_MSG'. With
+TEMPLATE_RELOAD_INTERVAL set, the files are checked for changes at most
+that often and reloaded, to edit templates without a restart.
+"""
+import logging
+import os
+import runpy
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_PATH = Path(os.path.dirname(os.path.realpath(__file__))) / \
+    'templates'
+TEMPLATE_DIRECTORIES = ('email', 'sms')
+TEMPLATE_SUFFIXES = ('.html', '.txt')
+# Seconds between checks for changed files, 0 to never reload
+TEMPLATE_RELOAD_INTERVAL = float(
+    os.environ.get('TEMPLATE_RELOAD_INTERVAL', 0))
+
+
+class Template:
+    """
+    str.format template, read once and formatted for every message.
+    Rendering fails on a missing field
+    """
+
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+
+    def render(self, data):
+        return self.text.format_map(data)
+
+
+def template_files(path):
+    return sorted(
+        template_file for directory in TEMPLATE_DIRECTORIES
+        for template_file in (path / directory).glob('*')
+        if template_file.suffix in TEMPLATE_SUFFIXES or
+        template_file.suffix == '.py' and
+        not template_file.name.startswith('_'))
+
+
+def load_templates(path):
+    templates = {}
+    for template_file in template_files(path):
+        name = template_file.relative_to(path).as_posix()
+        if template_file.suffix in TEMPLATE_SUFFIXES:
+            # As written, line endings included
+            text = template_file.read_bytes().decode('utf-8')
+            templates[name] = Template(name, text)
+            continue
+
+        module = name[:-len('.py')]
+        constants = runpy.run_path(str(template_file))
+        for constant, text in constants.items():
+            if constant.isupper() and isinstance(text, str):
+                name = f'{module}.{constant}'
+                templates[name] = Template(name, text)
+    return templates
+
+
+class TemplateRegistry:
+    """
+    Parsed templates indexed by name
+    """
+
+    def __init__(self, path=TEMPLATES_PATH,
+                 reload_interval=TEMPLATE_RELOAD_INTERVAL):
+        self.path = Path(path)
+        self.reload_interval = reload_interval
+        self.templates = {}
+        self._signature = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def _source_signature(self):
+        signature = []
+        for template_file in template_files(self.path):
+            stat = template_file.stat()
+            signature.append((str(template_file), stat.st_mtime_ns,
+                              stat.st_size))
+        return tuple(signature)
+
+    def reload(self):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            signature = self._source_signature()
+            try:
+                templates = load_templates(self.path)
+            except (OSError, ValueError, SyntaxError):
+                logger.exception(f'Error loading templates from '
+                                 f'{self.path}, keeping previous templates')
+                return False
+
+            self.templates = templates
+            self._signature = signature
+            logger.info(f'Loaded templates {sorted(templates)}')
+            return True
+
+    def maybe_reload(self):
+        if not self.reload_interval or \
+                time.monotonic() - self._checked_at < self.reload_interval:
+            return False
+
+        with self._lock:
+            self._checked_at = time.monotonic()
+            changed = self._source_signature() != self._signature
+        if changed:
+            return self.reload()
+        return False
+
+    def get(self, name):
+        self.maybe_reload()
+        return self.templates[name]
+
+    def render(self, name, data):
+        return self.get(name).render(data)
@@ -0,0 +1,210 @@
+"""
+Signups grouped by hour, day, week or month in any time zone
+
+Timestamps are stored as naive UTC. Ranges whose start, end and bucket
+boundaries are all on a UTC hour, which covers every zone with a whole
+hour offset, are added up from the hourly stats rollup. Otherwise the
+passengers are grouped by the database: PostgreSQL converts and truncates
+the timestamps, SQLite has no time zones so signups are grouped by UTC
+quarter hour, which every zone offset in use is a multiple of, and added
+up to the local buckets.
+"""
+import re
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+import pytz
+from sqlalchemy import Integer, and_, cast, func, select
+
+from taxipassengers_backend.db import db
+from taxipassengers_backend.models import (PassengerHourlyStatsModel,
+                                           PassengerModel)
+
+GRANULARITIES = ('hour', 'day', 'week', 'month')
+MAX_BUCKETS = 5000
+QUARTER_HOUR = 900
+ISO_TIME_FORMATS = ('%H:%M:%S.%f', '%H:%M:%S', '%H:%M')
+ISO_OFFSET = re.compile(r'(?:[Zz]|([+-])(\d{2}):?(\d{2}))$')
+
+
+def time_zone(value):
+    try:
+        return pytz.timezone(value)
+    except pytz.UnknownTimeZoneError:
+        raise ValueError(f'Unknown time zone {value}')
+
+
+def iso_datetime(value):
+    """
+    ISO 8601 date, or date and time with an optional Z or UTC offset.
+    Parsed with strptime, fromisoformat needs Python 3.7 and %z doesn't
+    take an offset with a colon before it
+    """
+    day, _, time = value.strip().replace('T', ' ', 1).partition(' ')
+    tzinfo = None
+    match = ISO_OFFSET.search(time)
+    if match:
+        time = time[:match.start()]
+        sign, hours, minutes = match.groups()
+        offset = timedelta(hours=int(hours or 0), minutes=int(minutes or 0))
+        tzinfo = timezone(-offset if sign == '-' else offset)
+    for time_format in ISO_TIME_FORMATS if time else ('', ):
+        try:
+            moment = datetime.strptime(f'{day} {time}'.strip(),
+                                       f'%Y-%m-%d {time_format}'.strip())
+        except ValueError:
+            continue
+        return moment.replace(tzinfo=tzinfo)
+    raise ValueError(f'Invalid isoformat string: {value!r}')
+
+
+def to_local(moment, zone):
+    """
+    Naive local time of the moment, naive moments are already local
+    """
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(zone).replace(tzinfo=None)
+
+
+def to_utc(moment, zone):
+    return zone.localize(moment).astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def truncate(moment, granularity):
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'hour':
+        return moment
+    moment = moment.replace(hour=0)
+    if granularity == 'week':
+        return moment - timedelta(days=moment.weekday())
+    if granularity == 'month':
+        return moment.replace(day=1)
+    return moment
+
+
+def next_bucket(start, granularity):
+    if granularity == 'hour':
+        return start + timedelta(hours=1)
+    if granularity == 'week':
+        return start + timedelta(weeks=1)
+    if granularity == 'month':
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def bucket_starts(start, end, granularity):
+    bucket = truncate(start, granularity)
+    while bucket < end:
+        yield bucket
+        bucket = next_bucket(bucket, granularity)
+
+
+def count_buckets(start, end, granularity, limit=MAX_BUCKETS):
+    """
+    Number of buckets between both times, counted up to limit + 1
+    """
+    return sum(1 for _ in islice(bucket_starts(start, end, granularity),
+                                 limit + 1))
+
+
+def grouped_counts(query, start, end, granularity, zone):
+    """
+    Signups of the query per local bucket, with a single grouped query
+    """
+    timestamp = PassengerModel.timestamp
+    query = (query.filter(timestamp >= to_utc(start, zone))
+             .filter(timestamp < to_utc(end, zone)))
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        local = func.timezone(zone.zone, func.timezone('UTC', timestamp))
+        bucket = func.date_trunc(granularity, local)
+        rows = (query.with_entities(bucket, func.count(PassengerModel.id))
+                .group_by(bucket).all())
+        return dict(rows)
+
+    slot = cast(func.strftime('%s', timestamp), Integer) / QUARTER_HOUR
+    rows = (query.with_entities(slot, func.count(PassengerModel.id))
+            .group_by(slot).all())
+    counts = Counter()
+    for slot, count in rows:
+        moment = datetime.fromtimestamp(slot * QUARTER_HOUR, pytz.utc)
+        counts[truncate(to_local(moment, zone), granularity)] += count
+    return counts
+
+
+def hour_aligned(moment):
+    return moment.minute == 0 and moment.second == 0 and \
+        moment.microsecond == 0
+
+
+def utc_boundaries(buckets, zone):
+    """
+    UTC start of the local buckets after the first
+    """
+    return [to_utc(bucket, zone) for bucket in buckets[1:]]
+
+
+def rollup_counts(start, end, buckets, boundaries, zone, filters):
+    """
+    Signups per local bucket added up from the hourly stats, start, end and
+    the UTC bucket boundaries have to be on a UTC hour
+    """
+    hourly = PassengerHourlyStatsModel.__table__
+    conditions = [hourly.c.hour >= to_utc(start, zone),
+                  hourly.c.hour < to_utc(end, zone)]
+    if filters.get('status'):
+        conditions.append(
+            hourly.c.suspended == int(filters['status'] == 'suspended'))
+    if filters.get('emailStatus'):
+        conditions.append(hourly.c.emailStatus == int(
+            filters['emailStatus'] == 'verified'))
+    if filters.get('phoneStatus'):
+        conditions.append(hourly.c.phoneNumberStatus == int(
+            filters['phoneStatus'] == 'verified'))
+
+    # Up to 24 rows a day, plain Core rows are much cheaper than ORM ones
+    rows = db.session.execute(
+        select([hourly.c.hour, func.sum(hourly.c.signups)])
+        .where(and_(*conditions)).group_by(hourly.c.hour)
+        .order_by(hourly.c.hour))
+
+    # Walk the hours and the UTC bucket boundaries together, instead of
+    # converting every hour to local time
+    counts = Counter()
+    index = 0
+    for hour, signups in rows:
+        while index < len(boundaries) and hour >= boundaries[index]:
+            index += 1
+        counts[buckets[index]] += int(signups)
+    return counts
+
+
+def signup_series(start, end, granularity='day', zone=pytz.utc,
+                  filters=None, query=None):
+    """
+    Signups per bucket between the local times start included and end
+    excluded, as a list of (aware bucket start, count). Empty buckets are
+    counted as 0
+
+    filters has the status, emailStatus and phoneStatus filters of the
+    passengers counted, query the same passengers for ranges the rollup
+    can't answer.
+    """
+    filters = filters or {}
+    buckets = list(bucket_starts(start, end, granularity))
+    boundaries = utc_boundaries(buckets, zone)
+    # A zone off the UTC hours by half an hour can have a range on UTC
+    # hours, but not its days
+    edges = [to_utc(start, zone), to_utc(end, zone)] + boundaries
+    if all(hour_aligned(edge) for edge in edges):
+        counts = rollup_counts(start, end, buckets, boundaries, zone,
+                               filters)
+    else:
+        if query is None:
+            query = db.session.query(PassengerModel)
+        counts = grouped_counts(query, start, end, granularity, zone)
+
+    return [(zone.localize(bucket), counts.get(bucket, 0))
+            for bucket in buckets]
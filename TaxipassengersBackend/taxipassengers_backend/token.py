@@ -1,18 +1,100 @@
+import hashlib
 import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
 import jwt
-from parse import parse
+
+from taxipassengers_backend.keyring import KeyRing
 
 logger = logging.getLogger(__name__)
 
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+
+
+class TokenCache:
+    """
+    Bounded, thread-safe cache of verified token payloads.
+
+    Entries are keyed by a digest of the token and expire at the token's
+    `exp` claim, or earlier when evicted by the LRU size cap.
+    """
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token, key_scope):
+        # The key is part of the cache key, so a token verified against one
+        # key is never served for another
+        return key_scope, hashlib.sha256(token).digest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expiry, payload = entry
+            if expiry <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(payload)
+
+    def set(self, key, payload):
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (payload['exp'], dict(payload))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+token_cache = TokenCache()
+# Same matching rules as parse('Bearer {}'), without the per-call overhead
+bearer_format = re.compile(r'Bearer (.+)', re.IGNORECASE | re.DOTALL)
+
 
 def encode_token(payload, private_key):
     return jwt.encode(payload, private_key, algorithm='RS256')
 
 
 def decode_token(token, public_key):
-    return jwt.decode(token, public_key, algoritms='RS256')
+    if isinstance(public_key, KeyRing):
+        public_key = public_key.get_key(token)
+    return jwt.decode(token, public_key, algorithms=['RS256'])
 
 
 def generate_token_header(payload1, private_key):
@@ -36,25 +118,40 @@ def generate_token_header(payload1, private_key):
     return f'Bearer {token}'
 
 
-def validate_token_header(header, public_key):
+def validate_token_header(header, public_key, cache=token_cache):
     """
     Validate that a token header is correct
 
     If correct, it return the username, if not, it
-    returns None
+    returns None. The public key can be a PEM string or a KeyRing.
+    Verified tokens are kept in the cache until they expire, pass
+    cache=None to always verify the signature.
     """
     if not header:
         logger.info('No header')
         return None
 
     # Retrieve the Bearer token
-    parse_result = parse('Bearer {}', header)
+    parse_result = bearer_format.fullmatch(header)
     if not parse_result:
         logger.info(f'Wrong format for header "{header}"')
         return None
-    token = parse_result[0]
+    token = parse_result[1].encode('utf8')
+
+    # Pick up rotated keys, verified tokens are cached per key generation
+    scope = public_key
+    if isinstance(public_key, KeyRing):
+        public_key.maybe_reload()
+        scope = (public_key, public_key.generation)
+
+    if cache is not None:
+        cache_key = cache.key(token, scope)
+        decoded_token = cache.get(cache_key)
+        if decoded_token is not None:
+            return decoded_token
+
     try:
-        decoded_token = decode_token(token.encode('utf8'), public_key)
+        decoded_token = decode_token(token, public_key)
     except jwt.exceptions.DecodeError:
         logger.warning(f'Error decoding header "{header}". '
                        'This may be key mismatch or wrong key')
@@ -62,6 +159,12 @@ def validate_token_header(header, public_key):
     except jwt.exceptions.ExpiredSignatureError:
         logger.error(f'Authentication header {header} has expired')
         return None
+    except (jwt.exceptions.InvalidKeyError,
+            jwt.exceptions.InvalidTokenError) as err:
+        # An unknown key, or a token otherwise invalid, e.g. signed with
+        # another algorithm
+        logger.warning(f'Error decoding header "{header}": {err}')
+        return None
 
     # Check expiry is in the token
     if 'exp' not in decoded_token:
@@ -74,4 +177,6 @@ def validate_token_header(header, public_key):
         return None
 
     logger.info('Header successfully validated')
+    if cache is not None:
+        cache.set(cache_key, decoded_token)
     return decoded_token
@@ -1,25 +1,26 @@
 import os
-import codecs
-from pathlib import Path
-from taxipassengers_backend.task import send_email, send_sms
+from taxipassengers_backend.task import (send_batch, send_suspension_batch,
+                                         send_welcome_batch)
+from taxipassengers_backend.templating import TemplateRegistry
 
+# Recipients per welcome notification task
+WELCOME_BATCH_SIZE = int(os.environ.get('WELCOME_BATCH_SIZE', 500))
+# Recipients per suspension notification task, the job progress is
+# updated after every task
+SUSPENSION_BATCH_SIZE = int(os.environ.get('SUSPENSION_BATCH_SIZE', 100))
 
-def format_string(text, data):
-    message = text.format(**data)
-    return message
+# Loaded once per process, by the API and the workers
+templates = TemplateRegistry()
 
 
-def html_to_string(location, data):
-    dir_path = Path(os.path.dirname(os.path.realpath(__file__)))
-    loc = dir_path / location
+def queue_batch(channel, messages, header):
+    send_batch.delay(channel, messages, header)
 
-    file = codecs.open(loc, 'r', "utf-8")
-    template = file.read()
-    message = format_string(template, data)
-    return message
 
-
-def send_notification(data, email_msg, sms_msg):
+def notification_messages(data, email_msg, sms_msg):
+    """
+    The SMS and email data posted to the gateways, and their header
+    """
     email_data = {
         'emailAddress': data['email'],
         'mail': email_msg,
@@ -32,6 +33,37 @@ def send_notification(data, email_msg, sms_msg):
         'typeMessage': data['typeMessage']
     }
     header = {'Authorization': data['Authorization']}
+    return sms_data, email_data, header
+
+
+def send_welcome_notifications(passengers, authorization):
+    """
+    Queue the welcome messages of many passengers, a task per
+    WELCOME_BATCH_SIZE passengers instead of two per passenger
+    """
+    recipients = [{
+        'firstName': passenger['firstName'],
+        'lastName': passenger['lastName'],
+        'email': passenger['email'],
+        'phoneNumber': passenger['phoneNumber'],
+    } for passenger in passengers]
+    header = {'Authorization': authorization}
+    for start in range(0, len(recipients), WELCOME_BATCH_SIZE):
+        send_welcome_batch.delay(
+            recipients[start:start + WELCOME_BATCH_SIZE], header)
+
 
-    send_sms.delay(sms_data, header)
-    send_email.delay(email_data, header)
+def send_suspension_notifications(job, passengers, authorization):
+    """
+    Queue the suspension messages of the passengers of a bulk job, a task
+    per SUSPENSION_BATCH_SIZE passengers
+    """
+    recipients = [{
+        'firstName': passenger['firstName'],
+        'email': passenger['email'],
+        'phoneNumber': passenger['phoneNumber'],
+    } for passenger in passengers]
+    header = {'Authorization': authorization}
+    for start in range(0, len(recipients), SUSPENSION_BATCH_SIZE):
+        send_suspension_batch.delay(
+            recipients[start:start + SUSPENSION_BATCH_SIZE], header, job.id)
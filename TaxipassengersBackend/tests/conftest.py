@@ -1,17 +1,86 @@
+import itertools
+
 import pytest
 from faker import Faker
 
+from taxipassengers_backend import config
 from taxipassengers_backend.app import create_app
+from taxipassengers_backend.models import PassengerModel
+from taxipassengers_backend.namespaces import api
+from taxipassengers_backend.stats import record_passenger_created
+from taxipassengers_backend.token import generate_token_header
 
 fake = Faker()
+sequence = itertools.count(1)
 
 
 @pytest.fixture
-def app():
+def app(tmp_path):
     application = create_app()
+    # Own SQLite file, the tests must not touch the development database
+    application.config['SQLALCHEMY_DATABASE_URI'] = (
+        f'sqlite:///{tmp_path}/test.sqlite3')
 
-    application.app_context().push()
+    context = application.app_context()
+    context.push()
     # Initialise the DB
     application.db.create_all()
 
-    return application
+    yield application
+
+    application.db.session.remove()
+    application.db.drop_all()
+    context.pop()
+
+
+@pytest.fixture
+def user_header():
+    return generate_token_header({'id': 1000}, config.PRIVATE_KEY)
+
+
+@pytest.fixture
+def admin_header():
+    return generate_token_header({'id': 1, 'admin': 1}, config.PRIVATE_KEY)
+
+
+@pytest.fixture
+def passenger_fixture(app):
+    """
+    Factory adding passengers to the DB, with fake data for the
+    fields not given
+    """
+    def create_passenger(**kwargs):
+        number = next(sequence)
+        values = {
+            'authId': number,
+            'firstName': fake.first_name(),
+            'lastName': fake.last_name(),
+            'email': f'passenger{number}@{fake.free_email_domain()}',
+            'phoneNumber': f'080{number:08d}',
+            'homeLocation': fake.address(),
+            'emailStatus': 1,
+            'phoneNumberStatus': 0,
+        }
+        values.update(kwargs)
+        passenger = PassengerModel(**values)
+        app.db.session.add(passenger)
+        app.db.session.flush()
+        record_passenger_created(passenger)
+        app.db.session.commit()
+        return passenger
+
+    return create_passenger
+
+
+@pytest.fixture
+def sent_notifications(monkeypatch):
+    """
+    Notifications sent by the API, instead of adding them to the outbox
+    """
+    sent = []
+
+    def queue_notification(data, email_msg, sms_msg):
+        sent.append(data)
+
+    monkeypatch.setattr(api, 'queue_notification', queue_notification)
+    return sent
@@ -0,0 +1,114 @@
+import threading
+
+import pytest
+from kombu import Connection
+
+from taxipassengers_backend import celery, delivery, task
+from taxipassengers_backend.models import NotificationOutboxModel
+from taxipassengers_backend.stub_gateway import stub_gateway
+
+async_worker = pytest.importorskip('taxipassengers_backend.async_worker')
+
+HEADER = {'Authorization': 'Bearer x'}
+
+
+@pytest.fixture
+def broker():
+    connection = Connection('memory://')
+    yield connection
+    connection.release()
+
+
+def publish(connection, name, *args, **options):
+    with connection.clone() as publisher:
+        celery.send_task(name, args=args,
+                         producer=celery.amqp.Producer(publisher), **options)
+
+
+def message_counts(connection, queues):
+    with connection.clone() as connection:
+        return [queue(connection.default_channel).queue_declare(
+            passive=True).message_count for queue in queues]
+
+
+def test_async_worker(app, broker, monkeypatch):
+    monkeypatch.setattr(delivery, 'backend', delivery.LocalBackend())
+    delivered = []
+    monkeypatch.setattr(task, 'dead_letter',
+                        lambda channel, header, failures, attempts:
+                        delivered.append(failures))
+    with stub_gateway() as url:
+        monkeypatch.setattr(async_worker, 'channel_urls', lambda channel: (
+            url if channel == 'sms' else 'http://127.0.0.1:1/', None))
+        publish(broker, task.send_sms.name, {'phoneNumber': '0801'}, HEADER)
+        publish(broker, task.send_batch.name, 'sms',
+                [{'phoneNumber': '0802'}, {'phoneNumber': '0803'}], HEADER)
+        # Connection refused, out of retries
+        publish(broker, task.send_batch.name, 'email',
+                [{'emailAddress': 'ada@example.com'}], HEADER,
+                delivery.CHANNELS['email']['max_retries'])
+        # Another task runs in a thread, in an app context
+        publish(broker, task.dispatch_outbox.name)
+
+        worker = async_worker.AsyncWorker(
+            app, connection=broker, queues=['sms', 'email', 'celery'],
+            max_messages=4)
+        worker.run()
+
+    assert 4 == worker.processed
+    assert 3 == delivery.metrics()['sms']['sent']
+    [failures] = delivered
+    assert [({'emailAddress': 'ada@example.com'}, {
+        'ok': False, 'status': None,
+        'error': failures[0][1]['error']})] == failures
+    assert 0 == NotificationOutboxModel.query.count()
+
+    # Every message was acked
+    assert [0, 0, 0] == message_counts(broker, worker.queues)
+
+
+def test_retry_countdown(app, broker, monkeypatch):
+    monkeypatch.setattr(delivery, 'backend', delivery.LocalBackend())
+    with stub_gateway() as url:
+        monkeypatch.setattr(async_worker, 'channel_urls',
+                            lambda channel: (url, None))
+        # A retry due in a minute, then a message due now
+        publish(broker, task.send_batch.name, 'sms',
+                [{'phoneNumber': '0801'}], HEADER, 1, countdown=60)
+        publish(broker, task.send_sms.name, {'phoneNumber': '0802'}, HEADER)
+
+        worker = async_worker.AsyncWorker(app, connection=broker,
+                                          queues=['sms'], max_messages=1)
+        worker.run()
+
+    # The worker stopped without waiting for the retry, nor acking it
+    assert 1 == worker.processed
+    assert 1 == delivery.metrics()['sms']['sent']
+
+
+def test_retries_outside_prefetch(app, broker, monkeypatch):
+    monkeypatch.setattr(delivery, 'backend', delivery.LocalBackend())
+    with stub_gateway() as url:
+        monkeypatch.setattr(async_worker, 'channel_urls',
+                            lambda channel: (url, None))
+        # Retries filling the prefetch, as during a gateway outage
+        for number in range(2):
+            publish(broker, task.send_batch.name, 'sms',
+                    [{'phoneNumber': f'080{number}'}], HEADER, 1,
+                    countdown=60)
+        publish(broker, task.send_sms.name, {'phoneNumber': '0809'}, HEADER)
+
+        worker = async_worker.AsyncWorker(app, connection=broker,
+                                          queues=['sms'], prefetch=2,
+                                          max_messages=1)
+        # Not stopped by the message due now if it is never delivered
+        timer = threading.Timer(10, lambda: worker._loop.call_soon_threadsafe(
+            worker.stop))
+        timer.start()
+        try:
+            worker.run()
+        finally:
+            timer.cancel()
+
+    assert 1 == worker.processed
+    assert 1 == delivery.metrics()['sms']['sent']
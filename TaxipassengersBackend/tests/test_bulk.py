@@ -0,0 +1,129 @@
+import http.client
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from taxipassengers_backend import gateway, task, utils
+from taxipassengers_backend.models import PassengerModel
+from taxipassengers_backend.stats import passenger_facets, rebuild_stats
+from tests.test_stats import hourly_stats
+
+
+@pytest.fixture
+def queued_batches(monkeypatch):
+    """
+    Suspension batches queued by the API, instead of sending them
+    """
+    queued = []
+    monkeypatch.setattr(utils, 'send_suspension_batch', SimpleNamespace(
+        delay=lambda *args: queued.append(args)))
+    monkeypatch.setattr(utils, 'SUSPENSION_BATCH_SIZE', 2)
+    return queued
+
+
+def test_bulk_suspend_ids(app, client, admin_header, passenger_fixture,
+                          queued_batches, monkeypatch):
+    passengers = [passenger_fixture(timestamp=datetime(2021, 3, day, 10))
+                  for day in range(1, 5)]
+    already = passenger_fixture(suspendedAt=passengers[0].timestamp)
+    ids = [passenger.id for passenger in passengers[:3]] + [already.id]
+
+    response = client.post('/api/passenger/suspend/', json={'ids': ids},
+                           headers={'Authorization': admin_header})
+
+    assert http.client.ACCEPTED == response.status_code
+    # The passenger already suspended is not changed or notified
+    assert 3 == response.json['changed']
+    assert 0 == response.json['notified']
+    assert response.json['finishedAt'] is None
+    assert 4 == PassengerModel.query.filter(
+        PassengerModel.suspendedAt.isnot(None)).count()
+    assert [2, 1] == [len(recipients) for recipients, _, _ in queued_batches]
+    assert ({passenger.email for passenger in passengers[:3]} ==
+            {recipient['email'] for recipients, _, _ in queued_batches
+             for recipient in recipients})
+
+    # Rollups kept in sync with the passengers
+    assert passenger_facets(PassengerModel.query) == passenger_facets()
+    hourly = hourly_stats()
+    rebuild_stats()
+    assert hourly_stats() == hourly
+
+    # Progress, as the batches are sent. The gateway rejects an address
+    rejected = passengers[0].email
+
+    def post(url, data, headers):
+        ok = data.get('emailAddress') != rejected
+        return SimpleNamespace(ok=ok, status_code=200 if ok else 400,
+                               reason='OK' if ok else 'Bad Request')
+
+    monkeypatch.setattr(gateway, 'post', post)
+    location = response.headers['Location']
+    task.send_suspension_batch(*queued_batches[0])
+    response = client.get(location, headers={'Authorization': admin_header})
+    assert http.client.OK == response.status_code
+    assert (2, 3, 1) == (response.json['notified'], response.json['sent'],
+                         response.json['failed'])
+    assert response.json['finishedAt'] is None
+
+    task.send_suspension_batch(*queued_batches[1])
+    response = client.get(location, headers={'Authorization': admin_header})
+    assert (3, 5, 1) == (response.json['notified'], response.json['sent'],
+                         response.json['failed'])
+    assert response.json['finishedAt'] is not None
+
+
+def test_bulk_suspend_filter(client, admin_header, passenger_fixture,
+                             queued_batches):
+    unverified = [passenger_fixture(emailStatus=0).id for _ in range(2)]
+    verified = passenger_fixture().id
+
+    response = client.post('/api/passenger/suspend/?emailStatus=unverified',
+                           json={}, headers={'Authorization': admin_header})
+
+    assert http.client.ACCEPTED == response.status_code
+    assert 2 == response.json['changed']
+    for passengerId in unverified:
+        assert PassengerModel.query.get(passengerId).suspendedAt is not None
+    assert PassengerModel.query.get(verified).suspendedAt is None
+
+    # ids and filters both have to match
+    response = client.post('/api/passenger/suspend/?emailStatus=verified',
+                           json={'ids': [unverified[0]]},
+                           headers={'Authorization': admin_header})
+    assert http.client.OK == response.status_code
+    assert 0 == response.json['changed']
+
+
+def test_bulk_unsuspend(client, admin_header, passenger_fixture,
+                        queued_batches):
+    suspended = passenger_fixture(
+        suspendedAt=passenger_fixture().timestamp).id
+
+    response = client.post('/api/passenger/suspend/?status=suspended',
+                           json={'suspend': 0},
+                           headers={'Authorization': admin_header})
+
+    # Nothing to send, the job is already finished
+    assert http.client.OK == response.status_code
+    assert 'unsuspend' == response.json['action']
+    assert 1 == response.json['changed']
+    assert response.json['finishedAt'] is not None
+    assert PassengerModel.query.get(suspended).suspendedAt is None
+    assert [] == queued_batches
+    assert 0 == passenger_facets()['suspended']
+
+
+def test_bulk_suspend_bad_request(client, admin_header, user_header):
+    response = client.post('/api/passenger/suspend/', json={},
+                           headers={'Authorization': admin_header})
+    assert http.client.BAD_REQUEST == response.status_code
+
+    response = client.post('/api/passenger/suspend/', json={'ids': [1]},
+                           headers={'Authorization': user_header})
+    assert http.client.FORBIDDEN == response.status_code
+
+    response = client.get('/api/passenger/suspend/1/',
+                          headers={'Authorization': admin_header})
+    assert http.client.NOT_FOUND == response.status_code
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from taxipassengers_backend.cache import (LocalBackend, RedisBackend,
+                                          ResultCache)
+
+
+def test_cached_result():
+    cache = ResultCache(LocalBackend(), ttl=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'total': 3}
+
+    assert {'total': 3} == cache.get_or_compute('sum', {'a': 1}, compute)
+    assert {'total': 3} == cache.get_or_compute('sum', {'a': 1}, compute)
+    assert 1 == len(calls)
+
+    # Other arguments are another result
+    cache.get_or_compute('sum', {'a': 2}, compute)
+    assert 2 == len(calls)
+    assert {'hits': 1, 'misses': 2} == cache.stats()
+
+
+def test_key_normalizes_arguments():
+    assert (ResultCache.key('sum', {'a': 1, 'b': 2}) ==
+            ResultCache.key('sum', {'b': 2, 'a': 1}))
+
+
+def test_cached_result_expires():
+    cache = ResultCache(LocalBackend(), ttl=0.05)
+    calls = []
+    cache.get_or_compute('sum', {}, lambda: calls.append(1) or 1)
+    time.sleep(0.1)
+    cache.get_or_compute('sum', {}, lambda: calls.append(1) or 1)
+    assert 2 == len(calls)
+
+
+def test_invalidate():
+    cache = ResultCache(LocalBackend(), ttl=60)
+    assert 1 == cache.get_or_compute('sum', {}, lambda: 1)
+    cache.invalidate()
+    assert 2 == cache.get_or_compute('sum', {}, lambda: 2)
+
+
+def test_local_backend_size_limit():
+    backend = LocalBackend(maxsize=2)
+    for key in ('a', 'b', 'c'):
+        backend.set(key, key, ttl=60)
+    assert 2 == len(backend)
+    assert backend.get('a') is None
+    assert 'c' == backend.get('c')
+
+
+def test_concurrent_misses_compute_once():
+    cache = ResultCache(LocalBackend(), ttl=60)
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 42
+
+    results = []
+
+    def worker():
+        results.append(cache.get_or_compute('sum', {}, compute))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    started.wait(5)
+    # Give the other threads time to join the running computation
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert 1 == len(calls)
+    assert [42] * 8 == results
+
+
+def test_errors_are_not_cached():
+    cache = ResultCache(LocalBackend(), ttl=60)
+
+    def compute():
+        raise ValueError('no database')
+
+    with pytest.raises(ValueError):
+        cache.get_or_compute('sum', {}, compute)
+    # Errors are not cached
+    assert 1 == cache.get_or_compute('sum', {}, lambda: 1)
+
+
+def test_redis_backend():
+    fakeredis = pytest.importorskip('fakeredis')
+    client = fakeredis.FakeStrictRedis()
+    cache = ResultCache(RedisBackend(client), ttl=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'01/03/2021': 2}
+
+    assert {'01/03/2021': 2} == cache.get_or_compute('date', {}, compute)
+    # Shared by another process with the same Redis
+    other = ResultCache(RedisBackend(client), ttl=60)
+    assert {'01/03/2021': 2} == other.get_or_compute('date', {}, compute)
+    assert 1 == len(calls)
+
+    other.invalidate()
+    cache.get_or_compute('date', {}, compute)
+    assert 2 == len(calls)
@@ -0,0 +1,184 @@
+import http.client
+import json
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from taxipassengers_backend import (PRIORITY_BULK, celery, delivery, gateway,
+                                    task)
+from taxipassengers_backend.models import (NotificationDeadLetterModel,
+                                           NotificationOutboxModel)
+
+HEADER = {'Authorization': 'Bearer x'}
+CHANNELS = {'sms': dict(delivery.CHANNELS['sms'], rate=10, burst=2)}
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    backend = delivery.LocalBackend()
+    monkeypatch.setattr(delivery, 'backend', backend)
+    return backend
+
+
+@pytest.fixture
+def retried(monkeypatch):
+    """
+    Retries queued by send_batch, instead of publishing them
+    """
+    queued = []
+    monkeypatch.setattr(task.send_batch, 'apply_async',
+                        lambda args, countdown, **options: queued.append(
+                            (args, countdown)))
+    return queued
+
+
+def test_rate_limit(monkeypatch):
+    slept = []
+    monkeypatch.setattr(delivery.time, 'sleep', slept.append)
+    monkeypatch.setattr(delivery.time, 'monotonic', lambda: 100.0)
+    limiter = delivery.RateLimiter(delivery.LocalBackend(), CHANNELS)
+
+    # The burst goes at once, then 10 per second
+    assert [0, 0] == [limiter.wait('sms') for _ in range(2)]
+    assert 0.1 == pytest.approx(limiter.wait('sms'))
+    assert 0.5 == pytest.approx(limiter.wait('sms', 4))
+    assert 2 == len(slept)
+
+    unlimited = {'sms': dict(CHANNELS['sms'], rate=0)}
+    limiter = delivery.RateLimiter(delivery.LocalBackend(), unlimited)
+    assert 0 == limiter.wait('sms', 100)
+
+
+def test_redis_backend():
+    fakeredis = pytest.importorskip('fakeredis')
+    backend = delivery.RedisBackend(fakeredis.FakeStrictRedis())
+
+    assert 1 == pytest.approx(backend.take('sms', 1, 0.01, 2), abs=0.01)
+    assert 0 == pytest.approx(backend.take('sms', 1, 0.01, 2), abs=0.01)
+    assert -1 == pytest.approx(backend.take('sms', 1, 0.01, 2), abs=0.01)
+    # Another channel has its own bucket
+    assert 1 == pytest.approx(backend.take('email', 1, 0.01, 2), abs=0.01)
+
+    backend.incr('sms:sent', 3)
+    backend.incr('sms:sent', 2)
+    assert {'sms:sent': 5} == backend.counters()
+
+
+def test_retry_and_dead_letter(app, metrics, retried, monkeypatch):
+    results = {
+        'ok': {'ok': True, 'status': 200, 'error': None},
+        'busy': {'ok': False, 'status': 503, 'error': 'Unavailable'},
+        'timeout': {'ok': False, 'status': None, 'error': 'Timed out'},
+        'invalid': {'ok': False, 'status': 400, 'error': 'Bad Request'},
+    }
+    monkeypatch.setattr(task, 'deliver', lambda channel, messages, header: [
+        results[message['phoneNumber']] for message in messages])
+    messages = [{'phoneNumber': name} for name in results]
+
+    task.send_batch('sms', messages, HEADER)
+
+    # Retried later with backoff
+    [((channel, retries, header, attempt), countdown)] = retried
+    assert ('sms', 1) == (channel, attempt)
+    assert [{'phoneNumber': 'busy'}, {'phoneNumber': 'timeout'}] == retries
+    assert 0 < countdown <= delivery.CHANNELS['sms']['retry_backoff']
+    # A client error is not retried
+    dead = NotificationDeadLetterModel.query.one()
+    assert {'phoneNumber': 'invalid'} == json.loads(dead.message)
+    assert (400, 'Bad Request', 1) == (dead.status, dead.error,
+                                       dead.attempts)
+
+    # Out of retries
+    max_retries = delivery.CHANNELS['sms']['max_retries']
+    task.send_batch('sms', retries, HEADER, max_retries)
+    assert 1 == len(retried)
+    assert 3 == NotificationDeadLetterModel.query.count()
+    assert {'sent': 1, 'retried': 2, 'deadLettered': 3} == \
+        delivery.metrics()['sms']
+
+    result = app.test_cli_runner().invoke(
+        args=['outbox', 'requeue-dead', '--channel', 'sms'])
+    assert 'Requeued 3 dead lettered messages' in result.output
+    assert 0 == NotificationDeadLetterModel.query.count()
+    assert 3 == NotificationOutboxModel.query.count()
+
+
+def test_metrics_endpoint(client, admin_header, user_header, metrics):
+    delivery.count('email', 'sent', 4)
+
+    response = client.get('/api/stat/notifications/',
+                          headers={'Authorization': admin_header})
+
+    assert http.client.OK == response.status_code
+    assert {'sent': 4, 'retried': 0, 'deadLettered': 0} == \
+        response.json['email']
+    assert 0 == response.json['sms']['sent']
+    assert 0 == response.json['outbox']
+    assert 0 == response.json['deadLetters']
+
+    response = client.get('/api/stat/notifications/',
+                          headers={'Authorization': user_header})
+    assert http.client.FORBIDDEN == response.status_code
+
+
+def test_routes():
+    def route(name, *args):
+        return celery.amqp.router.route({}, name, args)
+
+    assert 'sms' == route(task.send_sms.name, {}, HEADER)['queue'].name
+    assert 'email' == route(task.send_batch.name, 'email', [],
+                            HEADER)['queue'].name
+    bulk = route(task.send_suspension_batch.name, 1, [], HEADER)
+    assert ('bulk', PRIORITY_BULK) == (bulk['queue'].name, bulk['priority'])
+    assert 'celery' == route(task.dispatch_outbox.name)['queue'].name
+    assert celery.conf.task_ignore_result
+
+
+def test_send_sms_task(app, metrics, retried, monkeypatch):
+    monkeypatch.setattr(task.gateway, 'post', lambda *args: SimpleNamespace(
+        ok=True, status_code=201, reason='Created'))
+
+    results = task.send_sms({'phoneNumber': '0801', 'message': 'Hi'}, HEADER)
+
+    assert [{'ok': True, 'status': 201, 'error': None}] == results
+    assert 1 == delivery.metrics()['sms']['sent']
+
+
+def test_deliver_fan_out(monkeypatch):
+    def post(url, data, headers, json=None):
+        if data['phoneNumber'] == 'broken':
+            raise requests.ConnectionError('refused')
+        ok = data['phoneNumber'] != 'rejected'
+        return SimpleNamespace(ok=ok, status_code=200 if ok else 400,
+                               reason='OK' if ok else 'Bad Request')
+
+    monkeypatch.setattr(gateway, 'post', post)
+    messages = [{'phoneNumber': number}
+                for number in ('0801', 'rejected', 'broken', '0802')]
+
+    results = task.deliver('sms', messages, HEADER)
+
+    assert [True, False, False, True] == [r['ok'] for r in results]
+    assert [200, 400, None, 200] == [r['status'] for r in results]
+    assert 'refused' == results[2]['error']
+
+
+def test_deliver_bulk(monkeypatch):
+    posts = []
+
+    def post(url, data, headers, json=None):
+        posts.append((url, json))
+        return SimpleNamespace(ok=True, status_code=200, json=lambda: {
+            'results': [{'ok': True}, {'ok': False, 'error': 'Invalid'}]})
+
+    monkeypatch.setattr(gateway, 'post', post)
+    monkeypatch.setattr(task, 'EMAIL_BULK_URL', 'http://mail/bulk/')
+    messages = [{'emailAddress': 'ada@example.com'},
+                {'emailAddress': 'obi'}]
+
+    results = task.deliver('email', messages, HEADER)
+
+    assert [('http://mail/bulk/', {'messages': messages})] == posts
+    assert [True, False] == [result['ok'] for result in results]
+    assert 'Invalid' == results[1]['error']
@@ -0,0 +1,31 @@
+from taxipassengers_backend import gateway
+
+
+def test_session_per_process(monkeypatch):
+    gateway.close_session()
+    session = gateway.session()
+    assert session is gateway.session()
+    adapter = session.get_adapter('http://localhost/')
+    assert gateway.HTTP_POOL_SIZE == adapter._pool_maxsize
+
+    # A forked process gets its own connections
+    monkeypatch.setattr(gateway.os, 'getpid', lambda: -1)
+    assert session is not gateway.session()
+    gateway.close_session()
+
+
+def test_post_timeouts(monkeypatch):
+    sent = []
+    monkeypatch.setattr(gateway, '_session', gateway.make_session())
+    monkeypatch.setattr(gateway, '_session_pid', gateway.os.getpid())
+    monkeypatch.setattr(gateway._session, 'post',
+                        lambda url, **kwargs: sent.append((url, kwargs)))
+
+    gateway.post('http://sms/', {'message': 'Hi'}, {'Authorization': 'x'})
+
+    assert [('http://sms/', {
+        'data': {'message': 'Hi'},
+        'headers': {'Authorization': 'x'},
+        'json': None,
+        'timeout': (gateway.HTTP_CONNECT_TIMEOUT, gateway.HTTP_READ_TIMEOUT),
+    })] == sent
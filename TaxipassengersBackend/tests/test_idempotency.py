@@ -0,0 +1,128 @@
+import http.client
+import threading
+from datetime import datetime, timedelta
+
+from taxipassengers_backend import idempotency
+from taxipassengers_backend.models import (IdempotencyKeyModel,
+                                           PassengerModel)
+
+SIGNUP = {
+    'first': 'Ada',
+    'last': 'Obi',
+    'email': 'ada.obi@example.com',
+    'phone': '08011112222',
+}
+
+
+def test_create_replayed(client, user_header, sent_notifications):
+    headers = {'Authorization': user_header, 'Idempotency-Key': 'signup-1'}
+
+    response = client.post('/api/me/passenger/', data=SIGNUP,
+                           headers=headers)
+    assert http.client.CREATED == response.status_code
+    assert 'Idempotent-Replayed' not in response.headers
+    created = response.json
+
+    response = client.post('/api/me/passenger/', data=SIGNUP,
+                           headers=headers)
+    assert http.client.CREATED == response.status_code
+    assert 'true' == response.headers['Idempotent-Replayed']
+    assert created == response.json
+
+    # Created and welcomed once
+    assert 1 == PassengerModel.query.count()
+    assert 1 == len(sent_notifications)
+
+    # Without the key it's a new request
+    response = client.post('/api/me/passenger/', data=SIGNUP,
+                           headers={'Authorization': user_header})
+    assert http.client.UNPROCESSABLE_ENTITY == response.status_code
+
+
+def test_update_replayed(client, admin_header, passenger_fixture,
+                         sent_notifications):
+    passenger = passenger_fixture()
+    url = f'/api/passenger/{passenger.id}/'
+    headers = {'Authorization': admin_header, 'Idempotency-Key': 'suspend'}
+
+    response = client.put(url, data={'suspend': 1}, headers=headers)
+    assert http.client.OK == response.status_code
+    etag = response.headers['ETag']
+    response = client.put(url, data={'suspend': 1}, headers=headers)
+    assert http.client.OK == response.status_code
+    assert etag == response.headers['ETag']
+    assert 1 == len(sent_notifications)
+
+    # The same key with another body
+    response = client.put(url, data={'suspend': 0}, headers=headers)
+    assert http.client.UNPROCESSABLE_ENTITY == response.status_code
+
+    # Keys are scoped to the path
+    response = client.patch(url, json={'suspend': 0}, headers=headers)
+    assert http.client.OK == response.status_code
+    assert response.json['suspendedAt'] is None
+
+
+def test_in_progress(app, client, user_header, sent_notifications,
+                     monkeypatch):
+    headers = {'Authorization': user_header, 'Idempotency-Key': 'slow'}
+    original = idempotency.reserve
+    retried = threading.Event()
+    responses = []
+
+    def retry():
+        with app.test_client() as other:
+            responses.append(other.post('/api/me/passenger/', data=SIGNUP,
+                                        headers=headers))
+
+    def reserve(key, fingerprint):
+        entry = original(key, fingerprint)
+        if not retried.is_set():
+            # A retry arriving while the first request runs
+            retried.set()
+            thread = threading.Thread(target=retry)
+            thread.start()
+            thread.join()
+        return entry
+
+    monkeypatch.setattr(idempotency, 'reserve', reserve)
+    response = client.post('/api/me/passenger/', data=SIGNUP,
+                           headers=headers)
+
+    assert http.client.CREATED == response.status_code
+    assert http.client.CONFLICT == responses[0].status_code
+    assert 1 == len(sent_notifications)
+
+
+def test_failed_request_not_saved(client, user_header, passenger_fixture):
+    passenger = passenger_fixture(authId=2000)
+    url = f'/api/passenger/{passenger.id}/'
+    headers = {'Authorization': user_header, 'Idempotency-Key': 'forbidden'}
+
+    response = client.put(url, data={'first': 'Changed'}, headers=headers)
+    assert http.client.FORBIDDEN == response.status_code
+    assert 0 == IdempotencyKeyModel.query.count()
+
+
+def test_expired_key(app, client, user_header, sent_notifications):
+    headers = {'Authorization': user_header, 'Idempotency-Key': 'old'}
+    response = client.post('/api/me/passenger/', data=SIGNUP,
+                           headers=headers)
+    assert http.client.CREATED == response.status_code
+
+    entry = IdempotencyKeyModel.query.one()
+    entry.expiresAt = datetime.utcnow() - timedelta(seconds=1)
+    app.db.session.commit()
+
+    # Runs again, the passenger exists now
+    response = client.post('/api/me/passenger/', data=SIGNUP,
+                           headers=headers)
+    assert http.client.UNPROCESSABLE_ENTITY == response.status_code
+    assert 'Idempotent-Replayed' not in response.headers
+
+    IdempotencyKeyModel.query.update(
+        {'expiresAt': datetime.utcnow() - timedelta(seconds=1)})
+    app.db.session.commit()
+    result = app.test_cli_runner().invoke(args=['idempotency', 'purge'])
+    assert 'Deleted 1 expired idempotency keys' in result.output
+    assert 0 == IdempotencyKeyModel.query.count()
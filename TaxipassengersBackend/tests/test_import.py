@@ -0,0 +1,153 @@
+import http.client
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+from taxipassengers_backend import gateway, importer, task
+from taxipassengers_backend.models import PassengerModel
+from taxipassengers_backend.namespaces import api
+from taxipassengers_backend.stats import passenger_facets
+
+
+def ndjson(*rows):
+    return '\n'.join(row if isinstance(row, str) else json.dumps(row)
+                     for row in rows) + '\n'
+
+
+def import_row(number, **kwargs):
+    row = {
+        'authId': 5000 + number,
+        'first': f'First{number}',
+        'last': f'Last{number}',
+        'email': f'import{number}@example.com',
+        'phone': f'0905{number:07d}',
+    }
+    row.update(kwargs)
+    return row
+
+
+def test_import_ndjson(app, client, admin_header, passenger_fixture,
+                       monkeypatch):
+    existing = passenger_fixture()
+    batches = []
+    monkeypatch.setattr(api, 'send_welcome_notifications',
+                        lambda passengers, authorization:
+                        batches.append([p['email'] for p in passengers]))
+
+    body = ndjson(
+        import_row(1, timestamp='2021-03-01T10:00:00+01:00'),
+        import_row(2, emailStatus=0, phoneNumberStatus=1),
+        'not json',
+        import_row(3, first=''),
+        import_row(4, emailStatus=3),
+        import_row(5, email=existing.email),
+        import_row(6, authId=5001),
+        import_row(7),
+    )
+    response = client.post('/api/passenger/import/?batchSize=2', data=body,
+                           content_type='application/x-ndjson',
+                           headers={'Authorization': admin_header})
+
+    assert http.client.OK == response.status_code
+    assert 3 == response.json['inserted']
+    assert 5 == response.json['rejected']
+    assert [
+        {'line': 3, 'errors': ['not a valid record']},
+        {'line': 4, 'errors': ['first is required']},
+        {'line': 5, 'errors': ['emailStatus must be one of 0, 1']},
+        {'line': 6, 'errors': [f'email {existing.email} is already used']},
+        {'line': 7, 'errors': ['authId 5001 is already used']},
+    ] == response.json['errors']
+
+    passenger = PassengerModel.query.filter_by(authId=5001).one()
+    assert 'First1' == passenger.firstName
+    assert datetime(2021, 3, 1, 9, 0, 0) == passenger.timestamp
+    assert 1 == passenger.emailStatus
+    passenger = PassengerModel.query.filter_by(authId=5002).one()
+    assert (0, 1) == (passenger.emailStatus, passenger.phoneNumberStatus)
+
+    # A notification batch per inserted batch
+    assert [['import1@example.com', 'import2@example.com'],
+            ['import7@example.com']] == batches
+    facets = passenger_facets()
+    assert 4 == facets['total']
+    assert 3 == facets['emailVerified']
+
+
+def test_import_csv(client, admin_header):
+    body = ('authId,first,last,email,phone,homeLocation\r\n'
+            '6001,Ada,Obi,ada@example.com,08000000001,Ikeja\r\n'
+            '6002,Bayo,,bayo@example.com,08000000002,Yaba\r\n')
+    response = client.post('/api/passenger/import/?notify=false', data=body,
+                           content_type='text/csv',
+                           headers={'Authorization': admin_header})
+
+    assert http.client.OK == response.status_code
+    assert 1 == response.json['inserted']
+    assert [{'line': 3, 'errors': ['last is required']}] == \
+        response.json['errors']
+    assert 'Ikeja' == PassengerModel.query.filter_by(
+        authId=6001).one().homeLocation
+
+
+def test_import_only_admin(client, user_header):
+    response = client.post('/api/passenger/import/', data=ndjson(),
+                           headers={'Authorization': user_header})
+    assert http.client.FORBIDDEN == response.status_code
+
+
+def test_import_concurrent_conflict(app, passenger_fixture, monkeypatch):
+    existing = passenger_fixture()
+    # As if the passenger was created after the conflict checks
+    monkeypatch.setattr(importer, 'reject_conflicts',
+                        lambda rows, result: rows)
+
+    lines = ndjson(import_row(1), import_row(2, phone=existing.phoneNumber),
+                   import_row(3)).splitlines()
+    result = importer.import_passengers(lines, 'ndjson',
+                                        api.importRowParser.args)
+
+    assert 2 == result.inserted
+    assert [{'line': 2,
+             'errors': ['authId, email or phone is already used']}] == \
+        result.errors
+    assert 3 == PassengerModel.query.count()
+    assert 3 == passenger_facets()['total']
+
+
+def test_import_command(app, tmp_path):
+    source = tmp_path / 'passengers.ndjson'
+    source.write_text(ndjson(import_row(1), import_row(2, phone='')))
+
+    runner = app.test_cli_runner(mix_stderr=False)
+    result = runner.invoke(args=['passengers', 'import', str(source),
+                                 '--batch-size', '10'])
+
+    assert 0 == result.exit_code, result.output
+    assert 'Imported 1 passengers, rejected 1' in result.output
+    assert 'Line 2: phone is required' in result.stderr
+    assert 1 == PassengerModel.query.filter_by(authId=5001).count()
+
+
+def test_welcome_batch(monkeypatch):
+    posts = []
+
+    def post(url, data, headers):
+        posts.append((url, data))
+        return SimpleNamespace(ok=True, status_code=200, reason='OK')
+
+    monkeypatch.setattr(gateway, 'post', post)
+
+    recipients = [{'firstName': f'First{number}', 'lastName': 'Last',
+                   'email': f'import{number}@example.com',
+                   'phoneNumber': f'0905{number:07d}'}
+                  for number in range(3)]
+    task.send_welcome_batch(recipients, {'Authorization': 'Bearer x'})
+
+    # Each channel on its own, the messages of a channel in parallel
+    assert 6 == len(posts)
+    assert [task.SMS_URL] * 3 + [task.EMAIL_URL] * 3 == \
+        [url for url, _ in posts]
+    assert 'First0' in min(data['message'] for _, data in posts[:3])
+    assert 'import2@example.com' == max(data['emailAddress']
+                                        for _, data in posts[3:])
@@ -0,0 +1,100 @@
+import json
+
+import jwt
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+from taxipassengers_backend import token as token_validation
+from taxipassengers_backend.keyring import KeyRing
+from .constants import PRIVATE_KEY, PUBLIC_KEY
+
+
+def generate_key_pair():
+    private_key = rsa.generate_private_key(public_exponent=65537,
+                                           key_size=2048,
+                                           backend=default_backend())
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo)
+    return private_key, public_pem
+
+
+def generate_header(private_key, kid=None):
+    payload = {
+        'id': 1,
+        'exp': 4102444800,
+    }
+    headers = {'kid': kid} if kid else None
+    token = jwt.encode(payload, private_key, algorithm='RS256',
+                       headers=headers)
+    return f'Bearer {token.decode("utf8")}'
+
+
+def test_default_key_without_kid():
+    keyring = KeyRing(default_key=PUBLIC_KEY)
+    header = generate_header(PRIVATE_KEY)
+    result = token_validation.validate_token_header(header, keyring,
+                                                    cache=None)
+    assert 1 == result['id']
+
+
+def test_key_from_directory(tmp_path):
+    private_key, public_pem = generate_key_pair()
+    (tmp_path / 'key-1.pem').write_bytes(public_pem)
+    keyring = KeyRing(tmp_path, default_key=PUBLIC_KEY)
+    assert {'default', 'key-1'} == set(keyring.keys)
+
+    header = generate_header(private_key, kid='key-1')
+    result = token_validation.validate_token_header(header, keyring,
+                                                    cache=None)
+    assert 1 == result['id']
+
+    # The kid selects the key, a token signed by another key fails
+    header = generate_header(PRIVATE_KEY, kid='key-1')
+    result = token_validation.validate_token_header(header, keyring,
+                                                    cache=None)
+    assert None is result
+
+
+def test_unknown_kid(tmp_path):
+    keyring = KeyRing(tmp_path, default_key=PUBLIC_KEY)
+    header = generate_header(PRIVATE_KEY, kid='unknown')
+    result = token_validation.validate_token_header(header, keyring,
+                                                    cache=None)
+    assert None is result
+
+
+def test_key_from_jwks(tmp_path):
+    private_key, _ = generate_key_pair()
+    jwk = json.loads(RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk['kid'] = 'jwks-key'
+    jwks_file = tmp_path / 'jwks.json'
+    jwks_file.write_text(json.dumps({'keys': [jwk]}))
+
+    keyring = KeyRing(jwks_file)
+    header = generate_header(private_key, kid='jwks-key')
+    result = token_validation.validate_token_header(header, keyring,
+                                                    cache=None)
+    assert 1 == result['id']
+
+
+def test_key_rotation(tmp_path):
+    cache = token_validation.TokenCache(maxsize=10)
+    keyring = KeyRing(tmp_path, default_key=PUBLIC_KEY, reload_interval=0)
+    private_key, public_pem = generate_key_pair()
+    header = generate_header(private_key, kid='new-key')
+
+    result = token_validation.validate_token_header(header, keyring, cache)
+    assert None is result
+
+    # Add the new key, it gets loaded without recreating the key ring
+    (tmp_path / 'new-key.pem').write_bytes(public_pem)
+    result = token_validation.validate_token_header(header, keyring, cache)
+    assert 1 == result['id']
+
+    # Remove it, the cached verification is not used anymore
+    (tmp_path / 'new-key.pem').unlink()
+    result = token_validation.validate_token_header(header, keyring, cache)
+    assert None is result
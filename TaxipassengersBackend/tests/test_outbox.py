@@ -0,0 +1,119 @@
+import http.client
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from taxipassengers_backend import outbox, utils
+from taxipassengers_backend.models import NotificationOutboxModel
+
+SIGNUP = {
+    'first': 'Ada',
+    'last': 'Obi',
+    'email': 'ada.obi@example.com',
+    'phone': '08011112222',
+}
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """
+    Batches published by the dispatcher, instead of queueing them
+    """
+    batches = []
+    monkeypatch.setattr(utils, 'send_batch', SimpleNamespace(
+        delay=lambda *args: batches.append(args)))
+    return batches
+
+
+def test_signup_outbox(app, client, user_header, published):
+    response = client.post('/api/me/passenger/', data=SIGNUP,
+                           headers={'Authorization': user_header})
+    assert http.client.CREATED == response.status_code
+
+    # Written with the passenger, published later
+    assert ['sms', 'email'] == [message.channel for message in
+                                NotificationOutboxModel.query.order_by(
+                                    NotificationOutboxModel.id)]
+    assert [] == published
+
+    result = app.test_cli_runner().invoke(args=['outbox', 'dispatch'])
+    assert 'Published 2 outbox messages' in result.output
+    assert 0 == NotificationOutboxModel.query.count()
+    (sms, sms_messages, header), (email, email_messages, _) = published
+    assert ('sms', 'email') == (sms, email)
+    assert {'Authorization': user_header} == header
+    assert '08011112222' == sms_messages[0]['phoneNumber']
+    assert 'Hi Ada' in sms_messages[0]['message']
+    assert 'ada.obi@example.com' == email_messages[0]['emailAddress']
+
+
+def test_rolled_back_not_sent(client, admin_header, passenger_fixture):
+    passengerId = passenger_fixture().id
+
+    response = client.patch(f'/api/passenger/{passengerId}/',
+                            json={'suspend': 1},
+                            headers={'Authorization': admin_header,
+                                     'If-Match': '"stale"'})
+
+    assert http.client.PRECONDITION_FAILED == response.status_code
+    assert 0 == NotificationOutboxModel.query.count()
+
+    response = client.patch(f'/api/passenger/{passengerId}/',
+                            json={'suspend': 1},
+                            headers={'Authorization': admin_header})
+    assert http.client.OK == response.status_code
+    assert 2 == NotificationOutboxModel.query.count()
+
+
+def test_dispatch_batches(app):
+    data = {'phoneNumber': '0801', 'email': 'ada@example.com',
+            'subject': 'Hi', 'typeMessage': 'Welcome Message'}
+    for number in range(3):
+        authorization = f'Bearer {number % 2}'
+        outbox.queue_notification(dict(data, Authorization=authorization),
+                                  '<p>Hi</p>', 'Hi')
+    app.db.session.commit()
+    batches = []
+
+    def publish(channel, messages, header):
+        if channel == 'sms' and header['Authorization'] == 'Bearer 1':
+            raise ConnectionError('broker down')
+        batches.append((channel, len(messages), header['Authorization']))
+
+    assert 4 == outbox.dispatch(batch_size=4, publish=publish)
+    assert [('sms', 1, 'Bearer 0'), ('email', 1, 'Bearer 0'),
+            ('email', 1, 'Bearer 1')] == batches
+
+    # The failed message is retried later, the rest are taken now
+    assert 2 == outbox.drain(batch_size=4, publish=publish)
+    assert ('email', 1, 'Bearer 0') == batches[-1]
+    failed = NotificationOutboxModel.query.one()
+    assert ('sms', 'Bearer 1') == (failed.channel, failed.authorization)
+    assert 1 == failed.attempts
+    assert failed.availableAt > datetime.utcnow()
+
+
+def test_dispatcher_survives_errors(app, monkeypatch):
+    class Stop(Exception):
+        pass
+
+    results = [OperationalError('SELECT', {}, 'database is locked'), 2, 0]
+
+    def drain(batch_size):
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def sleep(interval):
+        if not results:
+            raise Stop()
+
+    monkeypatch.setattr(outbox, 'drain', drain)
+    monkeypatch.setattr(outbox.time, 'sleep', sleep)
+
+    with pytest.raises(Stop):
+        outbox.run_dispatcher(interval=0)
+    assert [] == results
@@ -0,0 +1,534 @@
+import csv
+import http.client
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+from sqlalchemy import event
+
+from taxipassengers_backend import config, models
+from taxipassengers_backend.models import PassengerModel
+from taxipassengers_backend.namespaces import api
+from taxipassengers_backend.stats import passenger_facets
+from taxipassengers_backend.token import generate_token_header
+
+
+def test_list_passengers_pages(client, user_header, passenger_fixture):
+    passengers = [passenger_fixture() for _ in range(5)]
+    ids = [passenger.id for passenger in passengers]
+
+    response = client.get('/api/passenger/?limit=2',
+                          headers={'Authorization': user_header})
+    assert http.client.OK == response.status_code
+    assert ids[:2] == [row['id'] for row in response.json]
+    cursor = response.headers['X-Next-Cursor']
+
+    response = client.get(f'/api/passenger/?limit=2&after={cursor}',
+                          headers={'Authorization': user_header})
+    assert ids[2:4] == [row['id'] for row in response.json]
+    cursor = response.headers['X-Next-Cursor']
+
+    response = client.get(f'/api/passenger/?limit=2&after={cursor}',
+                          headers={'Authorization': user_header})
+    assert ids[4:] == [row['id'] for row in response.json]
+    assert 'X-Next-Cursor' not in response.headers
+
+
+def test_list_passengers_page_size_is_bounded(client, user_header,
+                                              passenger_fixture, monkeypatch):
+    monkeypatch.setattr(api, 'MAX_PAGE_SIZE', 3)
+    for _ in range(5):
+        passenger_fixture()
+
+    response = client.get('/api/passenger/?limit=1000',
+                          headers={'Authorization': user_header})
+    assert 3 == len(response.json)
+    assert 'X-Next-Cursor' in response.headers
+
+    response = client.get('/api/passenger/?limit=0',
+                          headers={'Authorization': user_header})
+    assert http.client.BAD_REQUEST == response.status_code
+
+
+def test_list_passengers_filters(client, user_header, passenger_fixture):
+    passenger_fixture(firstName='Ada', emailStatus=1)
+    passenger_fixture(firstName='Bob', emailStatus=0)
+
+    response = client.get('/api/passenger/?emailStatus=unverified',
+                          headers={'Authorization': user_header})
+    assert ['Bob'] == [row['firstName'] for row in response.json]
+
+
+def test_list_passengers_unauthorized(client):
+    response = client.get('/api/passenger/')
+    assert http.client.UNAUTHORIZED == response.status_code
+
+    token = jwt.encode({'id': 1}, 'secret', algorithm='HS256')
+    response = client.get('/api/passenger/', headers={
+        'Authorization': f'Bearer {token.decode("utf8")}'})
+    assert http.client.UNAUTHORIZED == response.status_code
+
+
+def test_sparse_fieldset(app, client, user_header, passenger_fixture):
+    passenger = passenger_fixture(image='http://example.com/image.png')
+    passenger_id = passenger.id
+    expected = {
+        'firstName': passenger.firstName,
+        'phoneNumber': passenger.phoneNumber,
+    }
+    # Start from an empty session, like a new request
+    app.db.session.remove()
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(app.db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(
+            f'/api/passenger/{passenger_id}/?fields=firstName,phoneNumber',
+            headers={'Authorization': user_header})
+    finally:
+        event.remove(app.db.engine, 'before_cursor_execute', record)
+
+    assert http.client.OK == response.status_code
+    assert expected == response.json
+    assert 'image' not in statements[-1]
+
+
+def test_sparse_fieldset_list(client, user_header, passenger_fixture):
+    passenger = passenger_fixture()
+
+    response = client.get('/api/passenger/?fields=id,rating',
+                          headers={'Authorization': user_header})
+    assert [{'id': passenger.id, 'rating': 0.0}] == response.json
+
+
+def test_sparse_fieldset_unknown_field(client, user_header):
+    response = client.get('/api/me/passenger/?fields=firstName,password',
+                          headers={'Authorization': user_header})
+    assert http.client.BAD_REQUEST == response.status_code
+
+
+def test_search_passengers(client, user_header, passenger_fixture):
+    passenger_fixture(firstName='Jonathan', lastName='Smith')
+    passenger_fixture(firstName='Mary', lastName='Johnson')
+    passenger_fixture(firstName='Craig', lastName='Watson',
+                      email='craig.w@example.com')
+
+    response = client.get('/api/passenger/?search=SON',
+                          headers={'Authorization': user_header})
+    assert {'Mary', 'Craig'} == {row['firstName'] for row in response.json}
+
+    response = client.get('/api/passenger/?search=craig.w&searchField=email',
+                          headers={'Authorization': user_header})
+    assert ['Craig'] == [row['firstName'] for row in response.json]
+
+    response = client.get('/api/passenger/?search=craig&searchField=phone',
+                          headers={'Authorization': user_header})
+    assert [] == response.json
+
+
+def test_search_follows_updates(app, client, user_header, passenger_fixture):
+    passenger = passenger_fixture(firstName='Jonathan', lastName='Smith')
+    passenger.firstName = 'Peter'
+    app.db.session.commit()
+
+    response = client.get('/api/passenger/?search=jon&searchField=name',
+                          headers={'Authorization': user_header})
+    assert [] == response.json
+
+    response = client.get('/api/passenger/?search=pete&searchField=name',
+                          headers={'Authorization': user_header})
+    assert ['Peter'] == [row['firstName'] for row in response.json]
+
+
+def search_pages(client, user_header, query):
+    pages = []
+    url = f'/api/passenger/?{query}&limit=2'
+    while url:
+        response = client.get(url, headers={'Authorization': user_header})
+        assert http.client.OK == response.status_code
+        pages.append([row['lastName'] for row in response.json])
+        cursor = response.headers.get('X-Next-Cursor')
+        url = cursor and f'/api/passenger/?{query}&limit=2&after={cursor}'
+    return pages
+
+
+def test_search_pages(client, user_header, passenger_fixture):
+    names = ['Johnson', 'Jonson', 'Robinson', 'Dickinson', 'Anderson']
+    for name in names:
+        passenger_fixture(firstName='Ada', lastName=name)
+    passenger_fixture(firstName='Ada', lastName='Okafor')
+
+    # Ranked, then ordered by id for the short terms
+    for query in ('search=son&searchField=name', 'search=n&searchField=name'):
+        pages = search_pages(client, user_header, query)
+        assert [2, 2, 1] == [len(page) for page in pages], query
+        assert sorted(names) == sorted(sum(pages, [])), query
+
+    # A search cursor doesn't apply to the plain listing, nor the reverse
+    response = client.get('/api/passenger/?after=0.5:3',
+                          headers={'Authorization': user_header})
+    assert http.client.BAD_REQUEST == response.status_code
+    response = client.get('/api/passenger/?search=son&after=3',
+                          headers={'Authorization': user_header})
+    assert http.client.BAD_REQUEST == response.status_code
+
+
+def test_search_without_trigram(monkeypatch, client, user_header,
+                                passenger_fixture):
+    # SQLite before 3.34 has no FTS5 trigram tokenizer
+    monkeypatch.setattr(models, 'FTS_TRIGRAM', False)
+    passenger_fixture(firstName='Mary', lastName='Johnson')
+    passenger_fixture(firstName='Craig', lastName='Watson')
+    passenger_fixture(firstName='Ada', lastName='Okafor')
+
+    pages = search_pages(client, user_header, 'search=SON&searchField=name')
+    assert [['Johnson', 'Watson']] == pages
+
+
+def test_search_short_term(client, user_header, passenger_fixture):
+    passenger_fixture(firstName='Al', lastName='Fox')
+    passenger_fixture(firstName='Bo', lastName='Fox')
+
+    response = client.get('/api/passenger/?search=a&searchField=name',
+                          headers={'Authorization': user_header})
+    assert ['Al'] == [row['firstName'] for row in response.json]
+
+
+def test_export_passengers_ndjson(app, admin_header, passenger_fixture):
+    # The streamed response can't be used with the context preserving
+    # client fixture
+    client = app.test_client()
+    passengers = [passenger_fixture(firstName=name, lastName='Fox')
+                  for name in ('Ada', 'Bob', 'Cy')]
+
+    response = client.get('/api/passenger/export/?fields=id,firstName',
+                          headers={'Authorization': admin_header})
+    assert http.client.OK == response.status_code
+    assert 'application/x-ndjson' == response.mimetype
+    rows = [json.loads(line) for line in response.data.splitlines()]
+    assert [{'id': passenger.id, 'firstName': passenger.firstName}
+            for passenger in passengers] == rows
+
+
+def test_export_passengers_csv_filtered(app, admin_header,
+                                        passenger_fixture):
+    client = app.test_client()
+    passenger_fixture(firstName='Ada', lastName='Fox', emailStatus=1)
+    passenger = passenger_fixture(firstName='Bob', lastName='Fox',
+                                  emailStatus=0)
+
+    response = client.get(
+        '/api/passenger/export/?format=csv&emailStatus=unverified',
+        headers={'Authorization': admin_header})
+    assert 'text/csv' == response.mimetype
+    rows = list(csv.DictReader(io.StringIO(response.data.decode('utf8'))))
+    assert [str(passenger.id)] == [row['id'] for row in rows]
+    assert 'Bob' == rows[0]['firstName']
+
+
+def test_export_passengers_only_admin(client, user_header):
+    response = client.get('/api/passenger/export/',
+                          headers={'Authorization': user_header})
+    assert http.client.FORBIDDEN == response.status_code
+
+
+def test_conditional_get_passenger(client, user_header, passenger_fixture):
+    passenger = passenger_fixture()
+    url = f'/api/passenger/{passenger.id}/'
+
+    response = client.get(url, headers={'Authorization': user_header})
+    assert http.client.OK == response.status_code
+    etag = response.headers['ETag']
+    assert 'Last-Modified' in response.headers
+
+    response = client.get(url, headers={'Authorization': user_header,
+                                        'If-None-Match': etag})
+    assert http.client.NOT_MODIFIED == response.status_code
+    assert etag == response.headers['ETag']
+
+    # Another representation has another ETag
+    response = client.get(f'{url}?fields=id', headers={
+        'Authorization': user_header,
+        'If-None-Match': etag
+    })
+    assert http.client.OK == response.status_code
+
+
+def test_conditional_get_after_update(client, user_header, admin_header,
+                                      passenger_fixture):
+    passenger = passenger_fixture()
+    url = f'/api/passenger/{passenger.id}/'
+    response = client.get(url, headers={'Authorization': user_header})
+    etag = response.headers['ETag']
+
+    response = client.put(url, data={'first': 'Changed'},
+                          headers={'Authorization': admin_header})
+    assert http.client.OK == response.status_code
+    assert etag != response.headers['ETag']
+
+    response = client.get(url, headers={'Authorization': user_header,
+                                        'If-None-Match': etag})
+    assert http.client.OK == response.status_code
+    assert 'Changed' == response.json['firstName']
+
+
+def test_conditional_get_list(client, user_header, passenger_fixture):
+    passenger_fixture()
+    response = client.get('/api/passenger/',
+                          headers={'Authorization': user_header})
+    etag = response.headers['ETag']
+
+    response = client.get('/api/passenger/', headers={
+        'Authorization': user_header,
+        'If-None-Match': etag
+    })
+    assert http.client.NOT_MODIFIED == response.status_code
+
+    passenger_fixture()
+    response = client.get('/api/passenger/', headers={
+        'Authorization': user_header,
+        'If-None-Match': etag
+    })
+    assert http.client.OK == response.status_code
+    assert 2 == len(response.json)
+
+
+def test_update_if_match(client, admin_header, passenger_fixture):
+    passenger = passenger_fixture()
+    url = f'/api/passenger/{passenger.id}/'
+    response = client.get(url, headers={'Authorization': admin_header})
+    etag = response.headers['ETag']
+
+    response = client.put(url, data={'first': 'First'}, headers={
+        'Authorization': admin_header,
+        'If-Match': etag
+    })
+    assert http.client.OK == response.status_code
+
+    # The ETag used is not current anymore
+    response = client.put(url, data={'first': 'Second'}, headers={
+        'Authorization': admin_header,
+        'If-Match': etag
+    })
+    assert http.client.PRECONDITION_FAILED == response.status_code
+
+
+def test_patch_passenger(client, user_header, passenger_fixture):
+    passenger = passenger_fixture(authId=1000, dateOfBirth='1980-01-01',
+                                  image='me.png')
+    url = f'/api/passenger/{passenger.id}/'
+    lastName = passenger.lastName
+
+    response = client.patch(url, json={'first': 'Patched', 'dob': None},
+                            headers={'Authorization': user_header})
+
+    assert http.client.OK == response.status_code
+    assert 'Patched' == response.json['firstName']
+    # null clears the field, absent fields are kept
+    assert response.json['dateOfBirth'] is None
+    assert lastName == response.json['lastName']
+    assert 'me.png' == response.json['image']
+    assert response.json['updateTimestamp'] is not None
+    assert response.headers['ETag']
+
+    passenger = PassengerModel.query.get(passenger.id)
+    assert ('Patched', None) == (passenger.firstName, passenger.dateOfBirth)
+
+
+def test_patch_passenger_single_update(app, client, user_header,
+                                       passenger_fixture):
+    passenger_id = passenger_fixture(authId=1000).id
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(app.db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.patch(f'/api/passenger/{passenger_id}/',
+                                json={'image': 'new.png'},
+                                headers={'Authorization': user_header})
+    finally:
+        event.remove(app.db.engine, 'before_cursor_execute', record)
+
+    assert http.client.OK == response.status_code
+    # No passenger loaded before the update
+    assert statements[0].startswith('UPDATE passenger_model')
+
+    # Not authenticated, nothing is read
+    statements.clear()
+    event.listen(app.db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.patch(f'/api/passenger/{passenger_id}/',
+                                json={'image': 'other.png'})
+    finally:
+        event.remove(app.db.engine, 'before_cursor_execute', record)
+    assert http.client.UNAUTHORIZED == response.status_code
+    assert [] == statements
+
+
+def test_patch_passenger_not_owner(client, user_header, admin_header,
+                                   passenger_fixture):
+    passenger = passenger_fixture(authId=2000)
+    url = f'/api/passenger/{passenger.id}/'
+
+    response = client.patch(url, json={'first': 'Changed'},
+                            headers={'Authorization': user_header})
+    assert http.client.NOT_FOUND == response.status_code
+
+    response = client.patch(url, json={'first': 'Changed'},
+                            headers={'Authorization': admin_header})
+    assert http.client.OK == response.status_code
+
+    response = client.patch('/api/passenger/999999/', json={'first': 'X'},
+                            headers={'Authorization': admin_header})
+    assert http.client.NOT_FOUND == response.status_code
+
+
+def test_patch_passenger_bad_request(client, admin_header,
+                                     passenger_fixture):
+    passenger = passenger_fixture()
+    email = passenger_fixture().email
+    url = f'/api/passenger/{passenger.id}/'
+
+    response = client.patch(url, json={},
+                            headers={'Authorization': admin_header})
+    assert http.client.BAD_REQUEST == response.status_code
+
+    # Required fields can't be cleared
+    response = client.patch(url, json={'email': None},
+                            headers={'Authorization': admin_header})
+    assert http.client.BAD_REQUEST == response.status_code
+
+    response = client.patch(url, json={'emailStatus': 3},
+                            headers={'Authorization': admin_header})
+    assert http.client.BAD_REQUEST == response.status_code
+
+    response = client.patch(url, json={'email': email},
+                            headers={'Authorization': admin_header})
+    assert http.client.UNPROCESSABLE_ENTITY == response.status_code
+
+
+def test_patch_passenger_suspend(client, admin_header, passenger_fixture,
+                                 sent_notifications):
+    passenger = passenger_fixture(phoneNumberStatus=1)
+    url = f'/api/passenger/{passenger.id}/'
+
+    response = client.patch(url, json={'suspend': 1, 'emailStatus': 0},
+                            headers={'Authorization': admin_header})
+
+    assert http.client.OK == response.status_code
+    assert response.json['suspendedAt'] is not None
+    assert 1 == len(sent_notifications)
+    facets = passenger_facets()
+    assert (1, 0, 1) == (facets['suspended'], facets['emailVerified'],
+                         facets['phoneVerified'])
+
+    # Already suspended, no new message
+    response = client.patch(url, json={'suspend': 1},
+                            headers={'Authorization': admin_header})
+    assert http.client.OK == response.status_code
+    assert 1 == len(sent_notifications)
+    assert 1 == passenger_facets()['suspended']
+
+    response = client.patch(url, json={'suspend': 0},
+                            headers={'Authorization': admin_header})
+    assert response.json['suspendedAt'] is None
+    assert 0 == passenger_facets()['suspended']
+
+
+def test_patch_if_match(client, admin_header, passenger_fixture):
+    passenger = passenger_fixture()
+    url = f'/api/passenger/{passenger.id}/'
+    response = client.get(url, headers={'Authorization': admin_header})
+    etag = response.headers['ETag']
+
+    response = client.patch(url, json={'first': 'First'}, headers={
+        'Authorization': admin_header,
+        'If-Match': etag
+    })
+    assert http.client.OK == response.status_code
+
+    # The ETag used is not current anymore, nothing is changed
+    response = client.patch(url, json={'first': 'Second'}, headers={
+        'Authorization': admin_header,
+        'If-Match': etag
+    })
+    assert http.client.PRECONDITION_FAILED == response.status_code
+    assert 'First' == PassengerModel.query.get(passenger.id).firstName
+
+
+def signup(number, **kwargs):
+    data = {
+        'first': f'First{number}',
+        'last': f'Last{number}',
+        'email': f'signup{number}@example.com',
+        'phone': f'0907{number:07d}',
+    }
+    data.update(kwargs)
+    return data
+
+
+def test_create_passenger_conflicts(client, user_header, passenger_fixture,
+                                    sent_notifications):
+    existing = passenger_fixture(authId=2000)
+    email, phone = existing.email, existing.phoneNumber
+
+    response = client.post('/api/me/passenger/', data=signup(1),
+                           headers={'Authorization': user_header})
+    assert http.client.CREATED == response.status_code
+    assert 'signup1@example.com' == response.json['email']
+    assert 1 == response.json['emailStatus']
+
+    response = client.post('/api/me/passenger/', data=signup(2),
+                           headers={'Authorization': user_header})
+    assert http.client.UNPROCESSABLE_ENTITY == response.status_code
+    assert ['authId'] == response.json['conflicts']
+    assert ('Auth Id has already been used to create a passenger' ==
+            response.json['result'])
+
+    header = generate_token_header({'id': 2001}, config.PRIVATE_KEY)
+    response = client.post('/api/me/passenger/',
+                           data=signup(3, email=email, phone=phone),
+                           headers={'Authorization': header})
+    assert http.client.UNPROCESSABLE_ENTITY == response.status_code
+    assert ['email', 'phoneNumber'] == response.json['conflicts']
+
+    assert 1 == len(sent_notifications)
+    assert 2 == passenger_facets()['total']
+
+
+def test_create_passenger_concurrent(app, sent_notifications):
+    """
+    Simultaneous signups sharing eight email addresses, five of them with
+    the same auth id
+    """
+    def create(number):
+        authId = 3000 if number >= 16 else 3000 + number
+        header = generate_token_header({'id': authId}, config.PRIVATE_KEY)
+        with app.test_client() as client:
+            return client.post('/api/me/passenger/',
+                               data=signup(number, email=f'burst{number % 8}'
+                                           '@example.com'),
+                               headers={'Authorization': header})
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(pool.map(create, range(20)))
+
+    created = [response for response in responses
+               if response.status_code == http.client.CREATED]
+    assert 8 == len(created)
+    assert 8 == len({response.json['email'] for response in created})
+    for response in responses:
+        if response.status_code != http.client.CREATED:
+            assert http.client.UNPROCESSABLE_ENTITY == response.status_code
+            assert response.json['conflicts']
+
+    app.db.session.remove()
+    assert 8 == PassengerModel.query.count()
+    assert 8 == passenger_facets()['total']
+    assert 8 == len(sent_notifications)
@@ -0,0 +1,422 @@
+import http.client
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event
+
+from taxipassengers_backend.models import (PassengerDailyStatsModel,
+                                           PassengerHourlyStatsModel)
+from taxipassengers_backend.stats import rebuild_stats
+from taxipassengers_backend.timeseries import iso_datetime
+
+
+def daily_stats(day):
+    row = PassengerDailyStatsModel.query.get(day)
+    if row is None:
+        return None
+    return (row.signups, row.suspensions, row.emailVerified,
+            row.phoneVerified)
+
+
+def hourly_stats():
+    return sorted((row.hour, row.suspended, row.emailStatus,
+                   row.phoneNumberStatus, row.signups)
+                  for row in PassengerHourlyStatsModel.query.all()
+                  if row.signups)
+
+
+def test_date_query(app, client, user_header, passenger_fixture):
+    passenger_fixture(timestamp=datetime(2021, 3, 1, 0, 0, 0))
+    passenger_fixture(timestamp=datetime(2021, 3, 1, 23, 59, 59))
+    passenger_fixture(timestamp=datetime(2021, 3, 3, 12, 0, 0))
+    passenger_fixture(timestamp=datetime(2021, 3, 4, 0, 0, 0))
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(app.db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(
+            '/api/stat/datequery/?startdate=01/03/2021&enddate=03/03/2021',
+            headers={'Authorization': user_header})
+    finally:
+        event.remove(app.db.engine, 'before_cursor_execute', record)
+
+    assert http.client.OK == response.status_code
+    assert {
+        '01/03/2021': 2,
+        '02/03/2021': 0,
+        '03/03/2021': 1,
+    } == response.json
+    assert 1 == len(statements)
+
+
+def test_date_query_wrong_range(client, user_header):
+    response = client.get(
+        '/api/stat/datequery/?startdate=03/03/2021&enddate=01/03/2021',
+        headers={'Authorization': user_header})
+    assert http.client.BAD_REQUEST == response.status_code
+
+
+def test_sum_query(client, user_header, passenger_fixture):
+    passenger_fixture(timestamp=datetime(2021, 3, 1, 8, 0, 0))
+    passenger_fixture(timestamp=datetime(2021, 5, 2, 8, 0, 0))
+
+    response = client.get('/api/stat/sumquery/',
+                          headers={'Authorization': user_header})
+    assert http.client.OK == response.status_code
+    assert 2 == response.json
+
+
+def test_month_query(client, user_header, passenger_fixture):
+    passenger_fixture(timestamp=datetime(2021, 3, 1, 8, 0, 0))
+    passenger_fixture(timestamp=datetime(2021, 3, 31, 23, 0, 0))
+    passenger_fixture(timestamp=datetime(2021, 12, 5, 8, 0, 0))
+    passenger_fixture(timestamp=datetime(2022, 1, 1, 0, 0, 0))
+
+    response = client.get('/api/stat/monthquery/?year=2021',
+                          headers={'Authorization': user_header})
+    assert http.client.OK == response.status_code
+    expected = {f'{month}': 0 for month in range(1, 13)}
+    expected.update({'3': 2, '12': 1})
+    assert expected == response.json
+
+
+def test_stats_follow_passenger_changes(app, client, user_header,
+                                        admin_header, sent_notifications):
+    response = client.post('/api/me/passenger/',
+                           data={
+                               'first': 'Ada',
+                               'last': 'Obi',
+                               'dob': '1990-01-01',
+                               'email': 'ada.obi@example.com',
+                               'phone': '08011112222',
+                               'homeLocation': 'Ikeja',
+                           },
+                           headers={'Authorization': user_header})
+    assert http.client.CREATED == response.status_code
+    passenger_id = response.json['id']
+    today = datetime.utcnow().date()
+    assert (1, 0, 1, 0) == daily_stats(today)
+    assert [(0, 1, 0, 1)] == [row[1:] for row in hourly_stats()]
+
+    response = client.put(f'/api/passenger/{passenger_id}/',
+                          data={'suspend': 1, 'phoneNumberStatus': 1},
+                          headers={'Authorization': admin_header})
+    assert http.client.OK == response.status_code
+    assert (1, 1, 1, 1) == daily_stats(today)
+    assert [(1, 1, 1, 1)] == [row[1:] for row in hourly_stats()]
+
+    # Repeating the same update does not count twice
+    response = client.put(f'/api/passenger/{passenger_id}/',
+                          data={'suspend': 1},
+                          headers={'Authorization': admin_header})
+    assert (1, 1, 1, 1) == daily_stats(today)
+
+    response = client.delete(f'/api/passenger/{passenger_id}/',
+                             headers={'Authorization': admin_header})
+    assert http.client.NO_CONTENT == response.status_code
+    assert (0, 0, 0, 0) == daily_stats(today)
+    assert [] == hourly_stats()
+
+
+def test_rebuild_stats(app, passenger_fixture):
+    passenger_fixture(timestamp=datetime(2021, 3, 1, 8, 0, 0),
+                      phoneNumberStatus=1)
+    passenger_fixture(timestamp=datetime(2021, 3, 1, 9, 0, 0),
+                      suspendedAt=datetime(2021, 4, 1), emailStatus=0)
+    passenger_fixture(timestamp=datetime(2021, 3, 2, 8, 0, 0))
+    incremental = {day: daily_stats(day)
+                   for day in (date(2021, 3, 1), date(2021, 3, 2))}
+    incremental_hourly = hourly_stats()
+
+    # Drift, e.g. rows changed outside of the API
+    app.db.session.query(PassengerDailyStatsModel).delete()
+    app.db.session.query(PassengerHourlyStatsModel).delete()
+    app.db.session.commit()
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['stats', 'rebuild'])
+    assert 0 == result.exit_code, result.output
+    assert 'Rebuilt stats for 2 days and 3 hourly rows' in result.output
+
+    assert (2, 1, 1, 1) == daily_stats(date(2021, 3, 1))
+    assert incremental == {day: daily_stats(day)
+                           for day in (date(2021, 3, 1), date(2021, 3, 2))}
+    assert incremental_hourly == hourly_stats()
+    assert (datetime(2021, 3, 1, 9, 0, 0), 1, 0, 0, 1) in hourly_stats()
+    assert (2, 3) == rebuild_stats()
+
+
+def test_stats_cached_until_passenger_write(app, client, user_header,
+                                            admin_header, passenger_fixture):
+    passenger = passenger_fixture(timestamp=datetime(2021, 3, 1, 8, 0, 0))
+    passenger_fixture(timestamp=datetime(2021, 3, 2, 8, 0, 0))
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    url = '/api/stat/datequery/?startdate=01/03/2021&enddate=02/03/2021'
+    event.listen(app.db.engine, 'before_cursor_execute', record)
+    try:
+        for _ in range(3):
+            response = client.get(url, headers={'Authorization': user_header})
+            assert {'01/03/2021': 1, '02/03/2021': 1} == response.json
+    finally:
+        event.remove(app.db.engine, 'before_cursor_execute', record)
+    assert 1 == len(statements)
+
+    response = client.delete(f'/api/passenger/{passenger.id}/',
+                             headers={'Authorization': admin_header})
+    assert http.client.NO_CONTENT == response.status_code
+
+    response = client.get(url, headers={'Authorization': user_header})
+    assert {'01/03/2021': 0, '02/03/2021': 1} == response.json
+
+
+def test_timeseries_days(app, client, user_header, passenger_fixture):
+    passenger_fixture(timestamp=datetime(2021, 3, 1, 8, 0, 0))
+    passenger_fixture(timestamp=datetime(2021, 3, 1, 23, 59, 0))
+    passenger_fixture(timestamp=datetime(2021, 3, 3, 8, 0, 0))
+    passenger_fixture(timestamp=datetime(2021, 3, 4, 0, 0, 0))
+
+    response = client.get(
+        '/api/stat/timeseries/?from=2021-03-01&to=2021-03-04',
+        headers={'Authorization': user_header})
+    assert http.client.OK == response.status_code
+    assert 'day' == response.json['granularity']
+    assert [
+        {'start': '2021-03-01T00:00:00+00:00', 'count': 2},
+        {'start': '2021-03-02T00:00:00+00:00', 'count': 0},
+        {'start': '2021-03-03T00:00:00+00:00', 'count': 1},
+    ] == response.json['buckets']
+
+
+def test_timeseries_time_zone(client, user_header, passenger_fixture):
+    # 00:30 on the 2nd in Lagos
+    passenger_fixture(timestamp=datetime(2021, 3, 1, 23, 30, 0))
+    passenger_fixture(timestamp=datetime(2021, 3, 2, 8, 0, 0))
+
+    response = client.get(
+        '/api/stat/timeseries/?from=2021-03-01&to=2021-03-03'
+        '&tz=Africa/Lagos',
+        headers={'Authorization': user_header})
+    assert http.client.OK == response.status_code
+    assert [
+        {'start': '2021-03-01T00:00:00+01:00', 'count': 0},
+        {'start': '2021-03-02T00:00:00+01:00', 'count': 2},
+    ] == response.json['buckets']
+
+    response = client.get(
+        '/api/stat/timeseries/?from=2021-03-02T00:00&to=2021-03-02T03:00'
+        '&tz=Africa/Lagos&granularity=hour',
+        headers={'Authorization': user_header})
+    assert [1, 0, 0] == [bucket['count']
+                         for bucket in response.json['buckets']]
+
+
+def test_timeseries_without_rollup(client, user_header, passenger_fixture):
+    # 05:00 and 06:00 in Kolkata, half an hour off the UTC hours
+    passenger_fixture(timestamp=datetime(2021, 3, 1, 23, 30, 0))
+    passenger_fixture(timestamp=datetime(2021, 3, 2, 0, 29, 0))
+    passenger_fixture(timestamp=datetime(2021, 3, 2, 0, 30, 0),
+                      suspendedAt=datetime(2021, 3, 5))
+
+    response = client.get(
+        '/api/stat/timeseries/?from=2021-03-02T05:00&to=2021-03-02T07:00'
+        '&tz=Asia/Kolkata&granularity=hour',
+        headers={'Authorization': user_header})
+    assert [
+        {'start': '2021-03-02T05:00:00+05:30', 'count': 2},
+        {'start': '2021-03-02T06:00:00+05:30', 'count': 1},
+    ] == response.json['buckets']
+
+    response = client.get(
+        '/api/stat/timeseries/?from=2021-03-02T05:00&to=2021-03-02T07:00'
+        '&tz=Asia/Kolkata&granularity=hour&status=active',
+        headers={'Authorization': user_header})
+    assert [2, 0] == [bucket['count']
+                      for bucket in response.json['buckets']]
+
+
+def test_timeseries_half_hour_days(client, user_header, passenger_fixture):
+    # 23:30 on the 1st, 00:15 on the 2nd and 01:30 on the 3rd in Kolkata
+    passenger_fixture(timestamp=datetime(2021, 3, 1, 18, 0, 0))
+    passenger_fixture(timestamp=datetime(2021, 3, 1, 18, 45, 0))
+    passenger_fixture(timestamp=datetime(2021, 3, 2, 20, 0, 0))
+
+    # The range is on UTC hours, the days start at 18:30 UTC
+    response = client.get(
+        '/api/stat/timeseries/?from=2021-03-01T05:30&to=2021-03-03T05:30'
+        '&tz=Asia/Kolkata',
+        headers={'Authorization': user_header})
+    assert http.client.OK == response.status_code
+    assert [
+        {'start': '2021-03-01T00:00:00+05:30', 'count': 1},
+        {'start': '2021-03-02T00:00:00+05:30', 'count': 1},
+        {'start': '2021-03-03T00:00:00+05:30', 'count': 1},
+    ] == response.json['buckets']
+
+
+def test_timeseries_weeks_and_months(client, user_header,
+                                     passenger_fixture):
+    passenger_fixture(timestamp=datetime(2021, 3, 1, 8, 0, 0))
+    passenger_fixture(timestamp=datetime(2021, 3, 7, 8, 0, 0))
+    passenger_fixture(timestamp=datetime(2021, 3, 8, 8, 0, 0))
+    passenger_fixture(timestamp=datetime(2021, 4, 30, 8, 0, 0))
+
+    response = client.get(
+        '/api/stat/timeseries/?from=2021-03-01&to=2021-03-15'
+        '&granularity=week',
+        headers={'Authorization': user_header})
+    assert [
+        {'start': '2021-03-01T00:00:00+00:00', 'count': 2},
+        {'start': '2021-03-08T00:00:00+00:00', 'count': 1},
+    ] == response.json['buckets']
+
+    response = client.get(
+        '/api/stat/timeseries/?from=2021-02-01&to=2021-05-01'
+        '&granularity=month',
+        headers={'Authorization': user_header})
+    assert [0, 3, 1] == [bucket['count']
+                         for bucket in response.json['buckets']]
+
+
+def test_timeseries_filters(client, user_header, passenger_fixture):
+    passenger_fixture(timestamp=datetime(2021, 3, 1, 8, 0, 0),
+                      suspendedAt=datetime(2021, 3, 5))
+    passenger_fixture(timestamp=datetime(2021, 3, 1, 9, 0, 0),
+                      phoneNumberStatus=1)
+    passenger_fixture(timestamp=datetime(2021, 3, 1, 10, 0, 0),
+                      emailStatus=0, phoneNumberStatus=1)
+
+    url = '/api/stat/timeseries/?from=2021-03-01&to=2021-03-02'
+    for query, count in (('&status=suspended', 1), ('&status=active', 2),
+                         ('&phoneStatus=verified', 2),
+                         ('&phoneStatus=verified&emailStatus=verified', 1)):
+        response = client.get(url + query,
+                              headers={'Authorization': user_header})
+        assert [count] == [bucket['count']
+                           for bucket in response.json['buckets']]
+
+
+def test_timeseries_bad_arguments(client, user_header):
+    for query in ('from=2021-03-02&to=2021-03-01',
+                  'from=2021-03-01&to=2021-03-02&tz=Mars/Olympus',
+                  'from=2021-03-01&to=2021-03-02&granularity=year',
+                  'from=01/03/2021&to=2021-03-02',
+                  'from=2000-01-01&to=2021-01-01&granularity=hour'):
+        response = client.get(f'/api/stat/timeseries/?{query}',
+                              headers={'Authorization': user_header})
+        assert http.client.BAD_REQUEST == response.status_code, query
+
+
+def test_iso_datetime():
+    assert datetime(2021, 3, 1) == iso_datetime('2021-03-01')
+    assert datetime(2021, 3, 1, 9, 30, 5, 250000) == \
+        iso_datetime('2021-03-01T09:30:05.25')
+    assert datetime(2021, 3, 1, 9, 30, tzinfo=timezone.utc) == \
+        iso_datetime('2021-03-01 09:30Z')
+    west_africa = timezone(timedelta(hours=1))
+    assert datetime(2021, 3, 1, 9, tzinfo=west_africa) == \
+        iso_datetime('2021-03-01T09:00:00+01:00')
+    assert datetime(2021, 3, 1, 9, tzinfo=west_africa) == \
+        iso_datetime('2021-03-01T09:00:00+0100')
+    with pytest.raises(ValueError):
+        iso_datetime('2021-03-01T25:00')
+
+
+def facet_passengers(passenger_fixture):
+    passenger_fixture(lastName='Adeyemi', emailStatus=1, phoneNumberStatus=1)
+    passenger_fixture(lastName='Adewale', emailStatus=0, phoneNumberStatus=1,
+                      suspendedAt=datetime(2021, 3, 5))
+    passenger_fixture(lastName='Okafor', emailStatus=1, phoneNumberStatus=0)
+
+
+def test_facets(app, client, user_header, passenger_fixture):
+    facet_passengers(passenger_fixture)
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(app.db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.get('/api/stat/facets/',
+                              headers={'Authorization': user_header})
+    finally:
+        event.remove(app.db.engine, 'before_cursor_execute', record)
+
+    assert http.client.OK == response.status_code
+    assert {
+        'total': 3,
+        'active': 2,
+        'suspended': 1,
+        'emailVerified': 2,
+        'emailUnverified': 1,
+        'phoneVerified': 2,
+        'phoneUnverified': 1,
+    } == response.json
+    # Added up from the rollup
+    assert 1 == len(statements)
+    assert 'passenger_daily_stats' in statements[0]
+    assert 'passenger_model' not in statements[0]
+
+
+def test_facets_filtered(client, user_header, passenger_fixture):
+    facet_passengers(passenger_fixture)
+
+    response = client.get('/api/stat/facets/?search=adew',
+                          headers={'Authorization': user_header})
+    assert http.client.OK == response.status_code
+    assert {
+        'total': 1,
+        'active': 0,
+        'suspended': 1,
+        'emailVerified': 0,
+        'emailUnverified': 1,
+        'phoneVerified': 1,
+        'phoneUnverified': 0,
+    } == response.json
+
+    response = client.get('/api/stat/facets/?search=ade&status=active',
+                          headers={'Authorization': user_header})
+    assert 1 == response.json['total']
+    assert 1 == response.json['emailVerified']
+
+    response = client.get('/api/stat/facets/?phoneStatus=verified',
+                          headers={'Authorization': user_header})
+    assert 2 == response.json['total']
+    assert 1 == response.json['suspended']
+
+
+def test_facets_search_after_rename(client, user_header, passenger_fixture):
+    facet_passengers(passenger_fixture)
+    # The passenger of the user token
+    okafor = passenger_fixture(authId=1000, lastName='Okonkwo')
+    url = '/api/stat/facets/?search=adew'
+    response = client.get(url, headers={'Authorization': user_header})
+    assert 1 == response.json['total']
+
+    # Only the name changes, not the rollups
+    response = client.patch(f'/api/passenger/{okafor.id}/',
+                            json={'last': 'Adewunmi'},
+                            headers={'Authorization': user_header})
+    assert http.client.OK == response.status_code
+
+    response = client.get(url, headers={'Authorization': user_header})
+    assert 2 == response.json['total']
+
+    response = client.put(f'/api/passenger/{okafor.id}/',
+                          data={'last': 'Okonkwo'},
+                          headers={'Authorization': user_header})
+    assert http.client.OK == response.status_code
+    response = client.get(url, headers={'Authorization': user_header})
+    assert 1 == response.json['total']
+
+
+def test_facets_unauthorized(client):
+    response = client.get('/api/stat/facets/')
+    assert http.client.UNAUTHORIZED == response.status_code
@@ -0,0 +1,37 @@
+import requests
+
+from taxipassengers_backend import task
+from taxipassengers_backend.stub_gateway import stub_gateway
+
+HEADER = {'Authorization': 'Bearer x'}
+
+
+def test_stub_gateway(monkeypatch):
+    with stub_gateway() as url:
+        monkeypatch.setattr(task, 'SMS_BULK_URL', f'{url}api/me/bulk/')
+        response = requests.post(f'{url}api/me/message/', headers=HEADER,
+                                 data={'phoneNumber': '0801'})
+        results = task.post_bulk(task.SMS_BULK_URL, [
+            {'emailAddress': 'ada@example.com'}, {'phoneNumber': '0802'}],
+            HEADER)
+        stats = requests.get(f'{url}stats/').json()
+        cleared = requests.get(f'{url}stats/').json()
+
+    assert 200 == response.status_code
+    assert [{'ok': True, 'status': 200, 'error': None}] * 2 == results
+    assert (2, 3, 0) == (stats['requests'], stats['messages'],
+                         stats['failed'])
+    assert {'0801', '0802', 'ada@example.com'} == set(stats['delivered'])
+    assert 0 == cleared['messages']
+
+
+def test_stub_gateway_errors():
+    with stub_gateway(error_rate=1) as url:
+        response = requests.post(url, data={'phoneNumber': '0801'})
+        bulk = requests.post(f'{url}bulk/', json={'messages': [{}, {}]})
+        invalid = requests.post(f'{url}bulk/', data='not json')
+
+    assert 503 == response.status_code
+    assert [{'ok': False, 'error': 'Unavailable'}] * 2 == \
+        bulk.json()['results']
+    assert 400 == invalid.status_code
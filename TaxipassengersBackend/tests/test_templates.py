@@ -0,0 +1,61 @@
+import os
+import shutil
+
+import pytest
+
+from taxipassengers_backend import utils
+from taxipassengers_backend.templating import (TEMPLATES_PATH, Template,
+                                               TemplateRegistry)
+
+DATA = {'firstName': 'Ada', 'receiverNo': 'Obi', 'pin': '1234',
+        'name': 'Ada'}
+
+
+@pytest.fixture
+def template_dir(tmp_path):
+    path = tmp_path / 'templates'
+    shutil.copytree(TEMPLATES_PATH, path)
+    return path
+
+
+def test_templates_loaded():
+    assert {'email/welcome.html', 'email/cascading_suspend.html',
+            'sms/template.WELCOME_MSG', 'sms/template.SUSPEND_MSG'} <= set(
+        utils.templates.templates)
+
+    message = utils.templates.render('sms/template.SUSPEND_MSG', DATA)
+    assert message.startswith('Hi Ada, you have been temporarily')
+
+    with pytest.raises(KeyError):
+        Template('missing', 'Hi {name}').render({})
+
+
+def test_templates_reload(template_dir):
+    registry = TemplateRegistry(template_dir, reload_interval=0.001)
+    unchecked = TemplateRegistry(template_dir, reload_interval=0)
+    welcome = template_dir / 'email' / 'welcome.html'
+    stat = welcome.stat()
+    welcome.write_text('Hello {firstName}', encoding='utf-8')
+    # The same size and mtime still count as changed
+    os.utime(welcome, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    registry._checked_at = 0
+
+    assert 'Hello Ada' == registry.render('email/welcome.html', DATA)
+
+    # A broken template keeps the previous ones
+    (template_dir / 'sms' / 'template.py').write_text('WELCOME_MSG = (')
+    registry._checked_at = 0
+    assert 'Hello Ada' == registry.render('email/welcome.html', DATA)
+
+    # Without an interval the files are never checked again
+    assert unchecked.render('email/welcome.html', DATA).startswith(
+        '<p>Hi Ada!')
+
+
+def test_render_as_file():
+    # As the template file read and formatted for every message
+    location = TEMPLATES_PATH / 'email' / 'welcome.html'
+    text = location.read_bytes().decode('utf-8')
+
+    assert text.format(**DATA) == \
+        utils.templates.render('email/welcome.html', DATA)
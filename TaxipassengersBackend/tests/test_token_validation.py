@@ -1,4 +1,5 @@
 import delorean
+import jwt
 from freezegun import freeze_time
 from taxipassengers_backend import token as token_validation
 from .constants import PRIVATE_KEY, PUBLIC_KEY
@@ -90,6 +91,17 @@ def test_valid_token_header_invalid_key():
     assert None is result
 
 
+def test_token_header_other_algorithm():
+    payload = {
+        'id': 1,
+        'exp': delorean.Delorean().datetime.timestamp() + 60,
+    }
+    token = jwt.encode(payload, 'secret', algorithm='HS256').decode('utf8')
+    header = f'Bearer {token}'
+    result = token_validation.validate_token_header(header, PUBLIC_KEY)
+    assert None is result
+
+
 def test_valid_token_header():
     payload = {
         'id': 1
@@ -97,3 +109,77 @@ def test_valid_token_header():
     header = token_validation.generate_token_header(payload, PRIVATE_KEY)
     result = token_validation.validate_token_header(header, PUBLIC_KEY)
     assert payload['id'] == result['id']
+
+
+def test_valid_token_header_is_cached():
+    cache = token_validation.TokenCache(maxsize=10)
+    payload = {
+        'id': 1
+    }
+    header = token_validation.generate_token_header(payload, PRIVATE_KEY)
+
+    first = token_validation.validate_token_header(header, PUBLIC_KEY, cache)
+    second = token_validation.validate_token_header(header, PUBLIC_KEY, cache)
+    assert first == second
+    assert 1 == cache.misses
+    assert 1 == cache.hits
+
+
+def test_cached_token_not_valid_for_other_key():
+    cache = token_validation.TokenCache(maxsize=10)
+    payload = {
+        'id': 1
+    }
+    header = token_validation.generate_token_header(payload, PRIVATE_KEY)
+
+    assert token_validation.validate_token_header(header, PUBLIC_KEY, cache)
+    result = token_validation.validate_token_header(header,
+                                                    INVALID_PUBLIC_KEY,
+                                                    cache)
+    assert None is result
+
+
+def test_invalid_token_header_not_cached():
+    cache = token_validation.TokenCache(maxsize=10)
+    header = 'Bearer baddata'
+    token_validation.validate_token_header(header, PUBLIC_KEY, cache)
+    assert 0 == len(cache)
+
+
+def test_cached_token_expires():
+    cache = token_validation.TokenCache(maxsize=10)
+    expiry = delorean.parse('2018-05-17 13:47:40').datetime
+    payload = {
+        'id': 1,
+        'exp': expiry,
+    }
+    token = token_validation.encode_token(payload, PRIVATE_KEY)
+    header = f'Bearer {token.decode("utf8")}'
+
+    with freeze_time('2018-05-17 13:47:34'):
+        assert token_validation.validate_token_header(header, PUBLIC_KEY,
+                                                      cache)
+        assert 1 == len(cache)
+
+    with freeze_time('2018-05-17 13:47:41'):
+        result = token_validation.validate_token_header(header, PUBLIC_KEY,
+                                                        cache)
+        assert None is result
+        assert 0 == len(cache)
+
+
+def test_token_cache_size_limit():
+    cache = token_validation.TokenCache(maxsize=2)
+    headers = [
+        token_validation.generate_token_header({'id': user_id}, PRIVATE_KEY)
+        for user_id in range(3)
+    ]
+    for header in headers:
+        token_validation.validate_token_header(header, PUBLIC_KEY, cache)
+    assert 2 == len(cache)
+
+    # The oldest entry has been evicted
+    token_validation.validate_token_header(headers[0], PUBLIC_KEY, cache)
+    assert 0 == cache.hits
+    token_validation.validate_token_header(headers[2], PUBLIC_KEY, cache)
+    assert 1 == cache.hits
@@ -1,3 +1,8 @@
-set -e
-cd /opt/code/
-celery worker -A celery_worker.celery --loglevel=info
\ No newline at end of file
+set -e
+cd /opt/code/
+# A worker per queue tunes them separately: the queues it consumes, its
+# processes, and the messages reserved per process and when they're acked
+# (CELERY_PREFETCH_MULTIPLIER and CELERY_ACKS_LATE, read by the app)
+celery worker -A celery_worker.celery --loglevel=info \
+    --queues="${CELERY_QUEUES:-celery,sms,email,bulk}" \
+    ${CELERY_CONCURRENCY:+--concurrency="$CELERY_CONCURRENCY"}